@@ -0,0 +1,190 @@
+"""
+Generators of synthetic, large-scale inputs for the partialtesting benchmarks:
+- coverage DBs using the coveragepy schema (file, context, arc, line_bits)
+- test trees defining the tests recorded as contexts in those DBs
+- git repositories with a (large) diff between two branches
+"""
+import os
+import random
+import sqlite3
+import subprocess
+
+SOURCE_ROOT = "/build/workspace/project"
+TESTS_PER_FILE = 20
+HUB_FILES_FRACTION = 0.01  # e.g. core/utils modules that most tests go through
+
+
+def source_file_path(file_index, n_packages):
+    return f"pkg_{file_index % n_packages:04d}/module_{file_index:06d}.py"
+
+
+def test_name(context_index):
+    # zero padded so that no test name is a prefix of another one (grep -f does substring matching)
+    return f"test_case_{context_index:07d}"
+
+
+def test_file_path(context_index, n_packages):
+    file_index = context_index // TESTS_PER_FILE
+    return f"tests/unit/pkg_{file_index % n_packages:04d}/test_module_{file_index:06d}.py"
+
+
+def _covered_files(rng, context_index, n_source_files, n_packages, files_per_context):
+    """
+    Files covered by a test: mostly files of "its" package plus a few hub files
+    """
+    n_hub_files = max(1, int(n_source_files * HUB_FILES_FRACTION))
+    package = (context_index // TESTS_PER_FILE) % n_packages
+    files_in_package = range(package, n_source_files, n_packages)
+
+    covered = set(rng.sample(range(n_hub_files), min(3, n_hub_files)))
+    n_from_package = min(files_per_context, len(files_in_package))
+    covered.update(rng.sample(files_in_package, n_from_package))
+    return covered
+
+
+def generate_coverage_db(
+    db_path,
+    n_source_files,
+    n_contexts,
+    files_per_context=30,
+    arcs_per_file=20,
+    n_packages=100,
+    line_coverage=False,
+    seed=0,
+):
+    """
+    Create a coveragepy-schema DB at db_path with n_contexts test contexts, each
+    one covering ~files_per_context files with arcs_per_file arcs (or one
+    line_bits row) per file.
+    Returns the number of coverage rows that were written.
+    """
+    rng = random.Random(seed)
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    db = sqlite3.connect(db_path)
+    cursor = db.cursor()
+    cursor.execute("PRAGMA journal_mode=OFF")
+    cursor.execute("PRAGMA synchronous=OFF")
+
+    cursor.execute("CREATE TABLE coverage_schema ( version integer );")
+    cursor.execute("INSERT INTO coverage_schema(version) VALUES (7);")
+    cursor.execute(
+        "CREATE TABLE meta ( key text, value text, unique (key) );"
+    )
+    cursor.execute(
+        "CREATE TABLE file ( id integer primary key, path text, unique(path) );"
+    )
+    cursor.execute(
+        "CREATE TABLE context ( id integer primary key, context text, unique(context) );"
+    )
+    cursor.execute(
+        "CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer, unique(file_id, context_id, fromno, tono) );"
+    )
+    cursor.execute(
+        "CREATE TABLE line_bits ( file_id integer, context_id integer, numbits blob, unique(file_id, context_id) );"
+    )
+    cursor.execute("CREATE TABLE tracer ( file_id integer primary key, tracer text );")
+
+    cursor.executemany(
+        "INSERT INTO file(id, path) VALUES (?, ?)",
+        (
+            (file_index + 1, f"{SOURCE_ROOT}/{source_file_path(file_index, n_packages)}")
+            for file_index in range(n_source_files)
+        ),
+    )
+    cursor.execute("INSERT INTO context(id, context) VALUES (?, ?)", (0, ""))
+    cursor.executemany(
+        "INSERT INTO context(id, context) VALUES (?, ?)",
+        ((context_index + 1, test_name(context_index)) for context_index in range(n_contexts)),
+    )
+
+    def _rows():
+        for context_index in range(n_contexts):
+            covered = _covered_files(
+                rng, context_index, n_source_files, n_packages, files_per_context
+            )
+            for file_index in covered:
+                if line_coverage:
+                    yield (file_index + 1, context_index + 1, b"\xff" * 8)
+                else:
+                    for arc in range(arcs_per_file):
+                        yield (file_index + 1, context_index + 1, arc, arc + 1)
+
+    if line_coverage:
+        sql = "INSERT INTO line_bits(file_id, context_id, numbits) VALUES (?, ?, ?)"
+    else:
+        sql = "INSERT INTO arc(file_id, context_id, fromno, tono) VALUES (?, ?, ?, ?)"
+    cursor.executemany(sql, _rows())
+    n_rows = cursor.execute(
+        f"SELECT count(*) FROM {'line_bits' if line_coverage else 'arc'}"
+    ).fetchone()[0]
+
+    db.commit()
+    db.close()
+    return n_rows
+
+
+def generate_test_tree(root_dir, n_contexts, n_packages=100):
+    """
+    Write the test files that define every test recorded in a generated coverage DB
+    """
+    test_files = {}
+    for context_index in range(n_contexts):
+        test_files.setdefault(test_file_path(context_index, n_packages), []).append(
+            test_name(context_index)
+        )
+
+    for path, names in test_files.items():
+        full_path = os.path.join(root_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.writelines(f"def {name}():\n    assert True\n\n\n" for name in names)
+
+    return len(test_files)
+
+
+def _git(repo_dir, *args):
+    subprocess.run(
+        ["git", *args],
+        cwd=repo_dir,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def generate_git_repo(repo_dir, n_source_files, n_changed_files, n_packages=100, base_branch="master"):
+    """
+    Create a git repo containing n_source_files source files committed to
+    base_branch, plus a 'feature' branch (checked out) that modifies
+    n_changed_files of them.
+    Returns the paths of the changed files.
+    """
+    os.makedirs(repo_dir, exist_ok=True)
+    _git(repo_dir, "init", "-q")
+    _git(repo_dir, "checkout", "-q", "-b", base_branch)
+    _git(repo_dir, "config", "user.email", "bench@partialtesting")
+    _git(repo_dir, "config", "user.name", "partialtesting benchmarks")
+
+    for file_index in range(n_source_files):
+        path = os.path.join(repo_dir, source_file_path(file_index, n_packages))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"def function_{file_index}():\n    return {file_index}\n")
+    _git(repo_dir, "add", "-A")
+    _git(repo_dir, "commit", "-q", "-m", "base")
+
+    _git(repo_dir, "checkout", "-q", "-b", "feature")
+    step = max(1, n_source_files // max(1, n_changed_files))
+    changed_files = [
+        source_file_path(file_index, n_packages)
+        for file_index in range(0, n_source_files, step)
+    ][:n_changed_files]
+    for path in changed_files:
+        with open(os.path.join(repo_dir, path), "a") as f:
+            f.write("\n# changed\n")
+    _git(repo_dir, "commit", "-q", "-a", "-m", "change")
+
+    return changed_files
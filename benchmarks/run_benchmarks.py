@@ -0,0 +1,163 @@
+"""
+Time every phase of partialtesting.detect_relevant_tests separately on
+synthetic, large-scale data and compare the timings with recorded baselines.
+
+    python -m benchmarks.run_benchmarks --scale small
+    python -m benchmarks.run_benchmarks --scale large --record
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+from benchmarks import generate_data
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_index import TestDefinitionIndex
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# realistic scale is 'large': 20k source files, 200k test contexts, ~300M arc rows
+SCALES = {
+    "tiny": dict(n_source_files=200, n_contexts=1000, files_per_context=5, arcs_per_file=5, n_changed_files=20),
+    "small": dict(n_source_files=2000, n_contexts=20000, files_per_context=10, arcs_per_file=10, n_changed_files=200),
+    "medium": dict(n_source_files=10000, n_contexts=100000, files_per_context=20, arcs_per_file=20, n_changed_files=1000),
+    "large": dict(n_source_files=20000, n_contexts=200000, files_per_context=40, arcs_per_file=40, n_changed_files=5000),
+}
+N_LOOKUP_FILES = 50  # changed files looked up in the coverage DB, includes hub files
+MIN_REGRESSION_SECONDS = 0.05  # ignore noise in phases that only take a few milliseconds
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """
+    Run func 'repeat' times and return (best time in seconds, last result)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmarks(work_dir, scale, repeat=3):
+    """
+    Generate the data for the given scale under work_dir and time each phase.
+    Returns {phase_name: seconds}
+    """
+    params = SCALES[scale]
+    repo_dir = os.path.join(work_dir, "repo")
+    db_path = os.path.join(work_dir, pt.COVERAGE_FILE)
+
+    logging.info(f"Generating data for scale '{scale}': {params}")
+    n_rows = generate_data.generate_coverage_db(
+        db_path,
+        params["n_source_files"],
+        params["n_contexts"],
+        files_per_context=params["files_per_context"],
+        arcs_per_file=params["arcs_per_file"],
+    )
+    changed_files = generate_data.generate_git_repo(
+        repo_dir, params["n_source_files"], params["n_changed_files"]
+    )
+    n_test_files = generate_data.generate_test_tree(repo_dir, params["n_contexts"])
+    logging.info(
+        f"Generated {n_rows} arc rows, {n_test_files} test files, {len(changed_files)} changed files"
+    )
+
+    timings = {}
+    previous_cwd = os.getcwd()
+    os.chdir(repo_dir)
+    try:
+        timings["git_diff_namestatus"], _ = best_of(
+            repeat, pt.git_diff_namestatus, "master"
+        )
+
+        lookup_files = changed_files[:N_LOOKUP_FILES]
+
+        def _lookup_all():
+            test_names = []
+            for changed_file in lookup_files:
+                test_names.extend(pt.get_tests_that_use_file(changed_file, db_path))
+            return test_names
+
+        timings["get_tests_that_use_file"], test_names = best_of(repeat, _lookup_all)
+
+        timings["get_test_files_for_test_names"], test_files = best_of(
+            repeat, pt.get_test_files_for_test_names, set(test_names)
+        )
+
+        timings["load_test_definition_index"], test_index = best_of(
+            repeat, TestDefinitionIndex.load, pt.TESTS_DIR
+        )
+        timings["test_files_for_test_names_from_index"], _ = best_of(
+            repeat, test_index.test_files_for_test_names, set(test_names)
+        )
+
+        output_file = os.path.join(work_dir, pt.TEST_FILES_TO_RUN_ALL_STAGES)
+        timings["write_file_of_test_files_to_run"], _ = best_of(
+            repeat, pt.write_file_of_test_files_to_run, test_files, output_file
+        )
+    finally:
+        os.chdir(previous_cwd)
+
+    return timings
+
+
+def find_regressions(timings, baselines, tolerance):
+    """
+    Return the phases whose timing is more than 'tolerance' (0.5 = 50%) slower than their baseline
+    (and at least MIN_REGRESSION_SECONDS slower)
+    """
+    regressions = {}
+    for phase, seconds in timings.items():
+        baseline = baselines.get(phase)
+        if baseline is None:
+            continue
+        if seconds > baseline * (1 + tolerance) and seconds - baseline > MIN_REGRESSION_SECONDS:
+            regressions[phase] = (baseline, seconds)
+    return regressions
+
+
+@click.command()
+@click.option("--scale", type=click.Choice(list(SCALES)), default="small", help="Size of the generated data. Default: small")
+@click.option("--repeat", default=3, help="Times each phase is run, the best time is kept. Default: 3")
+@click.option("--tolerance", default=0.5, help="Allowed slowdown over the baseline (0.5 = 50%). Default: 0.5")
+@click.option("--record", is_flag=True, help="Record the timings as the new baselines for this scale")
+@click.option("--work-dir", default=None, help="Where to generate the data. Default: a temporary directory")
+def main(scale, repeat, tolerance, record, work_dir):
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    with tempfile.TemporaryDirectory(prefix="pt_bench") as tmp_dir:
+        timings = run_benchmarks(work_dir or tmp_dir, scale, repeat)
+
+    baselines = {}
+    if os.path.isfile(BASELINES_FILE):
+        with open(BASELINES_FILE) as f:
+            baselines = json.load(f)
+
+    for phase, seconds in timings.items():
+        baseline = baselines.get(scale, {}).get(phase)
+        click.echo(f"{phase:35} {seconds:10.4f}s  (baseline: {baseline})")
+
+    if record:
+        baselines[scale] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+        with open(BASELINES_FILE, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write("\n")
+        click.echo(f"Recorded baselines for scale '{scale}' in {BASELINES_FILE}")
+        return
+
+    regressions = find_regressions(timings, baselines.get(scale, {}), tolerance)
+    for phase, (baseline, seconds) in regressions.items():
+        click.secho(f"Regression in {phase}: {seconds:.4f}s vs baseline {baseline:.4f}s", fg="red")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
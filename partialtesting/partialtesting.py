@@ -1,14 +1,51 @@
+import concurrent.futures
 import configparser
+import json
 import logging
 import os
 import sqlite3
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 from enum import Enum
 
 import click
 
+from partialtesting.partialtesting_ast import (
+    WORKING_TREE,
+    read_sources,
+    semantically_unchanged_paths,
+)
+from partialtesting.partialtesting_cache import (
+    DEFAULT_MAX_SIZE_MB,
+    ResultCache,
+    coverage_build_id,
+    selection_cache_key,
+)
+from partialtesting.partialtesting_db import close_connections, get_connection
+from partialtesting.partialtesting_deps import (
+    changed_distributions,
+    is_dependency_file,
+    load_distributions_map,
+    tests_using_distributions,
+)
+from partialtesting.partialtesting_groups import covered_files_by_test_file, group_names, group_test_files
+from partialtesting.partialtesting_history import CoFailureModel
+from partialtesting.partialtesting_index import (
+    TestDefinitionIndex,
+    find_reverse_index,
+    get_test_func_name,
+    get_tests_that_use_file_from_index,
+)
+from partialtesting.partialtesting_metrics import Metrics, write_metrics
+from partialtesting.partialtesting_monorepo import ProjectGraph
+from partialtesting.partialtesting_native import is_native_source, native_source_map, python_importers
+from partialtesting.partialtesting_resources import ResourceRules
+from partialtesting.partialtesting_results import Footprints, TestResultCache, drop_cached_passes
+from partialtesting.partialtesting_rules import FileClass, Rules, load_rules
+
 
 class FileStatus(Enum):
     ADDED = 1
@@ -59,8 +96,12 @@ NO_TESTS_EXTENSIONS = [".md", ".rst", ".tex", ".txt"]
 TEST_FILES_TO_RUN_ALL_STAGES = "test_files_to_run.txt"
 TEST_STAGES = ["unit", "integration", "integration_db"]
 COVERAGE_FILE = ".coverage"
+# commit (sha) the coverage data of a build was recorded at, next to its .coverage
+BUILD_COMMIT_FILE = "commit"
 CONFIG_FILE = "~/.partialtesting"
 DEFAULT_BRANCH_TO_COMPARE = "origin/master"
+DEFAULT_MAX_WORKERS = 8
+TESTS_DIR = "tests"
 
 
 class File:
@@ -77,7 +118,9 @@ class File:
         self.new_path = new_path  # for renamed files
         self.status = map_git_status(status)
 
-    def is_test_file(self):
+    def is_test_file(self, rules=None):
+        if rules is not None:
+            return rules.is_test_file(self.path)
         return self.path.startswith("tests/")
 
     def __repr__(self):
@@ -109,15 +152,59 @@ class Project:
         self.coverage_db_path = f"{build_path}{build_number}/{COVERAGE_FILE}"
         logging.info(f"Partial Testing: using coverage file '{self.coverage_db_path}'")
 
+        # limit on the number of tests selected before falling back to a full test
+        self.context_budget = None
+        # per-test imported distributions, see partialtesting_deps
+        self.distributions_map = None
+        # file -> tests posting lists of this build, see partialtesting_index
+        self.reverse_index_path = None
+
+
+class SelectionTooLarge(Exception):
+    """
+    Raised when a selection grows over its ContextBudget:
+    running a full test is cheaper than resolving it
+    """
+
+
+class ContextBudget:
+    """
+    Maximum number of distinct contexts (test names) that the coverage
+    lookups of a selection may fetch. Shared by concurrent lookups.
+    """
+
+    def __init__(self, max_contexts):
+        self.max_contexts = max_contexts
+        self.exceeded = False
+        self._contexts = set()
+        self._lock = threading.Lock()
+
+    def add(self, context):
+        with self._lock:
+            if not self.exceeded:
+                self._contexts.add(context)
+                if len(self._contexts) > self.max_contexts:
+                    self.exceeded = True
+                    self._contexts = set()  # not needed anymore, free it
+
+            if self.exceeded:
+                raise SelectionTooLarge(
+                    f"more than {self.max_contexts} tests would be selected"
+                )
+
 
 def run_sh_cmd(command_and_params):
     """
     run a shell command and return the std output
     """
     logging.info(f"Partial Testing: Running: {command_and_params}")
+    start = time.perf_counter()
     result = subprocess.run(
         command_and_params, stdout=subprocess.PIPE, stderr=subprocess.PIPE
     )
+    logging.debug(
+        f"Partial Testing: '{command_and_params[0]}' took {time.perf_counter() - start:.3f}s"
+    )
     stdout = result.stdout.decode("utf-8")
     stderr = result.stderr.decode("utf-8")
     return stdout, stderr
@@ -162,7 +249,34 @@ def connect_to_db(coverage_db_path):
     return db, db.cursor()
 
 
-def get_tests_that_use_file(changed_file, coverage_db_path, line_coverage=False):
+def warm_up_db(coverage_db_path):
+    """
+    Open the (pooled) connection to the coverage DB and read its (small)
+    file and context tables, so that their pages are already cached when
+    the lookups start
+    """
+    db = get_connection(coverage_db_path)
+    db.execute("select count(*) from file").fetchone()
+    db.execute("select count(*) from context").fetchone()
+
+
+def resolve_project(project_name, coverage_dir, line_coverage=False, build_number="", warm_up=True):
+    """
+    Find the coverage data of a project (the latest build unless build_number is given)
+    and, if warm_up, warm up its DB
+    """
+    project_data = Project(project_name, coverage_dir, build_number, line_coverage)
+    project_data.reverse_index_path = find_reverse_index(
+        f"{coverage_dir}/{project_name}", coverage_build_id(project_data.coverage_db_path)
+    )
+    if project_data.reverse_index_path is not None:
+        logging.info(f"Partial Testing: using reverse index '{project_data.reverse_index_path}'")
+    elif warm_up:
+        warm_up_db(project_data.coverage_db_path)
+    return project_data
+
+
+def get_tests_that_use_file(changed_file, coverage_db_path, line_coverage=False, budget=None):
     """
     SQL query based on:
     https://nedbatchelder.com/blog/201810/who_tests_what_is_here.html
@@ -172,6 +286,9 @@ def get_tests_that_use_file(changed_file, coverage_db_path, line_coverage=False)
 
     The check to filter out empty contexts is based on:
     https://github.com/nedbat/coveragepy/issues/796
+
+    Rows are consumed as they are streamed from the DB. If a ContextBudget is
+    given, SelectionTooLarge is raised as soon as the selection exceeds it
     """
     test_names = []
 
@@ -182,16 +299,43 @@ select distinct context.context from {cov_table}, file, context \
 where {cov_table}.file_id = file.id and {cov_table}.context_id = context.id and \
 file.path like ? and context.context != '' \
 """
-    db, cursor = connect_to_db(coverage_db_path)
+    # read-only, immutable and reused across calls, see partialtesting_db
+    cursor = get_connection(coverage_db_path).execute(sql_query, (f"%{changed_file}", ))
 
-    cursor.execute(sql_query, (f"%{changed_file}", ))
-
-    for row in cursor.fetchall():
+    for row in cursor:
+        if budget is not None:
+            budget.add(row[0])
         test_names.append(row[0])
 
     return test_names
 
 
+def count_known_tests(coverage_db_path):
+    """
+    Number of tests (non empty contexts) recorded in the coverage DB
+    """
+    cursor = get_connection(coverage_db_path).execute(
+        "select count(*) from context where context != ''"
+    )
+    return cursor.fetchone()[0]
+
+
+def get_context_budget(project_data, max_contexts=None, max_selected_percent=None):
+    """
+    The ContextBudget for a selection: at most max_contexts tests and/or
+    at most max_selected_percent of the tests known by the coverage data.
+    None when there is no limit
+    """
+    limits = []
+    if max_contexts:
+        limits.append(max_contexts)
+    if max_selected_percent:
+        known_tests = count_known_tests(project_data.coverage_db_path)
+        limits.append(int(known_tests * max_selected_percent / 100))
+
+    return ContextBudget(min(limits)) if limits else None
+
+
 def get_test_files_for_test_names(test_names, tests_dir="tests"):
     """
     Given a set of test names, find the test files in which they are defined
@@ -201,15 +345,8 @@ def get_test_files_for_test_names(test_names, tests_dir="tests"):
     # https://unix.stackexchange.com/questions/288757/why-does-grep-sometimes-return-directories-with-two-slashes
     tests_dir = tests_dir.rstrip("/")
 
-    def _get_test_func_name(test_name):
-        if "." in test_name:
-            # fully qualified test name in the newest coverage (version >= v5.0a6)
-            # https://github.com/nedbat/coveragepy/commit/a9f5f7fadacaa8a84b4ac247e79bcb6f29935bb1
-            return test_name.rpartition(".")[2]
-        return test_name
-
     # Write test function names to a file grep can use as patterns
-    test_func_names = (_get_test_func_name(test_name) for test_name in test_names)
+    test_func_names = (get_test_func_name(test_name) for test_name in test_names)
     with tempfile.NamedTemporaryFile(
         mode="wt", prefix="pt_grep_patterns", delete=False
     ) as grep_patterns_f:
@@ -255,13 +392,25 @@ def parse_git_diff_name_status(git_output):
     return files
 
 
+def git_merge_base(compare_to_branch=DEFAULT_BRANCH_TO_COMPARE):
+    """
+    Return the commit (sha) in which HEAD branched off from compare_to_branch
+    """
+    git_merge_out, _ = run_sh_cmd(["git", "merge-base", "HEAD", compare_to_branch])
+    return git_merge_out.splitlines()[0]
+
+
+def git_head_commit():
+    git_out, _ = run_sh_cmd(["git", "rev-parse", "HEAD"])
+    return git_out.splitlines()[0]
+
+
 def git_diff_namestatus(compare_to_branch=DEFAULT_BRANCH_TO_COMPARE):
     """
     Used when running partial_testing in jenkins.
     'git diff' is done using the changes that were committed to the branch
     """
-    git_merge_out, _ = run_sh_cmd(["git", "merge-base", "HEAD", compare_to_branch])
-    git_merge_base_commit = git_merge_out.splitlines()[0]
+    git_merge_base_commit = git_merge_base(compare_to_branch)
     git_diff_output, _ = run_sh_cmd(
         ["git", "diff", "--name-status", f"{git_merge_base_commit}..HEAD"]
     )
@@ -277,6 +426,57 @@ def git_diff_uncommitted(compare_to_branch=DEFAULT_BRANCH_TO_COMPARE):
     return git_diff_output
 
 
+def read_build_commits(project_dir):
+    """
+    {commit: build directory} of the builds that recorded their commit,
+    the latest build of a commit wins
+    """
+    builds = []
+    for name in os.listdir(project_dir):
+        commit_file = os.path.join(project_dir, name, BUILD_COMMIT_FILE)
+        if name.startswith(".") or not os.path.isfile(commit_file):
+            continue
+        with open(commit_file) as f:
+            builds.append((os.path.getmtime(os.path.join(project_dir, name)), f.read().strip(), name))
+
+    return {commit: name for _, commit, name in sorted(builds)}
+
+
+def nearest_commit_with_build(build_commits, revision):
+    """
+    First commit with a build found walking the ancestors of revision (itself included)
+    with a single 'git rev-list', stopped as soon as it is found. None if there is none
+    """
+    process = subprocess.Popen(
+        ["git", "rev-list", revision], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        for line in process.stdout:
+            commit = line.decode("utf-8").strip()
+            if commit in build_commits:
+                return commit
+    finally:
+        process.kill()
+        process.wait()
+    return None
+
+
+def find_build_for_merge_base(project_name, coverage_dir, compare_to_branch):
+    """
+    The build recorded at the nearest ancestor of the merge-base of HEAD and
+    compare_to_branch: diffing against its commit matches the coverage data exactly.
+    Returns (build directory, commit), (None, None) if no build recorded an ancestor
+    """
+    build_commits = read_build_commits(f"{coverage_dir}/{project_name}")
+    if not build_commits:
+        return None, None
+
+    commit = nearest_commit_with_build(build_commits, git_merge_base(compare_to_branch))
+    if commit is None:
+        return None, None
+    return build_commits[commit], commit
+
+
 def detect_changed_files(git_diff_use_head, compare_to_branch):
 
     if git_diff_use_head:
@@ -339,57 +539,113 @@ def modified_file_with_special_or_unknown_extension(modified_files, special_exte
     return False
 
 
-def full_test_required(nontest_files, test_files, special_files, special_extensions):
+def full_test_required(nontest_files, test_files, special_files, special_extensions, rules=None):
     """
     Determine weather we need to run a full test or not.
     Read possible scenarios in http://docs/core/services/partial_testing/
+
+    Each file is classified once by the compiled rules (see partialtesting_rules),
+    which default to special_files/special_extensions and the known extensions
     """
+    if rules is None:
+        rules = Rules.from_defaults(special_files, special_extensions)
 
-    if new_nontest_code_file_added(nontest_files):
-        logging.info(
-            "Partial Testing: New nontest files were added, a full test is required"
-        )
-        return True
+    nontest_paths = {file.path for file in nontest_files}
 
-    if modified_special_file(nontest_files + test_files, special_files):
-        logging.info(
-            "Partial Testing: a special file was modified, a full test is required"
-        )
-        return True
+    for file in nontest_files + test_files:
+        file_class = rules.classify(file.path)
 
-    if modified_file_with_special_or_unknown_extension(
-        nontest_files + test_files, special_extensions
-    ):
-        logging.info(
-            "Partial Testing: a file with a special/unknown extension was modified, a full test is required"
-        )
-        return True
+        if file_class == FileClass.SPECIAL:
+            logging.info(
+                f"Partial Testing: a special file was modified: {file.path}, a full test is required"
+            )
+            return True
+
+        if file_class == FileClass.UNKNOWN:
+            logging.info(
+                f"Partial Testing: a file with an unknown type was modified: {file.path}, a full test is required"
+            )
+            return True
+
+        if (
+            file_class == FileClass.CODE
+            and file.status == FileStatus.ADDED
+            and file.path in nontest_paths
+        ):
+            logging.info(
+                f"Partial Testing: a nontest file was added: {file.path}, a full test is required"
+            )
+            return True
 
     return False
 
 
-def identify_tests_related_to_modified_files(modified_files, project_data):
+def identify_tests_related_to_modified_files(modified_files, project_data, executor=None):
     """
     Given a list of files that have been modified or deleted,
     check which tests use them and return the files they are in
+
+    If an executor is given, the files are looked up concurrently
     """
 
-    all_test_names = []
-    for file in modified_files:
-        test_names = get_tests_that_use_file(file.path, project_data.coverage_db_path, project_data.line_coverage)
+    def _lookup(file):
+        test_names = None
+        index_path = project_data.reverse_index_path
+        if index_path is not None:
+            try:
+                test_names = get_tests_that_use_file_from_index(
+                    file.path, index_path, project_data.context_budget
+                )
+            except (FileNotFoundError, sqlite3.OperationalError) as e:
+                # a writer deleted the generation since it was resolved (see update_reverse_index),
+                # the current one indexes a newer build: use the coverage DB of this build
+                logging.warning(f"Partial Testing: not using the reverse index '{index_path}'. Reason: {e}")
+                project_data.reverse_index_path = None
+        if test_names is None:
+            test_names = get_tests_that_use_file(
+                file.path,
+                project_data.coverage_db_path,
+                project_data.line_coverage,
+                project_data.context_budget,
+            )
         logging.debug(f"Partial Testing: file '{file}' triggers test: '{test_names}'")
+        return test_names
+
+    lookups = executor.map(_lookup, modified_files) if executor else map(_lookup, modified_files)
+
+    all_test_names = []
+    for test_names in lookups:
         all_test_names.extend(test_names)
 
     return all_test_names
 
 
-def identify_files_to_test_for_modified_files(modified_files, project_data):
+def identify_files_to_test_for_modified_files(
+    modified_files, project_data, metrics=None, test_index=None, executor=None, extra_test_names=()
+):
     """
     Given a list of files that have been modified or deleted,
     check which tests use them and return the files they are in
+
+    test_index: TestDefinitionIndex (or a Future still loading it) used to find
+    the test files instead of grep
+    extra_test_names: tests selected by other means (e.g. changed dependencies)
     """
-    test_names = identify_tests_related_to_modified_files(modified_files, project_data)
-    test_files = get_test_files_for_test_names(test_names)
+    metrics = metrics or Metrics()
+
+    with metrics.phase("db_lookup"):
+        test_names = identify_tests_related_to_modified_files(modified_files, project_data, executor)
+    metrics.count("contexts_fetched", len(test_names))
+    test_names = set(test_names) | set(extra_test_names)
+
+    with metrics.phase("test_file_resolution"):
+        if isinstance(test_index, concurrent.futures.Future):
+            test_index = test_index.result()
+
+        if test_index is not None:
+            test_files = test_index.test_files_for_test_names(test_names)
+        else:
+            test_files = get_test_files_for_test_names(test_names)
 
     return test_files
 
@@ -415,17 +671,25 @@ def identify_files_to_test_for_testfiles(test_files):
     return files_to_test
 
 
-def separate_test_files(diff_files):
+def separate_test_files(diff_files, rules=None):
 
     nontest_files = []
     test_files = []
     for file in diff_files:
-        test_files.append(file) if file.is_test_file() else nontest_files.append(file)
+        test_files.append(file) if file.is_test_file(rules) else nontest_files.append(file)
 
     return nontest_files, test_files
 
 
-def identify_files_to_test(nontest_files, test_files, project_data):
+def identify_files_to_test(
+    nontest_files,
+    test_files,
+    project_data,
+    metrics=None,
+    test_index=None,
+    executor=None,
+    extra_test_names=(),
+):
     """
     given a list of of files that have been added/deleted/modified
     identify what tests if any need to be run
@@ -435,7 +699,7 @@ def identify_files_to_test(nontest_files, test_files, project_data):
     # because a file under tests/ might be a utility file that is imported
     # in other test files
     files_to_test_1 = identify_files_to_test_for_modified_files(
-        nontest_files + test_files, project_data
+        nontest_files + test_files, project_data, metrics, test_index, executor, extra_test_names
     )
     files_to_test_2 = identify_files_to_test_for_testfiles(test_files)
 
@@ -466,6 +730,19 @@ def detect_relevant_tests(
     output_file=TEST_FILES_TO_RUN_ALL_STAGES,
     compare_to_branch=DEFAULT_BRANCH_TO_COMPARE,
     line_coverage=False,
+    metrics_file=None,
+    result_cache_dir=None,
+    result_cache_max_size_mb=DEFAULT_MAX_SIZE_MB,
+    max_contexts=None,
+    max_selected_percent=None,
+    skip_non_semantic_changes=False,
+    test_result_cache_dir=None,
+    build_from_merge_base=False,
+    history_file=None,
+    history_defer_below=None,
+    group_workers=None,
+    manifest_file=None,
+    build_number="",
 ):
     """
     For a change set (defined by git diff), determine which tests need to be run.
@@ -475,31 +752,1020 @@ def detect_relevant_tests(
     b) set() -> no tests need to be run (empty set)
     c) {'tests/unit/test_file_1.py', 'tests/unit/test_file_2.py'}
         -> run tests within the mentioned files
+
+    If metrics_file is given, the time spent in each phase and some counts
+    are written to it (see partialtesting_metrics.Metrics.write)
+
+    If result_cache_dir is given, results for committed changes
+    (git_diff_use_head) are cached there, keyed by coverage build and
+    merge-base/HEAD commits, so that re-running the same selection
+    (CI retries, multi-stage pipelines) does not hit SQLite or grep again
+
+    If max_contexts and/or max_selected_percent (of the tests known by the
+    coverage data) are given, a full test is done as soon as the selection
+    grows over them, e.g. when a core module changed
+
+    If skip_non_semantic_changes, modified .py files whose AST did not change
+    (only comments, formatting, docstrings or annotations) are ignored
+
+    If test_result_cache_dir is given, the selected test files whose tests all
+    passed already with the same content of every file they cover and the same
+    environment (see partialtesting_results) are not written to output_file
+
+    If build_from_merge_base, the coverage build recorded at the nearest ancestor
+    of the merge-base is used (see find_build_for_merge_base) instead of the latest
+    one, and the changes are found against its commit
+
+    If history_file is given, the co-failure model trained on past CI runs
+    (see partialtesting_history) adds the test files that historically failed
+    with the changed files. If history_defer_below is given too, the selected
+    test files whose estimated risk is lower are written to
+    deferred_output_file(output_file) instead of output_file
+
+    If group_workers is given, the selected test files are also split into that
+    many groups of test files covering the same files (see partialtesting_groups
+    and write_test_groups())
+
+    If manifest_file is given, the stages and resources (e.g. a database) the
+    selection needs are written to it (see write_manifest())
+
+    If build_number is given, that coverage build is used instead of the latest
+    one (e.g. to replay past merges, see partialtesting_replay)
     """
+    metrics = Metrics(labels={"project": project_name})
+    history = None
+    if history_file:
+        try:
+            history = CoFailureModel.load(history_file)
+        except Exception as e:
+            logging.warning(f"Partial Testing: not using the co-failure model. Reason: {e}")
+    result_cache = None
+    if result_cache_dir and git_diff_use_head:
+        if history is not None and history_defer_below is not None:
+            # a cached selection would not come with its deferred test files
+            logging.info("Partial Testing: the result cache is not used when deferring tests")
+        else:
+            result_cache = ResultCache(result_cache_dir, result_cache_max_size_mb)
+    test_result_cache = None
+    if test_result_cache_dir:
+        test_result_cache = TestResultCache(test_result_cache_dir, result_cache_max_size_mb)
+
+    try:
+        files_to_test = _detect_relevant_tests(
+            project_name,
+            coverage_dir,
+            git_diff_use_head,
+            special_files,
+            special_extensions,
+            output_file,
+            compare_to_branch,
+            line_coverage,
+            metrics,
+            result_cache,
+            max_contexts,
+            max_selected_percent,
+            skip_non_semantic_changes,
+            test_result_cache,
+            build_from_merge_base,
+            history,
+            history_defer_below,
+            group_workers,
+            build_number,
+        )
+        if manifest_file:
+            write_manifest(files_to_test, manifest_file)
+    finally:
+        close_connections()
+        if metrics_file:
+            metrics.write(metrics_file)
 
+    return files_to_test
+
+
+def _detect_relevant_tests(
+    project_name,
+    coverage_dir,
+    git_diff_use_head,
+    special_files,
+    special_extensions,
+    output_file,
+    compare_to_branch,
+    line_coverage,
+    metrics,
+    result_cache=None,
+    max_contexts=None,
+    max_selected_percent=None,
+    skip_non_semantic_changes=False,
+    test_result_cache=None,
+    build_from_merge_base=False,
+    history=None,
+    history_defer_below=None,
+    group_workers=None,
+    build_number="",
+):
+    """
+    The selection runs in lazy stages, the coverage data (shared storage)
+    is only touched when a lookup is actually needed:
+    1) git diff (while the test definition index loads) and classification
+    2) early exit when a full test is required or when none of the changed
+       files is a code file (e.g. docs only changes)
+    3) coverage build resolution, result cache and concurrent DB lookups
+    """
     try:
-        project_data = Project(project_name, coverage_dir, line_coverage=line_coverage)
+        rules = load_rules(special_files, special_extensions)
+    except Exception as e:
+        logging.error(
+            f"Partial Testing: could not read the project rules. A full test will be done. Reason: {e}"
+        )
+        metrics.count("full_test", 1)
+        return None
+
+    if build_from_merge_base:
+        with metrics.phase("build_selection"):
+            try:
+                build, build_commit = find_build_for_merge_base(
+                    project_name, coverage_dir, compare_to_branch
+                )
+            except Exception as e:
+                logging.warning(f"Partial Testing: could not match a build with the merge-base. Reason: {e}")
+                build = None
+        if build is None:
+            logging.info("Partial Testing: no build recorded at an ancestor of the merge-base, using the latest one")
+        else:
+            logging.info(f"Partial Testing: using build {build} recorded at {build_commit}")
+            # the merge-base of HEAD and an ancestor is that ancestor
+            build_number, compare_to_branch = build, build_commit
+
+    stop_loading = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+
+    try:
+        changes_future = executor.submit(
+            _timed, metrics, "git_diff", detect_changed_files, git_diff_use_head, compare_to_branch
+        )
+        test_index_future = executor.submit(
+            _timed, metrics, "test_index", TestDefinitionIndex.load, rules.test_dirs(), stop_loading
+        )
+
+        try:
+            changed_files = changes_future.result()
+        except Exception as e:
+            logging.error(
+                f"Partial Testing: could not find the changed files. A full test will be done. Reason: {e}"
+            )
+            metrics.count("full_test", 1)
+            return None
+
+        project_data = None
+        distributions = set()
+        dependency_changes = find_dependency_only_changes(
+            changed_files, git_diff_use_head, compare_to_branch, metrics, rules
+        )
+        if dependency_changes:
+            # the distributions map is recorded with the coverage build
+            project_data = _resolve_project_or_none(
+                project_name, coverage_dir, line_coverage, metrics, build_number
+            )
+            if project_data is None:
+                return None
+            changed_files, distributions = apply_dependency_changes(
+                changed_files, dependency_changes, project_data
+            )
+            if distributions is None:
+                metrics.count("full_test", 1)
+                return None
+
+        if project_data is None and any(is_native_source(file.path) for file in changed_files):
+            # native sources no Python file imports are looked up in the coverage data
+            project_data = _resolve_project_or_none(
+                project_name, coverage_dir, line_coverage, metrics, build_number
+            )
+            if project_data is None:
+                return None
+
+        rules, native_importers = resolve_native_sources(
+            changed_files, rules, metrics, project_data.coverage_db_path if project_data else None
+        )
+        nontest_files, test_files, full_test = classify_changed_files(
+            changed_files, special_files, special_extensions, metrics, rules
+        )
+
+        if full_test:
+            # a full test is needed, do not write partial testing instructions
+            logging.info(f"Partial Testing: a full test is required")
+            metrics.count("full_test", 1)
+            return None
+
+        if skip_non_semantic_changes:
+            nontest_files, test_files = drop_non_semantic_changes(
+                nontest_files, test_files, git_diff_use_head, compare_to_branch, metrics, rules
+            )
+
+        if not coverage_lookup_required(nontest_files, test_files, rules) and not distributions:
+            logging.info(
+                "Partial Testing: no code files were changed, the coverage data is not needed"
+            )
+            stop_loading.set()
+            return select_tests_without_coverage(test_files, output_file, metrics)
+
+        nontest_files, test_files = expand_native_sources(nontest_files, test_files, native_importers, rules)
+
+        if project_data is None:
+            project_data = _resolve_project_or_none(
+                project_name, coverage_dir, line_coverage, metrics, build_number
+            )
+            if project_data is None:
+                return None
+
+        cache_key = None
+        if result_cache is not None:
+            with metrics.phase("result_cache"):
+                try:
+                    cache_key = get_selection_cache_key(
+                        project_data,
+                        special_files,
+                        special_extensions,
+                        compare_to_branch,
+                        max_contexts,
+                        max_selected_percent,
+                        rules,
+                        skip_non_semantic_changes,
+                        test_result_cache is not None,
+                        history,
+                    )
+                    hit, files_to_test = result_cache.get(cache_key)
+                except Exception as e:
+                    logging.warning(f"Partial Testing: not using the result cache. Reason: {e}")
+                    hit = False
+            metrics.count("result_cache_hit", int(hit))
+            if hit:
+                metrics.count("full_test", int(files_to_test is None))
+                if files_to_test is not None:
+                    metrics.count("tests_selected", len(files_to_test))
+                    write_file_of_test_files_to_run(files_to_test, output_file)
+                    if group_workers:
+                        write_test_groups(
+                            files_to_test, project_data, test_index_future, group_workers, output_file, metrics
+                        )
+                return files_to_test
+
+        if not _prepare_lookups(project_data, max_contexts, max_selected_percent, metrics):
+            return None
+
+        try:
+            files_to_test = select_tests_for_project(
+                project_data,
+                nontest_files,
+                test_files,
+                output_file,
+                metrics,
+                test_index_future,
+                executor,
+                tests_for_distributions(project_data, distributions, metrics),
+                test_result_cache,
+                history,
+                history_defer_below,
+            )
+        except SelectionTooLarge as e:
+            logging.info(f"Partial Testing: {e}, a full test is required")
+            metrics.count("selection_cutoff", 1)
+            metrics.count("full_test", 1)
+            files_to_test = None
+
+        if cache_key is not None:
+            result_cache.put(cache_key, files_to_test)
+
+        if group_workers and files_to_test is not None:
+            write_test_groups(files_to_test, project_data, test_index_future, group_workers, output_file, metrics)
+
+        return files_to_test
+    finally:
+        stop_loading.set()
+        executor.shutdown(wait=True)
+
+
+def _resolve_project_or_none(project_name, coverage_dir, line_coverage, metrics, build_number=""):
+    """
+    Resolve the coverage build of the project, None (a full test) if it cannot be accessed.
+    Its DB is not opened yet, see _prepare_lookups()
+    """
+    try:
+        with metrics.phase("build_resolution"):
+            project_data = resolve_project(project_name, coverage_dir, line_coverage, build_number, warm_up=False)
     except Exception as e:
         logging.error(
             f"Partial Testing: could not access the project's information. A full test will be done. Reason: {e}"
         )
+        metrics.count("full_test", 1)
         return None
 
-    nontest_files, test_files = separate_test_files(
-        detect_changed_files(git_diff_use_head, compare_to_branch)
+    return project_data
+
+
+def _prepare_lookups(project_data, max_contexts, max_selected_percent, metrics):
+    """
+    Warm up the coverage DB and set the context budget once the lookups are
+    certain to happen (e.g. not on a result cache hit). False (a full test) on errors
+    """
+    try:
+        with metrics.phase("build_resolution"):
+            if project_data.reverse_index_path is None:
+                warm_up_db(project_data.coverage_db_path)
+            project_data.context_budget = get_context_budget(
+                project_data, max_contexts, max_selected_percent
+            )
+    except Exception as e:
+        logging.error(
+            f"Partial Testing: could not access the project's information. A full test will be done. Reason: {e}"
+        )
+        metrics.count("full_test", 1)
+        return False
+
+    return True
+
+
+def _timed(metrics, phase, func, *args):
+    with metrics.phase(phase):
+        return func(*args)
+
+
+def get_selection_cache_key(
+    project_data,
+    special_files,
+    special_extensions,
+    compare_to_branch,
+    max_contexts=None,
+    max_selected_percent=None,
+    rules=None,
+    skip_non_semantic_changes=False,
+    test_result_cache=False,
+    history=None,
+):
+    """
+    Key for the result cache: coverage build + change set + classification config.
+    It does not read the coverage DB, so that a hit never opens it
+    """
+    config = {
+        "max_contexts": max_contexts,
+        "max_selected_percent": max_selected_percent,
+        "special_files": sorted(special_files),
+        "special_extensions": sorted(special_extensions),
+        "code_extensions": CODE_EXTENSIONS,
+        "no_tests_extensions": NO_TESTS_EXTENSIONS,
+        "line_coverage": project_data.line_coverage,
+        "rules": rules.to_dict() if rules is not None else None,
+        "skip_non_semantic_changes": skip_non_semantic_changes,
+        "test_result_cache": test_result_cache,
+        "history": history.fingerprint() if history is not None else None,
+    }
+    return selection_cache_key(
+        coverage_build_id(project_data.coverage_db_path),
+        git_merge_base(compare_to_branch),
+        git_head_commit(),
+        config,
     )
 
-    if full_test_required(nontest_files, test_files, special_files, special_extensions):
-        # a full test is needed, do not write partial testing instructions
-        logging.info(f"Partial Testing: a full test is required")
-        return None
 
-    files_to_test = identify_files_to_test(nontest_files, test_files, project_data)
-    write_file_of_test_files_to_run(files_to_test, output_file)
+def resolve_native_sources(changed_files, rules, metrics, coverage_db_path=None):
+    """
+    Native (C/C++/Cython) sources compiled into Python extension modules
+    (see partialtesting_native.native_source_map) become code files: their
+    tests are the ones using the Python files importing those extension
+    modules, or covering the source itself (e.g. Cython's coverage plugin) when
+    coverage_db_path is given. Native sources that cannot be mapped, or whose
+    extension modules are neither imported nor covered, still require a full test.
+    Returns (rules, {native source: [Python files importing its extension modules]})
+    """
+    native_paths = [file.path for file in changed_files if is_native_source(file.path)]
+    if not native_paths:
+        return rules, {}
+
+    with metrics.phase("native_sources"):
+        source_map = native_source_map()
+        modules = {path: source_map[path] for path in native_paths if path in source_map}
+        if not modules:
+            return rules, {}
+
+        importers = python_importers(set().union(*modules.values()))
+        native_importers = {
+            path: sorted({importer for module in path_modules for importer in importers[module]})
+            for path, path_modules in modules.items()
+        }
+        native_importers = {
+            path: path_importers
+            for path, path_importers in native_importers.items()
+            if path_importers or (coverage_db_path and is_recorded(path, coverage_db_path))
+        }
+        if not native_importers:
+            return rules, {}
+
+    logging.info(f"Partial Testing: native sources and the Python files using them {native_importers}")
+    return rules.with_code_paths(sorted(native_importers)), native_importers
+
+
+def is_recorded(path, coverage_db_path):
+    """
+    Did the coverage data record a file ending with path?
+    """
+    db = get_connection(coverage_db_path)
+    return db.execute("SELECT 1 FROM file WHERE path LIKE ? LIMIT 1", (f"%{path}",)).fetchone() is not None
+
+
+def expand_native_sources(nontest_files, test_files, native_importers, rules=None):
+    """
+    Add the Python files importing the extension modules built from the changed native sources:
+    the test files importing them are run directly, the other files are looked up in the coverage data.
+    Returns (nontest_files, test_files)
+    """
+    expanded_nontest_files = list(nontest_files)
+    expanded_test_files = list(test_files)
+    for file in nontest_files:
+        for path in native_importers.get(file.path, ()):
+            importer = File(path, "M")
+            if importer.is_test_file(rules):
+                expanded_test_files.append(importer)
+            else:
+                expanded_nontest_files.append(importer)
+    return expanded_nontest_files, expanded_test_files
+
+
+def classify_changed_files(changed_files, special_files, special_extensions, metrics, rules=None):
+    """
+    Split the changed files into non-test and test files and check
+    whether they require a full test.
+    Returns (nontest_files, test_files, full_test_required)
+    """
+    metrics.count("changed_files", len(changed_files))
+
+    with metrics.phase("classification"):
+        nontest_files, test_files = separate_test_files(changed_files, rules)
+        full_test = full_test_required(
+            nontest_files, test_files, special_files, special_extensions, rules
+        )
+
+    return nontest_files, test_files, full_test
+
+
+def diff_revisions(git_diff_use_head, compare_to_branch):
+    """
+    The two ends of the diff (see detect_changed_files): (merge-base, HEAD) for
+    committed changes, (compare_to_branch, working tree) for uncommitted ones
+    """
+    if git_diff_use_head:
+        return git_merge_base(compare_to_branch), "HEAD"
+    return compare_to_branch, WORKING_TREE
+
+
+def find_dependency_only_changes(changed_files, git_diff_use_head, compare_to_branch, metrics, rules=None):
+    """
+    Dependency files (setup.py, setup.cfg, requirements and lock files) in which
+    only the dependencies changed, e.g. a version bump. The files matching the
+    special patterns of the project-level rules file are left out: they require
+    a full test whatever changed in them.
+    Returns {path: {changed distributions}}
+    """
+    paths = [
+        file.path
+        for file in changed_files
+        if file.status in (FileStatus.ADDED, FileStatus.MODIFIED, FileStatus.DELETED)
+        and is_dependency_file(file.path, rules)
+        and not (rules is not None and rules.is_project_special(file.path))
+    ]
+    if not paths:
+        return {}
+
+    dependency_changes = {}
+    with metrics.phase("dependency_diff"):
+        try:
+            sources = read_sources(paths, *diff_revisions(git_diff_use_head, compare_to_branch))
+        except Exception as e:
+            logging.warning(f"Partial Testing: not comparing the dependencies. Reason: {e}")
+            return {}
+
+        for path, (old_content, new_content) in sources.items():
+            distributions = changed_distributions(path, old_content, new_content)
+            if distributions is not None:
+                logging.info(f"Partial Testing: only dependencies changed in {path}: {sorted(distributions)}")
+                dependency_changes[path] = distributions
+
+    return dependency_changes
+
+
+def apply_dependency_changes(changed_files, dependency_changes, project_data):
+    """
+    When the coverage build has a distributions map (see partialtesting_deps),
+    the dependency files that only changed dependencies are replaced by the
+    distributions that changed. Otherwise they are classified as usual.
+    The map only knows the distributions the covered files import directly:
+    when a changed distribution is not in it (a transitive dependency, a pytest
+    plugin, etc.), the tests using it are unknown and distributions is None (a full test).
+    Returns (changed_files, distributions)
+    """
+    project_data.distributions_map = load_distributions_map(project_data.coverage_db_path)
+    if project_data.distributions_map is None:
+        logging.info(
+            "Partial Testing: no distributions map recorded for the coverage build, dependency files are handled as usual"
+        )
+        return changed_files, set()
+
+    distributions = set().union(*dependency_changes.values())
+    unknown = distributions - set().union(*project_data.distributions_map.values())
+    if unknown:
+        logging.info(
+            f"Partial Testing: no test imported the changed distributions {sorted(unknown)}, a full test is required"
+        )
+        return changed_files, None
+
+    changed_files = [file for file in changed_files if file.path not in dependency_changes]
+    return changed_files, distributions
+
+
+def tests_for_distributions(project_data, distributions, metrics):
+    """
+    Tests (contexts) that imported any of the distributions during the master run
+    """
+    if not distributions:
+        return set()
+
+    test_names = tests_using_distributions(project_data.distributions_map, distributions)
+    metrics.count("distribution_tests", len(test_names))
+    if project_data.context_budget is not None:
+        for test_name in test_names:
+            project_data.context_budget.add(test_name)
+
+    return test_names
+
+
+def drop_non_semantic_changes(
+    nontest_files, test_files, git_diff_use_head, compare_to_branch, metrics, rules=None
+):
+    """
+    Remove the modified .py files whose code did not change once comments,
+    formatting, docstrings and annotations are ignored (AST comparison of
+    the merge-base and HEAD versions, or of compare_to_branch and the working
+    tree for uncommitted changes). Returns (nontest_files, test_files)
+    """
+    candidates = [
+        file.path
+        for file in nontest_files + test_files
+        if file.status == FileStatus.MODIFIED
+        and file.path.endswith(".py")
+        and (rules is None or rules.classify(file.path) == FileClass.CODE)
+    ]
+    if not candidates:
+        return nontest_files, test_files
+
+    with metrics.phase("ast_comparison"):
+        try:
+            unchanged = semantically_unchanged_paths(
+                candidates, *diff_revisions(git_diff_use_head, compare_to_branch)
+            )
+        except Exception as e:
+            logging.warning(f"Partial Testing: not comparing the ASTs. Reason: {e}")
+            unchanged = set()
+    metrics.count("non_semantic_changes", len(unchanged))
+
+    return (
+        [file for file in nontest_files if file.path not in unchanged],
+        [file for file in test_files if file.path not in unchanged],
+    )
+
+
+def coverage_lookup_required(nontest_files, test_files, rules=None):
+    """
+    The coverage data only needs to be looked up if a code file changed.
+    Files with unknown extensions already require a full test, so the
+    rest are non-code files (e.g. .md) that no test depends on
+    """
+    if rules is None:
+        return any(is_code_file(file.path) for file in nontest_files + test_files)
+    return any(rules.classify(file.path) == FileClass.CODE for file in nontest_files + test_files)
+
+
+def select_tests_without_coverage(test_files, output_file, metrics):
+    """
+    Select the tests when no coverage lookup is required: only the changed
+    test files themselves (see identify_files_to_test_for_testfiles)
+    """
+    metrics.count("full_test", 0)
+    files_to_test = set(identify_files_to_test_for_testfiles(test_files))
+    metrics.count("tests_selected", len(files_to_test))
+
+    with metrics.phase("output"):
+        write_file_of_test_files_to_run(files_to_test, output_file)
 
     return files_to_test
 
 
+def select_tests_for_project(
+    project_data,
+    nontest_files,
+    test_files,
+    output_file,
+    metrics,
+    test_index=None,
+    executor=None,
+    extra_test_names=(),
+    test_result_cache=None,
+    history=None,
+    history_defer_below=None,
+):
+    """
+    Find the tests of a project to run for changes that do not require a full test
+    and write them to output_file
+    """
+    metrics.count("full_test", 0)
+    files_to_test = identify_files_to_test(
+        nontest_files, test_files, project_data, metrics, test_index, executor, extra_test_names
+    )
+    if history is not None:
+        files_to_test = apply_history(
+            files_to_test, nontest_files, test_files, history, history_defer_below, output_file, metrics
+        )
+    if test_result_cache is not None and files_to_test:
+        files_to_test = skip_cached_passes(files_to_test, project_data, test_index, test_result_cache, metrics)
+    metrics.count("tests_selected", len(files_to_test))
+
+    with metrics.phase("output"):
+        write_file_of_test_files_to_run(files_to_test, output_file)
+
+    return files_to_test
+
+
+def apply_history(files_to_test, nontest_files, test_files, history, defer_below, output_file, metrics):
+    """
+    Add the test files that historically failed with the changed files
+    (see partialtesting_history.CoFailureModel). If defer_below is given, the
+    test files with a lower risk are written to deferred_output_file(output_file)
+    and dropped, except for the changed test files and the ones just added
+    """
+    with metrics.phase("history"):
+        changed_paths = [file.path for file in nontest_files + test_files]
+        changed_paths += [file.new_path for file in nontest_files + test_files if file.new_path]
+
+        added = {
+            test_file
+            for test_file in history.cofailing_tests(changed_paths)
+            if test_file not in files_to_test and os.path.isfile(test_file)
+        }
+        for test_file in sorted(added):
+            logging.info(f"Partial Testing: {test_file} historically fails with these changes, adding it")
+        files_to_test = files_to_test | added
+
+        deferred = set()
+        if defer_below is not None:
+            kept = added | set(identify_files_to_test_for_testfiles(test_files))
+            deferred = {
+                test_file
+                for test_file in files_to_test - kept
+                if history.risk(test_file, changed_paths) < defer_below
+            }
+            write_file_of_test_files_to_run(deferred, deferred_output_file(output_file))
+
+    metrics.count("history_added", len(added))
+    metrics.count("history_deferred", len(deferred))
+    return files_to_test - deferred
+
+
+def write_test_groups(files_to_test, project_data, test_index, workers, output_file, metrics):
+    """
+    Split the selected test files into groups of test files covering the same
+    files (see partialtesting_groups), so that the modules they import and
+    the fixtures they share are only set up once per worker:
+    - groups_output_file(output_file): {test file: group name} for the
+    xdist_group marker (pytest -n <workers> --dist loadgroup)
+    - worker_output_file(output_file, n): the test files of the n-th group
+    The selection itself is not affected by any error
+    """
+    with metrics.phase("grouping"):
+        try:
+            if isinstance(test_index, concurrent.futures.Future):
+                test_index = test_index.result()
+            if test_index is None:
+                test_index = TestDefinitionIndex.load()
+            groups = group_test_files(
+                covered_files_by_test_file(project_data.coverage_db_path, files_to_test, test_index), workers
+            )
+        except Exception as e:
+            logging.warning(f"Partial Testing: could not group the selected tests. Reason: {e}")
+            return None
+
+        groups_file = groups_output_file(output_file)
+        with open(groups_file, "w") as f:
+            logging.info(f"Creating file {groups_file}")
+            json.dump(group_names(groups), f, indent=4, sort_keys=True)
+        for worker in range(workers):
+            write_file_of_test_files_to_run(
+                groups[worker] if worker < len(groups) else [], worker_output_file(output_file, worker)
+            )
+
+    metrics.count("test_groups", len(groups))
+    return groups
+
+
+def skip_cached_passes(files_to_test, project_data, test_index, test_result_cache, metrics):
+    """
+    Drop the test files whose tests all passed already on the same footprint
+    (see partialtesting_results), the selection is kept as is on any error
+    """
+    with metrics.phase("test_result_cache"):
+        try:
+            if isinstance(test_index, concurrent.futures.Future):
+                test_index = test_index.result()
+            if test_index is None:
+                test_index = TestDefinitionIndex.load()
+            footprints = Footprints(project_data.coverage_db_path, test_index)
+            files_to_run = drop_cached_passes(files_to_test, footprints, test_result_cache)
+        except Exception as e:
+            logging.warning(f"Partial Testing: not using the test result cache. Reason: {e}")
+            return files_to_test
+
+    metrics.count("cached_passes", len(files_to_test) - len(files_to_run))
+    return files_to_run
+
+
+def discover_projects(coverage_dir):
+    """
+    Every directory under coverage_dir is considered a project
+    holding coverage data: <coverage_dir>/<project_name>
+    """
+    return sorted(
+        name
+        for name in os.listdir(coverage_dir)
+        if not name.startswith(".") and os.path.isdir(os.path.join(coverage_dir, name))
+    )
+
+
+def project_output_file(output_file, project_name):
+    """
+    test_files_to_run.txt -> test_files_to_run_<project_name>.txt
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_{project_name}{ext}"
+
+
+def deferred_output_file(output_file):
+    """
+    test_files_to_run.txt -> test_files_to_run_deferred.txt
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_deferred{ext}"
+
+
+def groups_output_file(output_file):
+    return f"{os.path.splitext(output_file)[0]}_groups.json"
+
+
+def worker_output_file(output_file, worker):
+    """
+    test_files_to_run.txt -> test_files_to_run_worker_<worker>.txt
+    """
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_worker_{worker}{ext}"
+
+
+def summary_output_file(output_file):
+    return f"{os.path.splitext(output_file)[0]}_summary.json"
+
+
+def detect_relevant_tests_for_projects(
+    project_names,
+    coverage_dir,
+    git_diff_use_head,
+    special_files=SPECIAL_FILES_DEFAULT,
+    special_extensions=SPECIAL_EXTENSIONS_DEFAULT,
+    output_file=TEST_FILES_TO_RUN_ALL_STAGES,
+    compare_to_branch=DEFAULT_BRANCH_TO_COMPARE,
+    line_coverage=False,
+    metrics_file=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    max_contexts=None,
+    max_selected_percent=None,
+    skip_non_semantic_changes=False,
+    manifest_file=None,
+):
+    """
+    Same as detect_relevant_tests() for many projects (e.g. a monorepo) at once.
+    git diff and the classification of the changed files are only done once, then
+    the coverage data of each project is looked up concurrently.
+    The changes to a project installed into other ones (see partialtesting_monorepo)
+    are also looked up in the coverage data of the projects depending on it.
+
+    Each project gets its own output file (see project_output_file()) and a
+    summary of all of them is written as JSON (see summary_output_file()):
+    {"<project_name>": {"full_test": bool, "test_files": [...]}, ...}
+    and, if manifest_file is given, a manifest per project (see write_manifest()
+    and project_output_file())
+
+    Returns {project_name: result} where result follows detect_relevant_tests()
+    """
+    metrics = Metrics(labels={"project": "all"})
+    projects_metrics = {name: Metrics(labels={"project": name}) for name in project_names}
+
+    try:
+        try:
+            rules = load_rules(special_files, special_extensions)
+            project_graph = ProjectGraph.load()
+        except Exception as e:
+            logging.error(
+                f"Partial Testing: could not read the project rules. A full test of every project will be done. Reason: {e}"
+            )
+            rules = None
+
+        if rules is None:
+            results = {name: None for name in project_names}
+        else:
+            results = _select_tests_for_projects(
+                project_names,
+                coverage_dir,
+                git_diff_use_head,
+                special_files,
+                special_extensions,
+                output_file,
+                compare_to_branch,
+                line_coverage,
+                max_workers,
+                max_contexts,
+                max_selected_percent,
+                skip_non_semantic_changes,
+                rules,
+                project_graph,
+                metrics,
+                projects_metrics,
+            )
+
+        write_summary_of_projects(results, summary_output_file(output_file))
+        if manifest_file:
+            resource_rules = ResourceRules.load(TEST_STAGES)
+            for name, files_to_test in results.items():
+                write_manifest(files_to_test, project_output_file(manifest_file, name), resource_rules)
+    finally:
+        close_connections()
+        if metrics_file:
+            all_metrics = [metrics] + list(projects_metrics.values())
+            write_metrics(
+                metrics_file,
+                {"runs": [project_metrics.to_dict() for project_metrics in all_metrics]},
+                all_metrics,
+            )
+
+    return results
+
+
+def _select_tests_for_projects(
+    project_names,
+    coverage_dir,
+    git_diff_use_head,
+    special_files,
+    special_extensions,
+    output_file,
+    compare_to_branch,
+    line_coverage,
+    max_workers,
+    max_contexts,
+    max_selected_percent,
+    skip_non_semantic_changes,
+    rules,
+    project_graph,
+    metrics,
+    projects_metrics,
+):
+    """
+    git diff and classification once, then the coverage lookups of every project
+    concurrently. {project_name: None} (a full test) if the changed files cannot be found
+    """
+    stop_loading = threading.Event()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the test definitions are shared by all projects, load them while git diff runs
+        test_index_future = executor.submit(
+            _timed, metrics, "test_index", TestDefinitionIndex.load, rules.test_dirs(), stop_loading
+        )
+
+        try:
+            with metrics.phase("git_diff"):
+                changed_files = detect_changed_files(git_diff_use_head, compare_to_branch)
+        except Exception as e:
+            logging.error(
+                f"Partial Testing: could not find the changed files. A full test of every project will be done. Reason: {e}"
+            )
+            stop_loading.set()
+            return {name: None for name in project_names}
+
+        rules, native_importers = resolve_native_sources(changed_files, rules, metrics)
+        nontest_files, test_files, full_test = classify_changed_files(
+            changed_files, special_files, special_extensions, metrics, rules
+        )
+        if skip_non_semantic_changes and not full_test:
+            nontest_files, test_files = drop_non_semantic_changes(
+                nontest_files, test_files, git_diff_use_head, compare_to_branch, metrics, rules
+            )
+
+        if full_test or not coverage_lookup_required(nontest_files, test_files, rules):
+            stop_loading.set()
+        nontest_files, test_files = expand_native_sources(nontest_files, test_files, native_importers, rules)
+        upstream_changes = project_graph.upstream_changes(nontest_files)
+
+        if full_test:
+            logging.info("Partial Testing: a full test is required for all projects")
+            return {name: None for name in project_names}
+
+        futures = {
+            name: executor.submit(
+                _select_tests_for_project_name,
+                name,
+                coverage_dir,
+                line_coverage,
+                nontest_files,
+                test_files,
+                project_output_file(output_file, name),
+                projects_metrics[name],
+                test_index_future,
+                max_contexts,
+                max_selected_percent,
+                rules,
+                project_graph,
+                upstream_changes,
+            )
+            for name in project_names
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def _select_tests_for_project_name(
+    project_name,
+    coverage_dir,
+    line_coverage,
+    nontest_files,
+    test_files,
+    output_file,
+    metrics,
+    test_index=None,
+    max_contexts=None,
+    max_selected_percent=None,
+    rules=None,
+    project_graph=None,
+    upstream_changes=None,
+):
+    try:
+        if not coverage_lookup_required(nontest_files, test_files, rules):
+            return select_tests_without_coverage(test_files, output_file, metrics)
+
+        with metrics.phase("build_resolution"):
+            project_data = resolve_project(project_name, coverage_dir, line_coverage)
+            project_data.context_budget = get_context_budget(
+                project_data, max_contexts, max_selected_percent
+            )
+        if upstream_changes:
+            with metrics.phase("upstream_changes"):
+                upstream_files = project_graph.files_to_look_up(
+                    project_name, project_data.coverage_db_path, upstream_changes
+                )
+            metrics.count("upstream_files", len(upstream_files))
+            nontest_files = nontest_files + upstream_files
+        return select_tests_for_project(
+            project_data, nontest_files, test_files, output_file, metrics, test_index
+        )
+    except SelectionTooLarge as e:
+        logging.info(f"Partial Testing: {e}, a full test of {project_name} is required")
+        metrics.count("selection_cutoff", 1)
+        metrics.count("full_test", 1)
+        return None
+    except Exception as e:
+        logging.error(
+            f"Partial Testing: could not select the tests of {project_name}. A full test will be done. Reason: {e}"
+        )
+        metrics.count("full_test", 1)
+        return None
+
+
+def write_summary_of_projects(results, summary_file):
+    summary = {
+        name: {
+            "full_test": files_to_test is None,
+            "test_files": sorted(files_to_test) if files_to_test is not None else [],
+        }
+        for name, files_to_test in results.items()
+    }
+    with open(summary_file, "w") as f:
+        logging.info(f"Creating file {summary_file}")
+        json.dump(summary, f, indent=4, sort_keys=True)
+
+
+def write_manifest(files_to_test, manifest_file, resource_rules=None):
+    """
+    Write which stages (TEST_STAGES) and resources (the [resources] and
+    [resource_markers] of the project rules, see partialtesting_resources)
+    the selection needs, so that CI only provisions those.
+    A full test (None) needs all of them
+    """
+    if resource_rules is None:
+        resource_rules = ResourceRules.load(TEST_STAGES)
+    with open(manifest_file, "w") as f:
+        logging.info(f"Creating file {manifest_file}")
+        json.dump(resource_rules.manifest(files_to_test), f, indent=4, sort_keys=True)
+
+
 def str_to_list(strlist):
     """
     Given the string "[file1, file2]" from a Jenkins job (groovy) return the list ["file1", "file2"]
@@ -510,6 +1776,27 @@ def str_to_list(strlist):
     return result
 
 
+def get_coverage_dir(coverage_dir):
+    """
+    Return the given coverage_dir or, if it was not provided,
+    the one set in ~/.partialtesting. Exit if neither is available
+    """
+    if coverage_dir:
+        return coverage_dir
+
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser(CONFIG_FILE))
+    try:
+        return config["coverage"]["dir"]
+    except KeyError:
+        click.secho(
+            "No coverage_directory provided.\n"
+            "Please set it via --coverage-dir or ~/.partialtesting\n"
+            "See --help for more information\n"
+        )
+        sys.exit(1)
+
+
 @click.command()
 @click.option(
     "--coverage-dir",
@@ -519,10 +1806,22 @@ def str_to_list(strlist):
 )
 @click.option(
     "--project-name",
-    required=True,
+    multiple=True,
     help=f"Project name (e.g. numpy)."
     "The name will be used to get the path to the coverage data "
-    "for this project:\n<coverage_dir>/<project_name>/.../.coverage\n",
+    "for this project:\n<coverage_dir>/<project_name>/.../.coverage\n"
+    "Can be repeated to select the tests of many projects at once, each one "
+    "gets its own output file: <output_file>_<project_name>.txt",
+)
+@click.option(
+    "--all-projects",
+    is_flag=True,
+    help="Select the tests of every project found under <coverage_dir>",
+)
+@click.option(
+    "--max-workers",
+    default=DEFAULT_MAX_WORKERS,
+    help=f"Projects whose coverage data is looked up concurrently. Default: {DEFAULT_MAX_WORKERS}",
 )
 @click.option(
     "--git-diff-use-head",
@@ -559,8 +1858,97 @@ def str_to_list(strlist):
     help=f"If recording line coverage instead of "
     "branch coverage (coverage run --branch) ",
 )
+@click.option(
+    "--metrics-file",
+    default=None,
+    help="Write the time spent in each phase and other metrics as JSON to this "
+    "file, and in the Prometheus textfile format next to it (.prom extension)",
+)
+@click.option(
+    "--result-cache-dir",
+    default=None,
+    help="Cache selection results in this directory (local or on the shared coverage dir) "
+    "and reuse them when running again for the same HEAD and coverage build. "
+    "Only used with --git-diff-use-head",
+)
+@click.option(
+    "--result-cache-max-size",
+    default=DEFAULT_MAX_SIZE_MB,
+    help=f"Maximum size (MB) of the result cache and of the test result cache, "
+    f"least recently used entries are evicted first. Default: {DEFAULT_MAX_SIZE_MB}",
+)
+@click.option(
+    "--max-contexts",
+    default=None,
+    type=int,
+    help="Do a full test instead when more than this number of tests "
+    "would be selected (stops looking up the coverage data as soon as it is reached)",
+)
+@click.option(
+    "--max-selected-percent",
+    default=None,
+    type=float,
+    help="Do a full test instead when more than this percentage of the tests "
+    "known by the coverage data would be selected",
+)
+@click.option(
+    "--skip-non-semantic-changes",
+    is_flag=True,
+    help="Ignore modified .py files whose code did not change once comments, "
+    "formatting, docstrings and annotations are ignored (AST comparison)",
+)
+@click.option(
+    "--test-result-cache-dir",
+    default=None,
+    help="Skip the selected test files whose tests all passed already with the same "
+    "content of every file they cover and the same environment, as recorded in this "
+    "directory by partialtesting-record-results",
+)
+@click.option(
+    "--build-from-merge-base",
+    is_flag=True,
+    help="Use the coverage build recorded at the nearest ancestor of the merge-base "
+    "(see partialtesting-publish --commit) instead of the latest build, "
+    "and find the changes against its commit",
+)
+@click.option(
+    "--history-file",
+    default=None,
+    help="Co-failure model trained on past CI runs by partialtesting-train-history: "
+    "also select the test files that historically failed when the changed files changed",
+)
+@click.option(
+    "--history-defer-below",
+    default=None,
+    type=float,
+    help="With --history-file, write the selected test files whose estimated risk of failing "
+    "is lower than this (0-1) to <output_file>_deferred.txt instead of <output_file>",
+)
+@click.option(
+    "--group-workers",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Also split the selected test files into this many groups of test files covering "
+    "the same files: <output_file>_groups.json (for pytest --dist loadgroup) "
+    "and one <output_file>_worker_<n>.txt per group",
+)
+@click.option(
+    "--manifest-file",
+    default=None,
+    help=f"Write which stages ({', '.join(TEST_STAGES)}) and resources (see [resources] "
+    "in the project rules) the selection needs as JSON to this file, "
+    "one per project (<manifest_file>_<project_name>.json) for many projects",
+)
+@click.option(
+    "--log-level",
+    default="DEBUG",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: DEBUG",
+)
 def main(
     project_name,
+    all_projects,
+    max_workers,
     coverage_dir,
     git_diff_use_head,
     special_files,
@@ -568,6 +1956,19 @@ def main(
     output_file,
     compare_to_branch,
     line_coverage,
+    metrics_file,
+    result_cache_dir,
+    result_cache_max_size,
+    max_contexts,
+    max_selected_percent,
+    skip_non_semantic_changes,
+    test_result_cache_dir,
+    build_from_merge_base,
+    history_file,
+    history_defer_below,
+    group_workers,
+    manifest_file,
+    log_level,
 ):
     """
     Partial Testing (PT) identifies which tests need to be run for a given
@@ -583,28 +1984,53 @@ def main(
     More information available at
     github.com/man-group/partialtesting/blob/master/README.md
     """
-    config = configparser.ConfigParser()
-    config.read(os.path.expanduser(CONFIG_FILE))
-    if not coverage_dir:
-        try:
-            coverage_dir = config["coverage"]["dir"]
-        except KeyError:
-            click.secho(
-                "No coverage_directory provided.\n"
-                "Please set it via --coverage-dir or ~/.partialtesting\n"
-                "See --help for more information\n"
-            )
-            sys.exit(1)
+    coverage_dir = get_coverage_dir(coverage_dir)
 
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.basicConfig(stream=sys.stdout, level=getattr(logging, log_level))
     if isinstance(special_files, str):
         special_files = str_to_list(special_files)
 
     if isinstance(special_extensions, str):
         special_extensions = str_to_list(special_extensions)
 
+    if all_projects:
+        project_name = discover_projects(coverage_dir)
+    elif not project_name:
+        click.secho("Please provide --project-name or --all-projects")
+        sys.exit(1)
+
+    if len(project_name) > 1 or all_projects:
+        single_project_options = {
+            "--result-cache-dir": result_cache_dir,
+            "--test-result-cache-dir": test_result_cache_dir,
+            "--build-from-merge-base": build_from_merge_base,
+            "--history-file": history_file,
+            "--history-defer-below": history_defer_below,
+            "--group-workers": group_workers,
+        }
+        unsupported = [option for option, value in single_project_options.items() if value]
+        if unsupported:
+            raise click.UsageError(f"{', '.join(unsupported)} cannot be used with several projects")
+        detect_relevant_tests_for_projects(
+            project_name,
+            coverage_dir,
+            git_diff_use_head,
+            special_files,
+            special_extensions,
+            output_file,
+            compare_to_branch,
+            line_coverage,
+            metrics_file,
+            max_workers,
+            max_contexts=max_contexts,
+            max_selected_percent=max_selected_percent,
+            skip_non_semantic_changes=skip_non_semantic_changes,
+            manifest_file=manifest_file,
+        )
+        return
+
     detect_relevant_tests(
-        project_name,
+        project_name[0],
         coverage_dir,
         git_diff_use_head,
         special_files,
@@ -612,6 +2038,18 @@ def main(
         output_file,
         compare_to_branch,
         line_coverage,
+        metrics_file,
+        result_cache_dir=result_cache_dir,
+        result_cache_max_size_mb=result_cache_max_size,
+        max_contexts=max_contexts,
+        max_selected_percent=max_selected_percent,
+        skip_non_semantic_changes=skip_non_semantic_changes,
+        test_result_cache_dir=test_result_cache_dir,
+        build_from_merge_base=build_from_merge_base,
+        history_file=history_file,
+        history_defer_below=history_defer_below,
+        group_workers=group_workers,
+        manifest_file=manifest_file,
     )
 
 
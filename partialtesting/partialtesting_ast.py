@@ -0,0 +1,180 @@
+import ast
+import logging
+import subprocess
+
+WORKING_TREE = None  # read the files from disk instead of a commit
+
+
+def git_cat_file_batch(specs):
+    """
+    Read many blobs ('<rev>:<path>') with a single 'git cat-file --batch' process.
+    Returns {spec: content (bytes)}, missing blobs are left out
+    """
+    if not specs:
+        return {}
+
+    result = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        input="".join(f"{spec}\n" for spec in specs).encode("utf-8"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    output = result.stdout
+
+    blobs = {}
+    position = 0
+    for spec in specs:
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].decode("utf-8")
+        position = header_end + 1
+
+        # '<sha> <type> <size>' or '<spec> missing' (also 'ambiguous')
+        fields = header.rsplit(" ", 2)
+        if len(fields) != 3 or not fields[2].isdigit():
+            continue
+        size = int(fields[2])
+        blobs[spec] = output[position:position + size]
+        position += size + 1  # content is followed by a newline
+
+    return blobs
+
+
+class _Normalizer(ast.NodeTransformer):
+    """
+    Remove what does not change how the code runs: docstrings, the annotations
+    of local variables and the order of consecutive module level imports.
+    Function signature, class and module level annotations are kept, they are
+    used at runtime (e.g. functools.singledispatch, dataclasses, pydantic models,
+    typing.get_type_hints)
+    """
+
+    def _strip_docstring(self, node):
+        if ast.get_docstring(node, clean=False) is not None:
+            node.body = node.body[1:] or [ast.Pass()]
+
+    def visit_Module(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        node.body = _sort_imports(node.body)
+        return node
+
+    def visit_ClassDef(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        return node
+
+    def visit_FunctionDef(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        # local variable annotations are never evaluated
+        node.body = [_AnnotationStripper().visit(statement) for statement in node.body]
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+class _AnnotationStripper(ast.NodeTransformer):
+    def visit_AnnAssign(self, node):
+        if node.value is None:
+            return ast.Pass()
+        return ast.Assign(targets=[node.target], value=node.value)
+
+    def visit_FunctionDef(self, node):
+        return node  # already normalized by _Normalizer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+
+
+def _bound_names(node):
+    return [alias.asname or alias.name.split(".")[0] for alias in node.names]
+
+
+def _is_sortable_import(node):
+    return isinstance(node, ast.Import) or (
+        isinstance(node, ast.ImportFrom) and node.module != "__future__"
+    )
+
+
+def _sort_imports(body):
+    """
+    Sort each run of consecutive import statements, unless two of them bind
+    the same name: then the last one wins and their order matters.
+    __future__ imports must come first, they are never moved
+    """
+    sorted_body = []
+    run = []
+    for node in body + [None]:
+        if node is not None and _is_sortable_import(node):
+            run.append(node)
+            continue
+        names = [name for statement in run for name in _bound_names(statement)]
+        if len(names) == len(set(names)) and "*" not in names:
+            run = sorted(run, key=ast.dump)
+        sorted_body.extend(run)
+        run = []
+        if node is not None:
+            sorted_body.append(node)
+
+    return sorted_body
+
+
+def normalized_ast(source):
+    """
+    Dump of the AST of source without comments, formatting, docstrings,
+    local variable annotations and module level import order
+    """
+    tree = _Normalizer().visit(ast.parse(source))
+    return ast.dump(tree, annotate_fields=False, include_attributes=False)
+
+
+def semantically_equal(old_source, new_source):
+    try:
+        return normalized_ast(old_source) == normalized_ast(new_source)
+    except (SyntaxError, ValueError):
+        # cannot tell, consider it changed
+        return False
+
+
+def read_sources(paths, base_rev, head_rev=WORKING_TREE):
+    """
+    Read the paths at base_rev and at head_rev (or from the working tree)
+    with a single 'git cat-file --batch' process.
+    Returns {path: (old content, new content)}, None where a file does not exist
+    """
+    specs = [f"{base_rev}:{path}" for path in paths]
+    if head_rev is not WORKING_TREE:
+        specs += [f"{head_rev}:{path}" for path in paths]
+    blobs = git_cat_file_batch(specs)
+
+    sources = {}
+    for path in paths:
+        if head_rev is WORKING_TREE:
+            try:
+                with open(path, "rb") as f:
+                    new_source = f.read()
+            except OSError:
+                new_source = None
+        else:
+            new_source = blobs.get(f"{head_rev}:{path}")
+        sources[path] = (blobs.get(f"{base_rev}:{path}"), new_source)
+
+    return sources
+
+
+def semantically_unchanged_paths(paths, base_rev, head_rev=WORKING_TREE):
+    """
+    Return the paths (.py files modified between base_rev and head_rev,
+    or the working tree) whose code is the same once comments, formatting,
+    docstrings, local variable annotations and import order are ignored
+    """
+    unchanged = set()
+    for path, (old_source, new_source) in read_sources(paths, base_rev, head_rev).items():
+        if old_source is None or new_source is None:
+            continue
+        if semantically_equal(old_source, new_source):
+            logging.info(f"Partial Testing: only non-semantic changes in {path}")
+            unchanged.add(path)
+
+    return unchanged
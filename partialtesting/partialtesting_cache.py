@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# bump when the selection logic changes so that old results are not reused
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE_MB = 100
+CACHE_FILE_EXTENSION = ".json"
+# files shared by the CI jobs of several users: tempfile.mkstemp() creates them 0600
+SHARED_FILE_MODE = 0o644
+
+
+def coverage_build_id(coverage_db_path):
+    """
+    Identify a coverage build without reading (checksumming) a possibly
+    multi-GB .coverage file: its real path, size and modification time
+    """
+    stat = os.stat(coverage_db_path)
+    return f"{os.path.realpath(coverage_db_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def selection_cache_key(build_id, merge_base_sha, head_sha, config):
+    """
+    Key of a selection result: the coverage build, the change set
+    (merge-base..HEAD) and the configuration used to classify files
+    (special files, extensions, etc. as a JSON-serialisable dict)
+    """
+    key_data = json.dumps(
+        {
+            "version": CACHE_VERSION,
+            "build": build_id,
+            "merge_base": merge_base_sha,
+            "head": head_sha,
+            "config": config,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent cache of whole selection results, stored as one small
+    JSON file per key under cache_dir (which can be on local disk or on
+    the shared coverage dir). When the cache grows over max_size_mb,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{CACHE_FILE_EXTENSION}")
+
+    def get(self, key):
+        """
+        Return (hit, result). result follows detect_relevant_tests():
+        None for a full test, otherwise the set of test files to run
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+
+        # mark it as recently used
+        os.utime(path, None)
+
+        logging.info(f"Partial Testing: selection result found in cache '{path}'")
+        if entry["full_test"]:
+            return True, None
+        return True, set(entry["test_files"])
+
+    def put(self, key, result):
+        entry = {
+            "full_test": result is None,
+            "test_files": sorted(result) if result is not None else [],
+        }
+        self._write(key, entry)
+        self.evict()
+
+    def _write(self, key, entry):
+        # write atomically, other CI jobs might be reading the same cache
+        fd, tmp_path = tempfile.mkstemp(prefix=".pt_cache", dir=self.cache_dir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.chmod(tmp_path, SHARED_FILE_MODE)
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_size_bytes
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_FILE_EXTENSION):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # evicted by someone else
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            logging.debug(f"Partial Testing: evicting cached result '{path}'")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
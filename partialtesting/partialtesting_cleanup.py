@@ -1,13 +1,31 @@
 import logging
 import os
+import sqlite3
 import sys
+import tempfile
 
 import click
 
-import partialtesting as pt
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_store import (
+    DEFAULT_GC_GRACE_SECONDS,
+    collect_garbage,
+    link_object,
+    store_object,
+)
 
 DEFAULT_COVERAGE_DIR = "default_dir"
 
+# what a thin build keeps of each coverage table: one row per (file, test) with dummy
+# arcs/lines/numbits, enough for the file level lookups of partialtesting
+THIN_COVERAGE_VALUES = {
+    "arc": {"fromno": 0, "tono": 0},
+    "line_bits": {"numbits": b""},
+    "line": {"lineno": 0},
+}
+# only present in thin builds
+THIN_MARKER_TABLE = "partialtesting_thin"
+
 
 def clean_coverage_data(coverage_dir, branch):
     """
@@ -15,8 +33,10 @@ def clean_coverage_data(coverage_dir, branch):
     Keeping the newest coverage file is enough.
     """
     for root, dirs, files in os.walk(coverage_dir):
+        # the object area and builds being published
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
         if root.endswith(f"/{branch}"):
-            last_build = pt.get_last_build_number(root)
+            last_build = pt.get_last_build_directory(root)
             logging.info(
                 f"At {root} the last build is: {last_build} and there are {len(dirs)} builds."
             )
@@ -33,6 +53,97 @@ def clean_coverage_data(coverage_dir, branch):
                         logging.info(f"Stdout: '{stdout}' stderr: '{stderr}'")
 
 
+def is_thin(db_path):
+    db = sqlite3.connect(db_path)
+    try:
+        return bool(
+            db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (THIN_MARKER_TABLE,)
+            ).fetchall()
+        )
+    finally:
+        db.close()
+
+
+def compact_coverage_db(db_path, thin_db_path):
+    """
+    Write a thin copy of the coverage DB at db_path to thin_db_path: same schema,
+    files and contexts, but a single row per (file, context) in the coverage tables
+    """
+    db = sqlite3.connect(thin_db_path)
+    try:
+        db.execute("ATTACH DATABASE ? AS full", (db_path,))
+        tables = db.execute(
+            "SELECT name, sql FROM full.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for name, sql in tables:
+            db.execute(sql)
+            if name in THIN_COVERAGE_VALUES:
+                columns = THIN_COVERAGE_VALUES[name]
+                db.execute(
+                    f"INSERT INTO main.{name} (file_id, context_id, {', '.join(columns)}) "
+                    f"SELECT DISTINCT file_id, context_id, {', '.join('?' * len(columns))} FROM full.{name}",
+                    list(columns.values()),
+                )
+            else:
+                db.execute(f"INSERT INTO main.{name} SELECT * FROM full.{name}")
+        db.execute(f"CREATE TABLE {THIN_MARKER_TABLE} ( source_size integer )")
+        db.execute(f"INSERT INTO {THIN_MARKER_TABLE} VALUES (?)", (os.path.getsize(db_path),))
+        db.commit()
+        db.execute("DETACH DATABASE full")
+    finally:
+        db.close()
+
+
+def compact_build(build_path, coverage_dir):
+    """
+    Replace the .coverage of a build with its thin copy, stored like
+    published builds (see partialtesting_store). The build directory keeps
+    its modification time, which orders the builds
+    """
+    db_path = os.path.join(build_path, pt.COVERAGE_FILE)
+    build_stat = os.stat(build_path)
+
+    with tempfile.TemporaryDirectory(prefix="pt_compact") as tmp_dir:
+        thin_db_path = os.path.join(tmp_dir, pt.COVERAGE_FILE)
+        compact_coverage_db(db_path, thin_db_path)
+        logging.info(
+            f"Compacted {db_path}: {os.path.getsize(db_path)} -> {os.path.getsize(thin_db_path)} bytes"
+        )
+
+        tmp_link_path = os.path.join(build_path, f".{pt.COVERAGE_FILE}.thin")
+        if os.path.lexists(tmp_link_path):
+            os.remove(tmp_link_path)
+        link_object(store_object(thin_db_path, coverage_dir), tmp_link_path)
+        # readers with the full DB open keep reading it
+        os.replace(tmp_link_path, db_path)
+
+    os.utime(build_path, ns=(build_stat.st_atime_ns, build_stat.st_mtime_ns))
+
+
+def compact_coverage_data(coverage_dir, branch, keep):
+    """
+    Keep the full .coverage of the newest keep builds and compact the older
+    ones (see compact_build()) instead of deleting them
+    """
+    for root, dirs, files in os.walk(coverage_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        if not root.endswith(f"/{branch}"):
+            continue
+
+        builds = sorted(
+            (name for name in dirs if os.path.isfile(os.path.join(root, name, pt.COVERAGE_FILE))),
+            key=lambda name: os.path.getmtime(os.path.join(root, name)),
+            reverse=True,
+        )
+        logging.info(f"At {root} there are {len(builds)} builds, keeping {keep} of them full")
+        for build in builds[keep:]:
+            build_path = os.path.join(root, build)
+            if not is_thin(os.path.join(build_path, pt.COVERAGE_FILE)):
+                compact_build(build_path, coverage_dir)
+        dirs[:] = []  # builds hold no other builds
+
+
 @click.command()
 @click.option(
     "--coverage-dir",
@@ -45,13 +156,33 @@ def clean_coverage_data(coverage_dir, branch):
     help=f"Branch of builds to cleanup. Usually, the master branch is the only one"
     "that stores coverage data",
 )
-def main(coverage_dir, branch):
+@click.option(
+    "--gc-grace-seconds",
+    default=DEFAULT_GC_GRACE_SECONDS,
+    help="Stored coverage data (see partialtesting-publish) no build refers to is deleted "
+    f"once older than this. Default: {DEFAULT_GC_GRACE_SECONDS}",
+)
+@click.option(
+    "--compact-keep",
+    default=None,
+    type=int,
+    help="Instead of deleting the older builds, keep the full coverage data of the "
+    "newest N builds and compact the others: only which tests used each file is kept "
+    "(about 5% of the size), enough for partialtesting, partialtesting-range and partialtesting-replay",
+)
+def main(coverage_dir, branch, gc_grace_seconds, compact_keep):
 
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
     logging.info(f"Will clean coverage data in {coverage_dir}")
 
-    clean_coverage_data(coverage_dir, branch)
+    if compact_keep is not None:
+        compact_coverage_data(coverage_dir, branch, compact_keep)
+    else:
+        clean_coverage_data(coverage_dir, branch)
+
+    deleted, freed = collect_garbage(coverage_dir, gc_grace_seconds)
+    logging.info(f"Deleted {deleted} unreferenced coverage files ({freed / 1024 / 1024:.1f} MB)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+
+# coverage DBs can be several GBs, map as much as possible of them
+DEFAULT_MMAP_SIZE = 4 * 1024 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 256 * 1024
+
+
+def open_readonly(coverage_db_path, mmap_size=DEFAULT_MMAP_SIZE, cache_size_kb=DEFAULT_CACHE_SIZE_KB):
+    """
+    Open a published .coverage DB read-only and immutable: SQLite does
+    no locking (expensive on NFS) and never creates or modifies the file
+    (a missing DB raises instead of silently creating an empty one).
+    Published builds are never modified in place, which is what makes
+    immutable=1 safe.
+    """
+    uri = f"{pathlib.Path(os.path.abspath(coverage_db_path)).as_uri()}?mode=ro&immutable=1"
+    db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    db.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    db.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")  # negative: size in KB
+    return db
+
+
+def _db_identity(coverage_db_path):
+    # a path can be replaced by a new DB (e.g. a re-published build), do not reuse its connections then
+    stat = os.stat(coverage_db_path)
+    return os.path.realpath(coverage_db_path), stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class ConnectionPool:
+    """
+    Reuses read-only connections to coverage DBs across calls.
+    Each thread gets its own connection per DB (sqlite3 connections should
+    not be used concurrently), so the pool is safe to use from the thread
+    pools of the multi-project mode. close() must be called once done.
+    """
+
+    def __init__(self, mmap_size=DEFAULT_MMAP_SIZE, cache_size_kb=DEFAULT_CACHE_SIZE_KB):
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self._lock = threading.Lock()
+        self._connections = {}  # (db identity, thread id) -> (connection, owner thread)
+
+    def get(self, coverage_db_path):
+        key = (_db_identity(coverage_db_path), threading.get_ident())
+
+        with self._lock:
+            if key not in self._connections:
+                logging.debug(f"Partial Testing: opening coverage DB '{coverage_db_path}' read-only")
+                db = open_readonly(coverage_db_path, self.mmap_size, self.cache_size_kb)
+                self._connections[key] = (db, threading.current_thread())
+
+            return self._connections[key][0]
+
+    def close(self, coverage_db_path=None):
+        """
+        Close the connections to coverage_db_path (or to every DB) that belong
+        to the calling thread or to threads that have finished (e.g. the workers
+        of a thread pool that was shut down). Connections still in use by other
+        running threads (e.g. concurrent requests of a server) are kept.
+        """
+        real_path = os.path.realpath(coverage_db_path) if coverage_db_path else None
+        current_thread = threading.current_thread()
+
+        with self._lock:
+            for key, (db, owner) in list(self._connections.items()):
+                if real_path is not None and key[0][0] != real_path:
+                    continue
+                if owner is current_thread or not owner.is_alive():
+                    del self._connections[key]
+                    db.close()
+
+
+_POOL = ConnectionPool()
+
+
+def get_connection(coverage_db_path):
+    """
+    Return a pooled read-only connection to the coverage DB
+    """
+    return _POOL.get(coverage_db_path)
+
+
+def close_connections(coverage_db_path=None):
+    _POOL.close(coverage_db_path)
@@ -0,0 +1,323 @@
+import ast
+import configparser
+import fnmatch
+import json
+import logging
+import os
+import re
+import sqlite3
+
+import click
+
+from partialtesting.partialtesting_rules import tomllib
+
+try:
+    from importlib.metadata import packages_distributions  # python >= 3.10
+except ImportError:  # pragma: no cover
+    packages_distributions = None
+
+# per-test map of the distributions imported by the code each test ran,
+# recorded during the master run next to the .coverage file
+DISTRIBUTIONS_FILE = "distributions.json"
+
+SETUP_PY = "setup.py"
+SETUP_CFG = "setup.cfg"
+REQUIREMENTS_PATTERNS = ["*requirements*.txt", "*requirements*.in"]
+TOML_LOCK_FILES = ["poetry.lock", "uv.lock"]
+PIPFILE_LOCK = "Pipfile.lock"
+DEPENDENCY_KEYWORDS = ["install_requires", "extras_require"]
+
+COVERED_TABLES = ["arc", "line_bits", "line"]
+
+REQUIREMENT_NAME_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+class UnparsableDependencies(Exception):
+    pass
+
+
+def normalize_name(name):
+    # PEP 503
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def is_dependency_file(path, rules=None):
+    """
+    The manifests and lock files of the project root (not e.g. docs/requirements.txt
+    or the setup.cfg of a test fixture), plus the ones matching the dependency_files
+    patterns of the rules (see partialtesting_rules.Rules)
+    """
+    if rules is not None and rules.is_dependency_file(path):
+        return True
+    return "/" not in path and (
+        path in (SETUP_PY, SETUP_CFG, PIPFILE_LOCK, *TOML_LOCK_FILES)
+        or any(fnmatch.fnmatch(path, pattern) for pattern in REQUIREMENTS_PATTERNS)
+    )
+
+
+def parse_requirements(lines):
+    """
+    {distribution: requirement} of requirement lines ('numpy>=1.20  # comment'),
+    options (-r, -e, --hash, etc.) are ignored
+    """
+    requirements = {}
+    for line in lines:
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith(("#", "-")):
+            continue
+        match = REQUIREMENT_NAME_RE.match(line)
+        if match:
+            requirements[normalize_name(match.group(1))] = line.replace(" ", "")
+    return requirements
+
+
+def _setup_call(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, "id", getattr(node.func, "attr", None)) == "setup":
+            return node
+    raise UnparsableDependencies("no setup() call")
+
+
+def _parse_setup_py(content):
+    """
+    Returns (requirements, dump of setup.py without its dependencies)
+    """
+    tree = ast.parse(content)
+    call = _setup_call(tree)
+
+    lines = []
+    for keyword in call.keywords:
+        if keyword.arg not in DEPENDENCY_KEYWORDS:
+            continue
+        try:
+            value = ast.literal_eval(keyword.value)
+        except (TypeError, ValueError):
+            raise UnparsableDependencies(f"{keyword.arg} is not a literal")
+        if isinstance(value, dict):
+            for extra, extra_requirements in sorted(value.items()):
+                lines += [f"{requirement}; extra == '{extra}'" for requirement in extra_requirements]
+        else:
+            lines += list(value)
+        keyword.value = ast.Constant(None)
+
+    return parse_requirements(lines), ast.dump(tree, include_attributes=False)
+
+
+def _parse_setup_cfg(content):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(content)
+
+    lines = []
+    if parser.has_option("options", "install_requires"):
+        lines += parser.get("options", "install_requires").splitlines()
+        parser.remove_option("options", "install_requires")
+    if parser.has_section("options.extras_require"):
+        for extra, value in sorted(parser.items("options.extras_require")):
+            lines += [f"{requirement}; extra == '{extra}'" for requirement in value.splitlines()]
+        parser.remove_section("options.extras_require")
+
+    rest = {section: dict(parser.items(section)) for section in parser.sections()}
+    return parse_requirements(lines), json.dumps(rest, sort_keys=True)
+
+
+def _parse_toml_lock(content):
+    if tomllib is None:
+        raise UnparsableDependencies("install 'tomli' to read lock files")
+    lock = tomllib.loads(content)
+    return {
+        normalize_name(package["name"]): f"{package['name']}=={package.get('version', '')}"
+        for package in lock.get("package", [])
+    }
+
+
+def _parse_pipfile_lock(content):
+    lock = json.loads(content)
+    requirements = {}
+    for section in ("default", "develop"):
+        for name, info in lock.get(section, {}).items():
+            requirements[normalize_name(name)] = json.dumps(info, sort_keys=True)
+    return requirements
+
+
+def parse_dependency_file(path, content):
+    """
+    Returns (requirements, rest) where requirements is {distribution: requirement}
+    and rest is whatever else the file holds (None for requirement and lock files),
+    e.g. the rest of setup.py: when it changes, dependencies are not the only change.
+    Raises UnparsableDependencies (or a parsing error) when the file cannot be understood
+    """
+    content = content.decode("utf-8") if isinstance(content, bytes) else content
+    file_name = os.path.basename(path)
+
+    if file_name == SETUP_PY:
+        return _parse_setup_py(content)
+    if file_name == SETUP_CFG:
+        return _parse_setup_cfg(content)
+    if file_name in TOML_LOCK_FILES:
+        return _parse_toml_lock(content), None
+    if file_name == PIPFILE_LOCK:
+        return _parse_pipfile_lock(content), None
+    return parse_requirements(content.splitlines()), None
+
+
+def changed_distributions(path, old_content, new_content):
+    """
+    Distributions whose requirement changed (bumped, added or removed) in a dependency file.
+    Returns None if something else than the dependencies changed (or the file cannot be parsed)
+    """
+    try:
+        old_requirements, old_rest = (
+            parse_dependency_file(path, old_content) if old_content is not None else ({}, None)
+        )
+        new_requirements, new_rest = (
+            parse_dependency_file(path, new_content) if new_content is not None else ({}, None)
+        )
+    except (UnparsableDependencies, SyntaxError, ValueError, configparser.Error) as e:
+        logging.info(f"Partial Testing: could not parse the dependencies in {path}: {e}")
+        return None
+
+    if old_content is None or new_content is None:
+        # an added/deleted setup.py or setup.cfg is not only about dependencies
+        if os.path.basename(path) in (SETUP_PY, SETUP_CFG):
+            return None
+    elif old_rest != new_rest:
+        return None
+
+    return {
+        name
+        for name in set(old_requirements) | set(new_requirements)
+        if old_requirements.get(name) != new_requirements.get(name)
+    }
+
+
+def distributions_file_path(coverage_db_path):
+    return os.path.join(os.path.dirname(coverage_db_path), DISTRIBUTIONS_FILE)
+
+
+def load_distributions_map(coverage_db_path):
+    """
+    {test (coverage context): [distributions]} recorded for a coverage build,
+    None if the build does not have one
+    """
+    path = distributions_file_path(coverage_db_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def tests_using_distributions(distributions_map, distributions):
+    distributions = set(distributions)
+    return {
+        test
+        for test, test_distributions in distributions_map.items()
+        if distributions.intersection(test_distributions)
+    }
+
+
+def top_level_imports(source, path="<unknown>"):
+    modules = set()
+    for node in ast.walk(ast.parse(source, path)):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.partition(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            modules.add(node.module.partition(".")[0])
+    return modules
+
+
+def _module_distributions():
+    if packages_distributions is None:
+        raise RuntimeError("recording the distributions requires Python >= 3.10 (importlib.metadata.packages_distributions)")
+    return {
+        module: [normalize_name(distribution) for distribution in distributions]
+        for module, distributions in packages_distributions().items()
+    }
+
+
+def record_distributions(coverage_db_path):
+    """
+    For every test (context) of the coverage data, the installed distributions
+    imported by the files it ran. The files must still be where the tests ran
+    them from, i.e. this runs at the end of the master run.
+    """
+    module_distributions = _module_distributions()
+    db = sqlite3.connect(coverage_db_path)
+    try:
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        # arcs (--branch) or lines, depending on how the coverage was recorded
+        covered = " UNION ".join(
+            f"SELECT context_id, file_id FROM {table}"
+            for table in COVERED_TABLES
+            if table in tables
+        )
+        rows = db.execute(
+            f"SELECT DISTINCT context.context, file.path FROM ({covered}) AS covered "
+            "JOIN context ON context.id = covered.context_id "
+            "JOIN file ON file.id = covered.file_id "
+            "WHERE context.context != ''"
+        ).fetchall()
+    finally:
+        db.close()
+
+    file_distributions = {}
+    distributions_map = {}
+    for context, path in rows:
+        if path not in file_distributions:
+            try:
+                with open(path, "rb") as f:
+                    modules = top_level_imports(f.read(), path)
+            except (OSError, SyntaxError, ValueError):
+                modules = set()
+            file_distributions[path] = {
+                distribution
+                for module in modules
+                for distribution in module_distributions.get(module, ())
+            }
+        distributions_map.setdefault(context, set()).update(file_distributions[path])
+
+    return {
+        context: sorted(distributions) for context, distributions in distributions_map.items()
+    }
+
+
+@click.command()
+@click.option(
+    "--coverage-file",
+    default=".coverage",
+    help="Coverage data of the master run. Default: .coverage",
+)
+@click.option(
+    "--output-file",
+    default=None,
+    help=f"Where to write the map. Default: {DISTRIBUTIONS_FILE} next to the coverage file",
+)
+@click.option(
+    "--log-level",
+    default="INFO",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: INFO",
+)
+def main(coverage_file, output_file, log_level):
+    """
+    Record which installed distributions each test imported (directly or
+    through the code it ran), so that partialtesting only selects the tests
+    using the distributions changed in setup.py, requirements or lock files.
+    Run it at the end of the master run and publish the map with the .coverage file
+    """
+    logging.basicConfig(level=getattr(logging, log_level))
+    output_file = output_file or distributions_file_path(coverage_file)
+
+    try:
+        distributions_map = record_distributions(coverage_file)
+    except RuntimeError as e:
+        # an empty map would select no test for any dependency change
+        raise click.ClickException(str(e))
+    with open(output_file, "w") as f:
+        json.dump(distributions_map, f, indent=4, sort_keys=True)
+    logging.info(
+        f"Partial Testing: distributions of {len(distributions_map)} tests written to {output_file}"
+    )
+
+
+if __name__ == "__main__":
+    main()
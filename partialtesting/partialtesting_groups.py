@@ -0,0 +1,76 @@
+from partialtesting.partialtesting_results import read_contexts_by_name, read_covered_paths
+
+# a group may take this much more than its share of the tests to keep related test files together
+DEFAULT_MAX_IMBALANCE = 1.25
+GROUP_NAME_FORMAT = "partialtesting_{}"
+
+
+def covered_files_by_test_file(coverage_db_path, test_files, test_index):
+    """
+    {test file: ({files covered by its tests}, number of its tests in the coverage data)}
+    """
+    test_files = set(test_files)
+    contexts_by_name = read_contexts_by_name(coverage_db_path)
+
+    context_ids_by_file = {test_file: set() for test_file in test_files}
+    for name, files in test_index.definitions.items():
+        for test_file in files & test_files:
+            context_ids_by_file[test_file].update(contexts_by_name.get(name, ()))
+
+    covered_paths = read_covered_paths(
+        coverage_db_path, set().union(*context_ids_by_file.values()) if context_ids_by_file else ()
+    )
+    return {
+        test_file: (
+            set().union(*(covered_paths.get(context_id, set()) for context_id in context_ids)),
+            len(context_ids),
+        )
+        for test_file, context_ids in context_ids_by_file.items()
+    }
+
+
+def overlap(covered, group_covered):
+    """
+    Share of the files covered by a test file that a group already imports
+    """
+    return len(covered & group_covered) / len(covered) if covered else 0.0
+
+
+def group_test_files(covered_files, workers, max_imbalance=DEFAULT_MAX_IMBALANCE):
+    """
+    Split the test files into (at most) workers groups of similar size, the
+    size being their number of tests (see covered_files_by_test_file()).
+    The largest test files are placed first, each one in the group already
+    covering most of its files, as long as that group has room for it.
+    Returns [[test file, ...], ...], empty groups left out
+    """
+    weights = {test_file: max(count, 1) for test_file, (_, count) in covered_files.items()}
+    capacity = max(max_imbalance * sum(weights.values()) / workers, max(weights.values(), default=0))
+
+    groups = [{"test_files": [], "covered": set(), "weight": 0} for _ in range(workers)]
+    for test_file in sorted(covered_files, key=lambda test_file: (-weights[test_file], test_file)):
+        covered, _ = covered_files[test_file]
+        candidates = [group for group in groups if group["weight"] + weights[test_file] <= capacity]
+        if not candidates:
+            candidates = [min(groups, key=lambda group: group["weight"])]
+        group = max(
+            candidates,
+            # ties (e.g. no overlap at all) go to the lightest group
+            key=lambda group: (overlap(covered, group["covered"]), -group["weight"]),
+        )
+        group["test_files"].append(test_file)
+        group["covered"] |= covered
+        group["weight"] += weights[test_file]
+
+    return [sorted(group["test_files"]) for group in groups if group["test_files"]]
+
+
+def group_names(groups):
+    """
+    {test file: xdist group name}, for pytest -n <workers> --dist loadgroup
+    """
+    return {
+        test_file: GROUP_NAME_FORMAT.format(index)
+        for index, test_files in enumerate(groups)
+        for test_file in test_files
+    }
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from partialtesting.partialtesting_cache import SHARED_FILE_MODE
+
+# bump when the format of the model file changes
+HISTORY_VERSION = 1
+# a test file is added when it failed in at least this share of the runs changing a file...
+DEFAULT_MIN_COFAILURE_RATE = 0.2
+# ...and at least this many times, a single (flaky) failure is not enough
+MIN_COFAILURES = 2
+# test files with fewer runs in the history are never deferred, their risk is unknown
+MIN_TEST_RUNS = 5
+
+
+class CoFailureModel:
+    """
+    Which test files failed when which files changed, counted over past CI runs
+    (see partialtesting_replay.train_cofailure_model):
+    - runs: {changed file: number of runs changing it}
+    - cofailures: {changed file: {test file: number of those runs it failed in}}
+    - test_runs / test_failures: {test file: number of runs it ran / failed in}
+
+    It finds dependencies the coverage data does not record (config files read,
+    code run in subprocesses, import time effects) and the test files that never
+    fail, whatever is changed
+    """
+
+    def __init__(self, runs=None, cofailures=None, test_runs=None, test_failures=None):
+        self.runs = runs or {}
+        self.cofailures = cofailures or {}
+        self.test_runs = test_runs or {}
+        self.test_failures = test_failures or {}
+
+    def add_run(self, changed_paths, results):
+        """
+        Count a run: the paths it changed and its TestResults (see partialtesting_results)
+        """
+        failed = {}
+        for result in results:
+            failed[result.test_file] = failed.get(result.test_file, False) or result.failed
+
+        for test_file, test_failed in failed.items():
+            self.test_runs[test_file] = self.test_runs.get(test_file, 0) + 1
+            self.test_failures[test_file] = self.test_failures.get(test_file, 0) + int(test_failed)
+
+        failed_test_files = [test_file for test_file, test_failed in failed.items() if test_failed]
+        for path in set(changed_paths):
+            self.runs[path] = self.runs.get(path, 0) + 1
+            for test_file in failed_test_files:
+                cofailures = self.cofailures.setdefault(path, {})
+                cofailures[test_file] = cofailures.get(test_file, 0) + 1
+
+    def cofailing_tests(self, changed_paths, min_rate=DEFAULT_MIN_COFAILURE_RATE):
+        """
+        Test files that historically fail when one of changed_paths changes
+        """
+        test_files = set()
+        for path in changed_paths:
+            for test_file, count in self.cofailures.get(path, {}).items():
+                if count >= MIN_COFAILURES and count / self.runs[path] >= min_rate:
+                    test_files.add(test_file)
+        return test_files
+
+    def risk(self, test_file, changed_paths):
+        """
+        Estimated probability that test_file fails with changed_paths: the highest of
+        its failure rate and of its failure rates when one of changed_paths changed.
+        1.0 when there is not enough history about it
+        """
+        runs = self.test_runs.get(test_file, 0)
+        if runs < MIN_TEST_RUNS:
+            return 1.0
+
+        risk = self.test_failures.get(test_file, 0) / runs
+        for path in changed_paths:
+            if self.runs.get(path):
+                risk = max(risk, self.cofailures.get(path, {}).get(test_file, 0) / self.runs[path])
+        return risk
+
+    def to_dict(self):
+        return {
+            "version": HISTORY_VERSION,
+            "runs": self.runs,
+            "cofailures": self.cofailures,
+            "test_runs": self.test_runs,
+            "test_failures": self.test_failures,
+        }
+
+    def fingerprint(self):
+        """
+        Digest of the model, part of the result cache key
+        """
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode("utf-8")).hexdigest()
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".pt_history", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.to_dict(), f, sort_keys=True)
+            os.chmod(tmp_path, SHARED_FILE_MODE)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logging.info(f"Partial Testing: saved the co-failure model to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != HISTORY_VERSION:
+            raise ValueError(f"Unsupported co-failure model version {data.get('version')} in {path}")
+        return cls(data["runs"], data["cofailures"], data["test_runs"], data["test_failures"])
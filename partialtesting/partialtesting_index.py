@@ -0,0 +1,303 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # not on Windows, updates are not serialized there
+
+from partialtesting.partialtesting_cache import SHARED_FILE_MODE
+from partialtesting.partialtesting_db import get_connection
+from partialtesting.partialtesting_deps import COVERED_TABLES
+
+# test definitions: 'def test_x(', 'async def test_x(' and 'class TestX'
+TEST_DEFINITION_RE = re.compile(r"^\s*(?:async\s+)?(?:def|class)\s+(\w+)", re.MULTILINE)
+TEST_FILE_PREFIX = "test_"
+TEST_FILE_EXTENSION = ".py"
+
+# file -> tests posting lists of a project's latest build: <project_dir>/.reverse_index/
+REVERSE_INDEX_DIR = ".reverse_index"
+CURRENT_GENERATION_FILE = "CURRENT"
+GENERATION_FILE_FORMAT = "gen-{:08d}.db"
+GENERATION_FILE_PREFIX = "gen-"
+# held while a generation is built, so that concurrent updates do not publish the same one
+LOCK_FILE = "LOCK"
+# previous generations might still be read by running lookups
+KEPT_GENERATIONS = 2
+
+
+def get_test_func_name(test_name):
+    """
+    Name of the test function for a test name (context) recorded by coverage
+    """
+    if "." in test_name:
+        # fully qualified test name in the newest coverage (version >= v5.0a6)
+        # https://github.com/nedbat/coveragepy/commit/a9f5f7fadacaa8a84b4ac247e79bcb6f29935bb1
+        return test_name.rpartition(".")[2]
+    return test_name
+
+
+def is_test_file_name(file_name):
+    # same files as grep --include=test_*.py
+    return file_name.startswith(TEST_FILE_PREFIX) and file_name.endswith(TEST_FILE_EXTENSION)
+
+
+class TestDefinitionIndex:
+    """
+    Maps the name of every test function/class defined under tests_dir to
+    the test files defining it. Loaded once, it replaces a 'grep' over the
+    whole test tree for every lookup.
+    """
+
+    __test__ = False  # not a pytest test class
+
+    def __init__(self, tests_dir, definitions=None):
+        self.tests_dir = tests_dir
+        self.definitions = definitions if definitions is not None else {}
+
+    @classmethod
+    def load(cls, tests_dir="tests", stop_event=None):
+        """
+        Scan every test_*.py file under tests_dir (a directory or a list of them).
+        Loading stops early (leaving a partial index) if stop_event gets set,
+        e.g. because a full test is required and the index is not needed
+        """
+        tests_dirs = [tests_dir] if isinstance(tests_dir, str) else list(tests_dir)
+        tests_dir = tests_dir.rstrip("/") if isinstance(tests_dir, str) else tests_dirs
+        index = cls(tests_dir)
+
+        for directory in tests_dirs:
+            for root, dirs, files in os.walk(directory.rstrip("/")):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if stop_event is not None and stop_event.is_set():
+                        logging.debug("Partial Testing: test definition index loading stopped")
+                        return index
+                    if is_test_file_name(file_name):
+                        index.add_file(os.path.normpath(os.path.join(root, file_name)))
+
+        logging.debug(
+            f"Partial Testing: indexed {len(index.definitions)} test definitions under '{tests_dir}'"
+        )
+        return index
+
+    def add_file(self, path):
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                content = f.read()
+        except OSError as e:
+            logging.warning(f"Partial Testing: could not index '{path}': {e}")
+            return
+
+        for name in TEST_DEFINITION_RE.findall(content):
+            self.definitions.setdefault(name, set()).add(path)
+
+    def remove_file(self, path):
+        for name in list(self.definitions):
+            self.definitions[name].discard(path)
+            if not self.definitions[name]:
+                del self.definitions[name]
+
+    def test_files_for_test_names(self, test_names):
+        """
+        Given a set of test names, find the test files in which they are defined
+        """
+        test_files = set()
+        for test_name in test_names:
+            test_files.update(self.definitions.get(get_test_func_name(test_name), ()))
+        return sorted(test_files)
+
+
+def read_file_contexts(coverage_db_path):
+    """
+    {covered file path: set of contexts} of a coverage DB
+    """
+    db = sqlite3.connect(coverage_db_path)
+    try:
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        covered = " UNION ".join(
+            f"SELECT file_id, context_id FROM {table}" for table in COVERED_TABLES if table in tables
+        )
+        rows = db.execute(
+            f"SELECT DISTINCT file.path, context.context FROM ({covered}) AS covered "
+            "JOIN file ON file.id = covered.file_id "
+            "JOIN context ON context.id = covered.context_id "
+            "WHERE context.context != ''"
+        )
+        file_contexts = {}
+        for path, context in rows:
+            file_contexts.setdefault(path, set()).add(context)
+        return file_contexts
+    finally:
+        db.close()
+
+
+def postings_delta(old_postings, new_postings):
+    """
+    Posting lists that differ between two {path: set of contexts}:
+    {path: new set of contexts, None when the file is not covered anymore}
+    """
+    delta = {path: None for path in old_postings if path not in new_postings}
+    delta.update(
+        (path, contexts)
+        for path, contexts in new_postings.items()
+        if old_postings.get(path) != contexts
+    )
+    return delta
+
+
+def read_current_generation(project_dir):
+    """
+    {"number": n, "generation": file name, "build_id": coverage build it indexes},
+    None if there is no index
+    """
+    try:
+        with open(os.path.join(project_dir, REVERSE_INDEX_DIR, CURRENT_GENERATION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_reverse_index(project_dir, build_id):
+    """
+    Path of the reverse index of the build (see partialtesting_cache.coverage_build_id),
+    None if the current generation indexes another build
+    """
+    current = read_current_generation(project_dir)
+    if current is None or current["build_id"] != build_id:
+        return None
+    return os.path.join(project_dir, REVERSE_INDEX_DIR, current["generation"])
+
+
+def _read_postings(index_path):
+    db = sqlite3.connect(index_path)
+    try:
+        rows = db.execute("SELECT path, contexts FROM postings")
+        return {path: set(json.loads(contexts)) for path, contexts in rows}
+    finally:
+        db.close()
+
+
+@contextmanager
+def _locked(index_dir):
+    """
+    Exclusive lock of the index of a project (fcntl locks also work over NFS)
+    """
+    with open(os.path.join(index_dir, LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+
+def update_reverse_index(project_dir, coverage_db_path, build_id):
+    """
+    Index a new coverage build of the project: the posting lists of the current
+    generation that changed are patched into a copy, published as a new
+    generation and made current with an atomic rename of the CURRENT file.
+    Readers keep using the generation they opened, which is never modified,
+    and concurrent updates (e.g. two builds landing at once) wait for each other.
+    Every posting list of the build and of the current generation is read, only
+    the writes are limited to the ones that changed. Returns the delta stats
+    """
+    index_dir = os.path.join(project_dir, REVERSE_INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+
+    with _locked(index_dir):
+        return _update_reverse_index(project_dir, index_dir, coverage_db_path, build_id)
+
+
+def _update_reverse_index(project_dir, index_dir, coverage_db_path, build_id):
+    current = read_current_generation(project_dir)
+    current_path = os.path.join(index_dir, current["generation"]) if current else None
+    if current_path is not None and not os.path.isfile(current_path):
+        current_path = None
+    old_postings = _read_postings(current_path) if current_path else {}
+
+    new_postings = read_file_contexts(coverage_db_path)
+    delta = postings_delta(old_postings, new_postings)
+
+    number = current["number"] + 1 if current_path else 1
+    generation = GENERATION_FILE_FORMAT.format(number)
+    fd, tmp_path = tempfile.mkstemp(prefix=".pt_index", dir=index_dir)
+    os.close(fd)
+    try:
+        if current_path:
+            shutil.copyfile(current_path, tmp_path)
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS postings ( path text primary key, contexts text )")
+            db.executemany(
+                "DELETE FROM postings WHERE path = ?",
+                [(path,) for path, contexts in delta.items() if contexts is None],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO postings VALUES (?, ?)",
+                [(path, json.dumps(sorted(contexts))) for path, contexts in delta.items() if contexts is not None],
+            )
+            db.commit()
+        finally:
+            db.close()
+        os.chmod(tmp_path, SHARED_FILE_MODE)
+        os.replace(tmp_path, os.path.join(index_dir, generation))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    fd, tmp_current = tempfile.mkstemp(prefix=".pt_current", dir=index_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"number": number, "generation": generation, "build_id": build_id}, f)
+    os.chmod(tmp_current, SHARED_FILE_MODE)
+    os.replace(tmp_current, os.path.join(index_dir, CURRENT_GENERATION_FILE))
+
+    generations = sorted(name for name in os.listdir(index_dir) if name.startswith(GENERATION_FILE_PREFIX))
+    for name in generations[:-KEPT_GENERATIONS]:
+        os.remove(os.path.join(index_dir, name))
+
+    stats = {
+        "generation": generation,
+        "files_added": sum(path not in old_postings for path in delta),
+        "files_removed": sum(contexts is None for contexts in delta.values()),
+        "files_changed": sum(
+            path in old_postings and contexts is not None for path, contexts in delta.items()
+        ),
+        "contexts_changed": len(
+            {
+                context
+                for path, contexts in delta.items()
+                for context in old_postings.get(path, set()) ^ (contexts or set())
+            }
+        ),
+    }
+    logging.info(f"Partial Testing: reverse index of {project_dir} updated: {stats}")
+    return stats
+
+
+def get_tests_that_use_file_from_index(changed_file, index_path, budget=None):
+    """
+    Same as partialtesting.get_tests_that_use_file() from a reverse index:
+    a single posting list per covered file instead of every arc
+    """
+    # generations are never modified once published, see partialtesting_db
+    cursor = get_connection(index_path).execute(
+        "SELECT contexts FROM postings WHERE path LIKE ?", (f"%{changed_file}",)
+    )
+    test_names = {}  # distinct, in order
+    for (contexts,) in cursor:
+        for context in json.loads(contexts):
+            if context in test_names:
+                continue
+            if budget is not None:
+                budget.add(context)
+            test_names[context] = None
+    return list(test_names)
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# functions called as hook(event, payload) for every metrics event, see register_hook()
+_HOOKS = []
+
+PHASE_STARTED = "phase_started"
+PHASE_FINISHED = "phase_finished"
+COUNT = "count"
+
+PROMETHEUS_PREFIX = "partialtesting"
+
+
+def register_hook(hook):
+    """
+    Subscribe to the metrics events of every partialtesting run (e.g. from a pytest
+    plugin or a CI wrapper). The hook is called as hook(event, payload):
+    - PHASE_STARTED:  {"phase": name, "labels": {...}}
+    - PHASE_FINISHED: {"phase": name, "seconds": elapsed, "labels": {...}}
+    - COUNT:          {"name": name, "value": value, "labels": {...}}
+    """
+    _HOOKS.append(hook)
+
+
+def unregister_hook(hook):
+    _HOOKS.remove(hook)
+
+
+def _emit(event, payload):
+    for hook in list(_HOOKS):
+        try:
+            hook(event, payload)
+        except Exception as e:
+            # a broken subscriber must never break the test selection
+            logging.warning(f"Partial Testing: metrics hook {hook} failed: {e}")
+
+
+class Metrics:
+    """
+    Collects the time spent in each phase of a partialtesting run
+    and counts (changed files, contexts fetched, tests selected, etc.)
+    - labels: extra information identifying the run (e.g. the project name)
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self.timings = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        _emit(PHASE_STARTED, {"phase": name, "labels": self.labels})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            # a phase can run more than once (e.g. concurrently, once per file), accumulate it
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            logging.debug(f"Partial Testing: phase '{name}' took {elapsed:.3f}s")
+            _emit(
+                PHASE_FINISHED,
+                {"phase": name, "seconds": elapsed, "labels": self.labels},
+            )
+
+    def count(self, name, value):
+        self.counts[name] = value
+        _emit(COUNT, {"name": name, "value": value, "labels": self.labels})
+
+    def to_dict(self):
+        return {"labels": self.labels, "timings": self.timings, "counts": self.counts}
+
+    def to_prometheus(self):
+        return prometheus_text([self])
+
+    def write(self, metrics_file):
+        """
+        Write the metrics as JSON to metrics_file and in the Prometheus
+        text format next to it (same name with the .prom extension)
+        """
+        write_metrics(metrics_file, self.to_dict(), [self])
+
+
+def prometheus_text(metrics_list):
+    """
+    Render the metrics of one or more runs (e.g. one per project) in the
+    Prometheus text exposition format (as read by the node_exporter textfile
+    collector). Samples of the same metric are grouped under a single TYPE line.
+    """
+    families = {}
+
+    def _labels(metrics, extra=None):
+        labels = dict(extra or {}, **metrics.labels)
+        return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+    phase_metric = f"{PROMETHEUS_PREFIX}_phase_seconds"
+    for metrics in metrics_list:
+        for phase, seconds in metrics.timings.items():
+            families.setdefault(phase_metric, []).append(
+                f"{phase_metric}{{{_labels(metrics, {'phase': phase})}}} {seconds:.6f}"
+            )
+        for name, value in metrics.counts.items():
+            metric = f"{PROMETHEUS_PREFIX}_{name}"
+            families.setdefault(metric, []).append(
+                f"{metric}{{{_labels(metrics)}}} {value}"
+            )
+
+    lines = []
+    for metric, samples in families.items():
+        if metric == phase_metric:
+            lines.append(f"# HELP {metric} Time spent in each partialtesting phase")
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics_file, json_content, metrics_list):
+    prometheus_file = f"{os.path.splitext(metrics_file)[0]}.prom"
+
+    _write_atomically(metrics_file, json.dumps(json_content, indent=4, sort_keys=True))
+    _write_atomically(prometheus_file, prometheus_text(metrics_list))
+    logging.info(
+        f"Partial Testing: metrics written to {metrics_file} and {prometheus_file}"
+    )
+
+
+def _write_atomically(path, content):
+    # the textfile collector may read the file at any time, never expose a partial write
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
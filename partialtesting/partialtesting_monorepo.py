@@ -0,0 +1,138 @@
+import copy
+import logging
+
+from partialtesting.partialtesting_db import get_connection
+from partialtesting.partialtesting_rules import read_config_section
+
+# sections of the project-level rules file (see partialtesting_rules.read_config_section):
+#   [projects]
+#   core = core/src
+#   [project_dependencies]
+#   app = core
+PROJECTS_SECTION = "projects"
+DEPENDENCIES_SECTION = "project_dependencies"
+# where the downstream projects record the files of an installed project
+INSTALL_DIRS = ("site-packages", "dist-packages")
+
+
+class ProjectGraph:
+    """
+    Which projects of a monorepo use which other ones:
+    - source_roots: {project: [repo path the project is installed from]},
+    a changed file under a root is looked up in the coverage of the downstream
+    projects by the path it is installed as (<root>/pkg/x.py -> site-packages/pkg/x.py)
+    - dependencies: {project: {upstream projects}}, as declared. The projects
+    not declared there depend on the projects whose installed files their
+    coverage recorded (see records_installed_files())
+    """
+
+    def __init__(self, source_roots=None, dependencies=None):
+        self.source_roots = {
+            project: [root.strip("/") for root in roots] for project, roots in (source_roots or {}).items()
+        }
+        self.dependencies = {project: set(upstream) for project, upstream in (dependencies or {}).items()}
+
+    @classmethod
+    def load(cls, repo_dir="."):
+        return cls(
+            read_config_section(PROJECTS_SECTION, repo_dir),
+            read_config_section(DEPENDENCIES_SECTION, repo_dir),
+        )
+
+    def installed_path(self, path):
+        """
+        (project, path relative to its source root) of a repository path,
+        (None, None) if it is not under any source root
+        """
+        matches = [
+            (len(root), project, path[len(root) + 1:])
+            for project, roots in self.source_roots.items()
+            for root in roots
+            if path.startswith(f"{root}/")
+        ]
+        if not matches:
+            return None, None
+        _, project, installed_path = max(matches)
+        return project, installed_path
+
+    def upstream_changes(self, nontest_files):
+        """
+        {project: [changed files, as installed]} of the changes under a source root
+        """
+        changes = {}
+        for file in nontest_files:
+            project, installed_path = self.installed_path(file.path)
+            if project is None:
+                continue
+            installed_file = copy.copy(file)
+            installed_file.path = installed_path
+            if file.new_path is not None:
+                installed_file.new_path = self.installed_path(file.new_path)[1]
+            changes.setdefault(project, []).append(installed_file)
+        return changes
+
+    def declared_dependencies(self, project_name):
+        """
+        Every project project_name depends on, directly or through other
+        declared dependencies (app -> lib -> core: app depends on lib and core)
+        """
+        dependencies = set()
+        to_visit = [project_name]
+        while to_visit:
+            for upstream in self.dependencies.get(to_visit.pop(), ()):
+                if upstream not in dependencies:
+                    dependencies.add(upstream)
+                    to_visit.append(upstream)
+        dependencies.discard(project_name)
+        return dependencies
+
+    def upstream_projects(self, project_name, coverage_db_path, upstream_changes):
+        """
+        The projects with upstream_changes that project_name depends on
+        """
+        candidates = set(upstream_changes) - {project_name}
+        if project_name in self.dependencies:
+            return candidates & self.declared_dependencies(project_name)
+        return {
+            upstream
+            for upstream in candidates
+            if records_installed_files(coverage_db_path, upstream_changes[upstream])
+        }
+
+    def files_to_look_up(self, project_name, coverage_db_path, upstream_changes):
+        """
+        The changes of the upstream projects of project_name, one file per
+        install directory: site-packages/pkg/x.py, dist-packages/pkg/x.py
+        """
+        files = []
+        for upstream in sorted(self.upstream_projects(project_name, coverage_db_path, upstream_changes)):
+            logging.info(f"Partial Testing: {project_name} depends on {upstream}")
+            for file in upstream_changes[upstream]:
+                for install_dir in INSTALL_DIRS:
+                    installed_file = copy.copy(file)
+                    installed_file.path = f"{install_dir}/{file.path}"
+                    files.append(installed_file)
+        return files
+
+
+def installed_top_level(installed_path):
+    """
+    pkg/sub/x.py -> pkg/, mod.py -> mod.py
+    """
+    top_level, separator, _ = installed_path.partition("/")
+    return f"{top_level}{separator}"
+
+
+def records_installed_files(coverage_db_path, installed_files):
+    """
+    Did the coverage record any file of the top-level packages (or modules)
+    of installed_files from an install directory?
+    """
+    top_levels = sorted({installed_top_level(file.path) for file in installed_files})
+    db = get_connection(coverage_db_path)
+    for install_dir in INSTALL_DIRS:
+        for top_level in top_levels:
+            pattern = f"%/{install_dir}/{top_level}%" if top_level.endswith("/") else f"%/{install_dir}/{top_level}"
+            if db.execute("SELECT 1 FROM file WHERE path LIKE ? LIMIT 1", (pattern,)).fetchone():
+                return True
+    return False
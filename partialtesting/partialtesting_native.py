@@ -0,0 +1,170 @@
+import ast
+import glob
+import json
+import logging
+import os
+import subprocess
+
+NATIVE_SOURCE_EXTENSIONS = [".c", ".cc", ".cpp", ".cxx", ".h", ".hh", ".hpp", ".pyx", ".pxd"]
+# optional mapping generated by the build: {"<source path>": ["<extension module>", ...]}
+NATIVE_MANIFEST_FILE = ".partialtesting_native.json"
+SETUP_FILE = "setup.py"
+
+
+def is_native_source(path):
+    return os.path.splitext(path)[1] in NATIVE_SOURCE_EXTENSIONS
+
+
+def _literal_strings(node):
+    """
+    Strings of a literal str/list/tuple node, anything computed is ignored
+    """
+    try:
+        value = ast.literal_eval(node)
+    except (TypeError, ValueError):
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [item for item in value if isinstance(item, str)]
+    return []
+
+
+def _call_name(call):
+    if isinstance(call.func, ast.Name):
+        return call.func.id
+    if isinstance(call.func, ast.Attribute):
+        return call.func.attr
+    return None
+
+
+def _module_name_from_source(path):
+    # cythonize("pkg/_fast.pyx") builds the pkg._fast extension module
+    return os.path.splitext(os.path.normpath(path))[0].replace(os.sep, ".")
+
+
+def native_sources_from_setup_py(setup_file=SETUP_FILE):
+    """
+    Statically read the Extension(name, sources, depends=...) and
+    cythonize(<paths or globs>) calls of setup.py (only literal arguments).
+    Returns {source path: {extension module, ...}}
+    """
+    with open(setup_file, "rb") as f:
+        tree = ast.parse(f.read(), setup_file)
+
+    setup_dir = os.path.dirname(setup_file)
+    sources = {}
+
+    def _add(source, module):
+        path = os.path.normpath(os.path.join(setup_dir, source))
+        sources.setdefault(path, set()).add(module)
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        keywords = {keyword.arg: keyword.value for keyword in node.keywords}
+        name = _call_name(node)
+
+        if name == "Extension":
+            module_nodes = node.args[:1] or [keywords.get("name")]
+            source_nodes = node.args[1:2] or [keywords.get("sources")]
+            modules = _literal_strings(module_nodes[0]) if module_nodes[0] is not None else []
+            if not modules:
+                continue
+            for source_node in source_nodes + [keywords.get("depends")]:
+                if source_node is not None:
+                    for source in _literal_strings(source_node):
+                        _add(source, modules[0])
+
+        elif name == "cythonize" and node.args:
+            for pattern in _literal_strings(node.args[0]):
+                for source in glob.glob(os.path.join(setup_dir, pattern), recursive=True):
+                    source = os.path.relpath(source, setup_dir or ".")
+                    _add(source, _module_name_from_source(source))
+
+    return sources
+
+
+def load_native_manifest(manifest_file=NATIVE_MANIFEST_FILE):
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    return {
+        os.path.normpath(source): set(modules) for source, modules in manifest.items()
+    }
+
+
+def native_source_map(setup_file=SETUP_FILE, manifest_file=NATIVE_MANIFEST_FILE):
+    """
+    Map the native (C/C++/Cython) sources to the extension modules they are
+    compiled into, from setup.py and/or the manifest generated by the build
+    """
+    sources = {}
+    for path, reader in ((setup_file, native_sources_from_setup_py), (manifest_file, load_native_manifest)):
+        if not os.path.isfile(path):
+            continue
+        try:
+            for source, modules in reader(path).items():
+                sources.setdefault(source, set()).update(modules)
+        except (OSError, SyntaxError, ValueError) as e:
+            logging.warning(f"Partial Testing: could not read the native sources from {path}: {e}")
+
+    return sources
+
+
+def _package_of(path):
+    return os.path.dirname(os.path.normpath(path)).replace(os.sep, ".")
+
+
+def imported_modules(source, path):
+    """
+    Absolute names of the modules (and possible submodules) imported by the Python file at path
+    """
+    modules = set()
+    package = _package_of(path)
+
+    for node in ast.walk(ast.parse(source, path)):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".") if package else []
+                parts = parts[: len(parts) - (node.level - 1)]
+                base = ".".join(parts + ([node.module] if node.module else []))
+            if base:
+                modules.add(base)
+            # 'from pkg import _fast' imports the pkg._fast module
+            modules.update(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+
+    return modules
+
+
+def python_importers(modules):
+    """
+    Python files of the repository importing any of the modules.
+    'git grep' narrows the files down to the ones mentioning the modules' names,
+    which are then parsed. Returns {module: [paths]}
+    """
+    modules = set(modules)
+    importers = {module: [] for module in modules}
+    if not modules:
+        return importers
+
+    names = sorted({module.rpartition(".")[2] for module in modules})
+    command = ["git", "grep", "-l", "-w", "-F"]
+    for name in names:
+        command += ["-e", name]
+    result = subprocess.run(command + ["--", "*.py"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    for path in result.stdout.decode("utf-8").splitlines():
+        try:
+            with open(path, "rb") as f:
+                imports = imported_modules(f.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for module in modules:
+            # relative imports in a src/ layout resolve to 'src.pkg._fast'
+            if any(name == module or name.endswith(f".{module}") for name in imports):
+                importers[module].append(path)
+
+    return importers
@@ -0,0 +1,239 @@
+import json
+import logging
+import sys
+
+import click
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_index import TestDefinitionIndex
+from partialtesting.partialtesting_metrics import Metrics
+from partialtesting.partialtesting_rules import load_rules
+
+# marks the start of each commit in the 'git log -z' stream
+COMMIT_MARKER = "\x01"
+
+
+def git_log_name_status(revision_range):
+    """
+    Changes of every commit in revision_range (oldest first), from one 'git log' process.
+    Merge commits are compared with their first parent
+    """
+    git_output, _ = pt.run_sh_cmd(
+        [
+            "git",
+            "log",
+            "-z",
+            "--reverse",
+            "--name-status",
+            "--diff-merges=first-parent",
+            f"--format={COMMIT_MARKER}%H",
+            revision_range,
+        ]
+    )
+    return git_output
+
+
+def parse_git_log_name_status(git_output):
+    """
+    Parse the output of git_log_name_status() into [(commit, [File, ...]), ...]
+    With -z, every field is NUL terminated: '<marker><sha>', '\\n<status>', '<path>'
+    (renames and copies are followed by two paths)
+    """
+    commits = []
+    fields = iter(git_output.split("\0"))
+
+    for field in fields:
+        field = field.lstrip("\n")
+        if not field:
+            continue
+        if field.startswith(COMMIT_MARKER):
+            commits.append((field[len(COMMIT_MARKER):], []))
+            continue
+
+        status, path, new_path = field, next(fields), None
+        if status[0] in ("R", "C"):
+            new_path = next(fields)
+        commits[-1][1].append(pt.File(path, status, new_path))
+
+    return commits
+
+
+class RangeSelector:
+    """
+    Selects the tests of many change sets against one coverage build:
+    the coverage DB connection, the test definition index and the
+    tests found for each changed file are shared by all of them
+    """
+
+    def __init__(self, project_data, rules, test_index, metrics=None):
+        self.project_data = project_data
+        self.rules = rules
+        self.test_index = test_index
+        self.metrics = metrics or Metrics()
+        self._tests_of_file = {}
+
+    def _tests_that_use_file(self, path):
+        if path not in self._tests_of_file:
+            self._tests_of_file[path] = set(
+                pt.get_tests_that_use_file(
+                    path, self.project_data.coverage_db_path, self.project_data.line_coverage
+                )
+            )
+        return self._tests_of_file[path]
+
+    def select(self, changed_files):
+        """
+        Same result as detect_relevant_tests(): None for a full test, else the test files
+        """
+        rules, native_importers = pt.resolve_native_sources(changed_files, self.rules, self.metrics)
+        nontest_files, test_files, full_test = pt.classify_changed_files(
+            changed_files, [], [], self.metrics, rules
+        )
+        if full_test:
+            return None
+
+        nontest_files, test_files = pt.expand_native_sources(nontest_files, test_files, native_importers, rules)
+        files_to_test = set(pt.identify_files_to_test_for_testfiles(test_files))
+        if not pt.coverage_lookup_required(nontest_files, test_files, rules):
+            return files_to_test
+
+        test_names = set()
+        with self.metrics.phase("db_lookup"):
+            for file in nontest_files + test_files:
+                test_names |= self._tests_that_use_file(file.path)
+
+        with self.metrics.phase("test_file_resolution"):
+            files_to_test.update(self.test_index.test_files_for_test_names(test_names))
+
+        return files_to_test
+
+
+def detect_relevant_tests_for_range(
+    revision_range,
+    project_name,
+    coverage_dir,
+    output,
+    special_files=pt.SPECIAL_FILES_DEFAULT,
+    special_extensions=pt.SPECIAL_EXTENSIONS_DEFAULT,
+    line_coverage=False,
+):
+    """
+    Select the tests of every commit in revision_range (e.g. A..B), each
+    commit being compared with its parent, and write one JSON line per commit
+    to output: {"commit": sha, "full_test": bool, "test_files": [...]}
+    Returns {commit: result} where result follows detect_relevant_tests()
+    """
+    metrics = Metrics(labels={"project": project_name})
+
+    with metrics.phase("git_log"):
+        commits = parse_git_log_name_status(git_log_name_status(revision_range))
+    logging.info(f"Partial Testing: {len(commits)} commits in {revision_range}")
+
+    rules = load_rules(special_files, special_extensions)
+    with metrics.phase("build_resolution"):
+        project_data = pt.resolve_project(project_name, coverage_dir, line_coverage)
+    with metrics.phase("test_index"):
+        test_index = TestDefinitionIndex.load(rules.test_dirs())
+
+    selector = RangeSelector(project_data, rules, test_index, metrics)
+    results = {}
+    try:
+        for commit, changed_files in commits:
+            files_to_test = selector.select(changed_files)
+            results[commit] = files_to_test
+            output.write(
+                json.dumps(
+                    {
+                        "commit": commit,
+                        "changed_files": len(changed_files),
+                        "full_test": files_to_test is None,
+                        "test_files": sorted(files_to_test) if files_to_test is not None else [],
+                    }
+                )
+                + "\n"
+            )
+    finally:
+        pt.close_connections()
+
+    logging.debug(f"Partial Testing: range metrics {metrics.to_dict()}")
+    return results
+
+
+@click.command()
+@click.argument("revision_range")
+@click.option(
+    "--coverage-dir",
+    help="Path to the saved coverage data.\n"
+    "Set a default path by setting the below in ~/.partialtesting:\n"
+    "[coverage]\ndir=<path>",
+)
+@click.option(
+    "--project-name",
+    required=True,
+    help="Project name (e.g. numpy). It should match the directory containing coverage data",
+)
+@click.option(
+    "--special-files",
+    default=pt.SPECIAL_FILES_DEFAULT,
+    help=f"Files that trigger a full test run. Default: {pt.SPECIAL_FILES_DEFAULT}",
+)
+@click.option(
+    "--special-extensions",
+    default=pt.SPECIAL_EXTENSIONS_DEFAULT,
+    help=f"Extensions that trigger a full test run. Default: {pt.SPECIAL_EXTENSIONS_DEFAULT}",
+)
+@click.option(
+    "--output-file",
+    default="-",
+    type=click.File("w"),
+    help="JSON Lines file with the selection of each commit. Default: stdout",
+)
+@click.option(
+    "--line-coverage",
+    is_flag=True,
+    help="If recording line coverage instead of "
+    "branch coverage (coverage run --branch) ",
+)
+@click.option(
+    "--log-level",
+    default="WARNING",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: WARNING",
+)
+def main(
+    revision_range,
+    coverage_dir,
+    project_name,
+    special_files,
+    special_extensions,
+    output_file,
+    line_coverage,
+    log_level,
+):
+    """
+    Select the tests of every commit in REVISION_RANGE (e.g. A..B) in one pass,
+    for bisecting or stacked PRs. One JSON line is written per commit (oldest first).
+    """
+    coverage_dir = pt.get_coverage_dir(coverage_dir)
+
+    # logs go to stderr, stdout may hold the selections
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, log_level))
+    if isinstance(special_files, str):
+        special_files = pt.str_to_list(special_files)
+
+    if isinstance(special_extensions, str):
+        special_extensions = pt.str_to_list(special_extensions)
+
+    detect_relevant_tests_for_range(
+        revision_range,
+        project_name,
+        coverage_dir,
+        output_file,
+        special_files,
+        special_extensions,
+        line_coverage,
+    )
+
+
+if __name__ == "__main__":
+    main()
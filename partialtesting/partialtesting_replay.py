@@ -0,0 +1,403 @@
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import click
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_history import CoFailureModel
+from partialtesting.partialtesting_results import read_junit_results
+
+
+def git_merge_commits(branch=pt.DEFAULT_BRANCH_TO_COMPARE, max_count=100):
+    """
+    The latest merge commits of branch (newest first) as [(sha, commit timestamp), ...]
+    """
+    git_output, _ = pt.run_sh_cmd(
+        ["git", "log", "--merges", "--first-parent", f"--max-count={max_count}", "--format=%H %ct", branch]
+    )
+    merges = []
+    for line in git_output.splitlines():
+        sha, timestamp = line.split()
+        merges.append((sha, int(timestamp)))
+    return merges
+
+
+def git_merged_changes(merge_commit):
+    """
+    Changes brought by a merge commit: diff with its first parent
+    """
+    git_output, _ = pt.run_sh_cmd(["git", "diff", "--name-status", f"{merge_commit}^1", merge_commit])
+    return pt.parse_git_diff_name_status(git_output)
+
+
+@contextmanager
+def detached_worktree():
+    """
+    A detached git worktree of the repository in a temporary directory,
+    removed on exit. Checking out each replayed commit there gives the
+    selection the tree (test definitions, rules files, setup.py, etc.) of that commit
+    """
+    path = tempfile.mkdtemp(prefix="pt_replay")
+    subprocess.run(
+        ["git", "worktree", "add", "--detach", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    try:
+        yield path
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def checkout(commit):
+    subprocess.run(
+        ["git", "checkout", "--quiet", "--detach", commit], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+
+
+def build_at(project_dir, timestamp):
+    """
+    Newest coverage build of the project published before timestamp, None if there is none
+    """
+    builds = [
+        (os.path.getmtime(os.path.join(project_dir, name)), name)
+        for name in os.listdir(project_dir)
+        if not name.startswith(".") and os.path.isfile(os.path.join(project_dir, name, pt.COVERAGE_FILE))
+    ]
+    builds = [build for build in builds if build[0] <= timestamp]
+    return max(builds)[1] if builds else None
+
+
+def junit_results_for_commit(junit_dir, commit):
+    """
+    Recorded JUnit results of a commit: <junit_dir>/<sha>.xml or <junit_dir>/<sha>/**/*.xml
+    """
+    junit_files = glob.glob(os.path.join(junit_dir, f"{commit}.xml")) + glob.glob(
+        os.path.join(junit_dir, commit, "**", "*.xml"), recursive=True
+    )
+    results = []
+    for junit_file in sorted(junit_files):
+        results.extend(read_junit_results(junit_file))
+    return results
+
+
+def evaluate_selection(files_to_test, results):
+    """
+    Compare a selection (None for a full test) with the JUnit results of the full run
+    """
+    selected = [
+        result for result in results if files_to_test is None or result.test_file in files_to_test
+    ]
+    failing = [result for result in results if result.failed]
+    failing_selected = [result for result in selected if result.failed]
+
+    return {
+        "full_test": files_to_test is None,
+        "tests": len(results),
+        "tests_selected": len(selected),
+        "tests_skipped": len(results) - len(selected),
+        "cpu_minutes_saved": (sum(r.seconds for r in results) - sum(r.seconds for r in selected)) / 60,
+        "failing_tests": len(failing),
+        "failing_tests_selected": len(failing_selected),
+        "missed_failures": sorted(f"{r.test_file}::{r.name}" for r in failing if r not in failing_selected),
+    }
+
+
+def summarize(replays):
+    """
+    Totals over all the replayed merges, recall being the share of failing tests that were selected
+    """
+    evaluated = [replay for replay in replays if "tests" in replay]
+    latencies = sorted(replay["selector_seconds"] for replay in evaluated)
+    failing = sum(replay["failing_tests"] for replay in evaluated)
+    failing_selected = sum(replay["failing_tests_selected"] for replay in evaluated)
+
+    return {
+        "merges": len(replays),
+        "merges_evaluated": len(evaluated),
+        "full_tests": sum(replay["full_test"] for replay in evaluated),
+        "tests": sum(replay["tests"] for replay in evaluated),
+        "tests_selected": sum(replay["tests_selected"] for replay in evaluated),
+        "tests_skipped": sum(replay["tests_skipped"] for replay in evaluated),
+        "cpu_minutes_saved": sum(replay["cpu_minutes_saved"] for replay in evaluated),
+        "failing_tests": failing,
+        "failing_tests_selected": failing_selected,
+        "recall": failing_selected / failing if failing else None,
+        "selector_seconds_mean": sum(latencies) / len(latencies) if latencies else None,
+        "selector_seconds_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+    }
+
+
+def replay(
+    project_name,
+    coverage_dir,
+    junit_dir,
+    output,
+    branch=pt.DEFAULT_BRANCH_TO_COMPARE,
+    max_count=100,
+    special_files=pt.SPECIAL_FILES_DEFAULT,
+    special_extensions=pt.SPECIAL_EXTENSIONS_DEFAULT,
+    line_coverage=False,
+    max_contexts=None,
+    max_selected_percent=None,
+    skip_non_semantic_changes=False,
+    history_file=None,
+    history_defer_below=None,
+):
+    """
+    Replay the test selection of the latest merge commits of branch, each one
+    against the coverage build that was the latest when it was merged, and
+    compare it with the JUnit results recorded for the merge commit.
+    Each merge commit is checked out in a detached worktree and selected by
+    detect_relevant_tests() with the given options, against its first parent.
+    One JSON line is written to output per merge, then the summary (see summarize())
+    """
+    # the selections run from the worktree
+    coverage_dir = os.path.abspath(coverage_dir)
+    junit_dir = os.path.abspath(junit_dir)
+    history_file = os.path.abspath(history_file) if history_file else None
+    project_dir = os.path.join(coverage_dir, project_name)
+    merges = list(reversed(git_merge_commits(branch, max_count)))
+    replays = []
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="pt_replay_output") as output_dir, detached_worktree() as worktree:
+        os.chdir(worktree)
+        try:
+            for commit, timestamp in merges:
+                build = build_at(project_dir, timestamp)
+                results = junit_results_for_commit(junit_dir, commit)
+                replayed = {"commit": commit, "build": build}
+
+                if build is None or not results:
+                    logging.info(f"Partial Testing: no coverage build or JUnit results for {commit}, skipping it")
+                else:
+                    checkout(commit)
+                    start = time.perf_counter()
+                    files_to_test = pt.detect_relevant_tests(
+                        project_name,
+                        coverage_dir,
+                        True,
+                        special_files,
+                        special_extensions,
+                        os.path.join(output_dir, pt.TEST_FILES_TO_RUN_ALL_STAGES),
+                        f"{commit}^1",
+                        line_coverage,
+                        max_contexts=max_contexts,
+                        max_selected_percent=max_selected_percent,
+                        skip_non_semantic_changes=skip_non_semantic_changes,
+                        history_file=history_file,
+                        history_defer_below=history_defer_below,
+                        build_number=build,
+                    )
+                    replayed["selector_seconds"] = time.perf_counter() - start
+                    replayed.update(evaluate_selection(files_to_test, results))
+
+                replays.append(replayed)
+                output.write(json.dumps(replayed) + "\n")
+        finally:
+            os.chdir(cwd)
+
+    summary = summarize(replays)
+    output.write(json.dumps({"summary": summary}) + "\n")
+    return summary
+
+
+def train_cofailure_model(junit_dir, branch=pt.DEFAULT_BRANCH_TO_COMPARE, max_count=1000):
+    """
+    Count, over the latest merge commits of branch with recorded JUnit results,
+    which test files failed when which files changed (see partialtesting_history)
+    """
+    model = CoFailureModel()
+    trained = 0
+    for commit, _ in reversed(git_merge_commits(branch, max_count)):
+        results = junit_results_for_commit(junit_dir, commit)
+        if not results:
+            continue
+        changed_files = git_merged_changes(commit)
+        changed_paths = [file.path for file in changed_files]
+        changed_paths += [file.new_path for file in changed_files if file.new_path]
+        model.add_run(changed_paths, results)
+        trained += 1
+
+    logging.info(f"Partial Testing: trained the co-failure model on {trained} merge commits")
+    return model
+
+
+@click.command()
+@click.option(
+    "--coverage-dir",
+    help="Path to the saved coverage data.\n"
+    "Set a default path by setting the below in ~/.partialtesting:\n"
+    "[coverage]\ndir=<path>",
+)
+@click.option(
+    "--project-name",
+    required=True,
+    help="Project name (e.g. numpy). It should match the directory containing coverage data",
+)
+@click.option(
+    "--junit-dir",
+    required=True,
+    help="JUnit results of the full runs: <junit_dir>/<sha>.xml or <junit_dir>/<sha>/**/*.xml",
+)
+@click.option(
+    "--branch",
+    default=pt.DEFAULT_BRANCH_TO_COMPARE,
+    help=f"Branch whose merge commits are replayed. Default: {pt.DEFAULT_BRANCH_TO_COMPARE}",
+)
+@click.option(
+    "--max-count",
+    default=100,
+    help="Number of merge commits to replay. Default: 100",
+)
+@click.option(
+    "--special-files",
+    default=pt.SPECIAL_FILES_DEFAULT,
+    help=f"Files that trigger a full test run. Default: {pt.SPECIAL_FILES_DEFAULT}",
+)
+@click.option(
+    "--special-extensions",
+    default=pt.SPECIAL_EXTENSIONS_DEFAULT,
+    help=f"Extensions that trigger a full test run. Default: {pt.SPECIAL_EXTENSIONS_DEFAULT}",
+)
+@click.option(
+    "--output-file",
+    default="-",
+    type=click.File("w"),
+    help="JSON Lines report, one line per merge then the summary. Default: stdout",
+)
+@click.option(
+    "--line-coverage",
+    is_flag=True,
+    help="If recording line coverage instead of "
+    "branch coverage (coverage run --branch) ",
+)
+@click.option(
+    "--max-contexts",
+    default=None,
+    type=int,
+    help="Same as partialtesting --max-contexts",
+)
+@click.option(
+    "--max-selected-percent",
+    default=None,
+    type=float,
+    help="Same as partialtesting --max-selected-percent",
+)
+@click.option(
+    "--skip-non-semantic-changes",
+    is_flag=True,
+    help="Same as partialtesting --skip-non-semantic-changes",
+)
+@click.option(
+    "--history-file",
+    default=None,
+    help="Same as partialtesting --history-file",
+)
+@click.option(
+    "--history-defer-below",
+    default=None,
+    type=float,
+    help="Same as partialtesting --history-defer-below, the deferred test files count as skipped",
+)
+@click.option(
+    "--log-level",
+    default="WARNING",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: WARNING",
+)
+def main(
+    coverage_dir,
+    project_name,
+    junit_dir,
+    branch,
+    max_count,
+    special_files,
+    special_extensions,
+    output_file,
+    line_coverage,
+    max_contexts,
+    max_selected_percent,
+    skip_non_semantic_changes,
+    history_file,
+    history_defer_below,
+    log_level,
+):
+    """
+    Measure what partialtesting would have saved and missed on past merges:
+    tests selected/skipped, CPU-minutes saved, recall on the failing tests
+    and selector latency
+    """
+    coverage_dir = pt.get_coverage_dir(coverage_dir)
+
+    # logs go to stderr, stdout may hold the report
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, log_level))
+    if isinstance(special_files, str):
+        special_files = pt.str_to_list(special_files)
+
+    if isinstance(special_extensions, str):
+        special_extensions = pt.str_to_list(special_extensions)
+
+    replay(
+        project_name,
+        coverage_dir,
+        junit_dir,
+        output_file,
+        branch,
+        max_count,
+        special_files,
+        special_extensions,
+        line_coverage,
+        max_contexts,
+        max_selected_percent,
+        skip_non_semantic_changes,
+        history_file,
+        history_defer_below,
+    )
+
+
+@click.command()
+@click.option(
+    "--junit-dir",
+    required=True,
+    help="JUnit results of the full runs: <junit_dir>/<sha>.xml or <junit_dir>/<sha>/**/*.xml",
+)
+@click.option(
+    "--branch",
+    default=pt.DEFAULT_BRANCH_TO_COMPARE,
+    help=f"Branch whose merge commits are trained on. Default: {pt.DEFAULT_BRANCH_TO_COMPARE}",
+)
+@click.option(
+    "--max-count",
+    default=1000,
+    help="Number of merge commits to train on. Default: 1000",
+)
+@click.option(
+    "--history-file",
+    required=True,
+    help="Where to write the model, the same as partialtesting --history-file",
+)
+@click.option(
+    "--log-level",
+    default="INFO",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: INFO",
+)
+def train_main(junit_dir, branch, max_count, history_file, log_level):
+    """
+    Train the co-failure model of partialtesting --history-file on the
+    JUnit results recorded for past merges and the files they changed
+    """
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, log_level))
+
+    train_cofailure_model(junit_dir, branch, max_count).save(history_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import fnmatch
+import logging
+import re
+
+from partialtesting.partialtesting_rules import read_config_section
+
+# sections of the project-level rules file (see partialtesting_rules.read_config_section):
+#   [resources]
+#   postgres = tests/integration_db/*
+#   [resource_markers]
+#   postgres = postgres, db
+RESOURCES_SECTION = "resources"
+RESOURCE_MARKERS_SECTION = "resource_markers"
+# '@pytest.mark.postgres', 'pytestmark = [pytest.mark.postgres]', '@mark.postgres'
+MARKER_RE = re.compile(r"\bmark\.(\w+)")
+
+
+def file_markers(path):
+    """
+    Names of the pytest markers used in a test file, found statically (without importing it)
+    """
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return set(MARKER_RE.findall(f.read()))
+    except OSError:
+        return set()
+
+
+class ResourceRules:
+    """
+    Which test files need which stage and which resources (e.g. a database):
+    - stages: the stage of a test file is the first directory of its path named
+    after one ('tests/integration_db/test_x.py' -> 'integration_db'). The stage
+    running the other test files is unknown: they need every stage
+    - paths: {resource: [glob patterns of the test files needing it]}
+    - markers: {resource: [pytest markers of the tests needing it]}
+    """
+
+    def __init__(self, stages=(), paths=None, markers=None):
+        self.stages = list(stages)
+        self.paths = paths or {}
+        self.markers = {resource: set(names) for resource, names in (markers or {}).items()}
+
+    @classmethod
+    def load(cls, stages=(), repo_dir="."):
+        return cls(
+            stages,
+            read_config_section(RESOURCES_SECTION, repo_dir),
+            read_config_section(RESOURCE_MARKERS_SECTION, repo_dir),
+        )
+
+    def resources(self):
+        return sorted(set(self.paths) | set(self.markers))
+
+    def stage_of(self, test_file):
+        return next((part for part in test_file.split("/")[:-1] if part in self.stages), None)
+
+    def resources_of(self, test_file):
+        resources = {
+            resource
+            for resource, patterns in self.paths.items()
+            if any(fnmatch.fnmatchcase(test_file, pattern) for pattern in patterns)
+        }
+        if self.markers:
+            markers = file_markers(test_file)
+            resources.update(resource for resource, names in self.markers.items() if names & markers)
+        return resources
+
+    def manifest(self, files_to_test):
+        """
+        What a selection (None for a full test) needs, for CI to only provision that:
+        {"full_test": bool,
+         "stages": {"<stage>": {"needed": bool, "test_files": [...]}, ...},
+         "resources": {"<resource>": {"needed": bool, "test_files": [...]}, ...}}
+        A full test needs everything, the test files are then left empty.
+        Test files without a stage (see stage_of()) are listed in every stage
+        """
+        stages = {stage: [] for stage in self.stages}
+        resources = {resource: [] for resource in self.resources()}
+        for test_file in sorted(files_to_test or ()):
+            stage = self.stage_of(test_file)
+            if stage is not None:
+                stages[stage].append(test_file)
+            else:
+                for stage_test_files in stages.values():
+                    stage_test_files.append(test_file)
+            for resource in self.resources_of(test_file):
+                resources[resource].append(test_file)
+
+        full_test = files_to_test is None
+        if not full_test:
+            needed = sorted(resource for resource, test_files in resources.items() if test_files)
+            logging.info(f"Partial Testing: the selection needs the resources {needed}")
+        return {
+            "full_test": full_test,
+            "stages": {
+                stage: {"needed": full_test or bool(test_files), "test_files": test_files}
+                for stage, test_files in stages.items()
+            },
+            "resources": {
+                resource: {"needed": full_test or bool(test_files), "test_files": test_files}
+                for resource, test_files in resources.items()
+            },
+        }
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+
+import click
+
+from partialtesting.partialtesting_cache import DEFAULT_MAX_SIZE_MB, ResultCache
+from partialtesting.partialtesting_db import close_connections, get_connection
+from partialtesting.partialtesting_deps import COVERED_TABLES, is_dependency_file
+from partialtesting.partialtesting_index import TestDefinitionIndex, get_test_func_name
+from partialtesting.partialtesting_rules import load_rules
+
+# bump when the footprint digest changes so that old pass records are not reused
+PASS_RECORD_VERSION = 2
+MISSING_FILE = "missing"
+# stay under SQLITE_MAX_VARIABLE_NUMBER of old SQLite versions
+MAX_SQL_VARIABLES = 900
+# contexts of pytest --cov-context=test: 'tests/test_x.py::TestX::test_a[1]|run'
+PYTEST_COV_CONTEXT_RE = re.compile(r"^(?P<module>[^:|]+)\.py::(?P<name>[^\[|]+)(?:\[.*\])?(?:\|\w+)?$")
+
+TestResult = namedtuple("TestResult", "test_file name seconds failed")
+TestResult.__test__ = False  # not a pytest test class
+
+
+def _test_file_of(testcase):
+    """
+    Test file of a JUnit testcase: its 'file' attribute (pytest xunit1) or the longest
+    module path of its classname found on disk ('tests.unit.test_x.TestClass')
+    """
+    if testcase.get("file"):
+        return os.path.normpath(testcase.get("file"))
+
+    parts = testcase.get("classname", "").split(".")
+    for end in range(len(parts), 0, -1):
+        path = f"{os.path.join(*parts[:end])}.py"
+        if os.path.isfile(path):
+            return path
+    return f"{os.path.join(*parts)}.py" if parts and parts[0] else ""
+
+
+def read_junit_results(junit_file):
+    results = []
+    for testcase in ElementTree.parse(junit_file).getroot().iter("testcase"):
+        failed = any(child.tag in ("failure", "error") for child in testcase)
+        results.append(
+            TestResult(
+                _test_file_of(testcase),
+                testcase.get("name"),
+                float(testcase.get("time") or 0),
+                failed,
+            )
+        )
+    return results
+
+
+def _git_z(command):
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return [entry for entry in result.stdout.decode("utf-8").split("\0") if entry]
+
+
+def git_content_hashes():
+    """
+    {path: git blob sha} of the tracked files as they are in the working tree:
+    the index from 'git ls-files', then 'git hash-object' for the locally modified files
+    """
+    hashes = {}
+    for entry in _git_z(["git", "ls-files", "-s", "-z"]):
+        # '<mode> <sha> <stage>\t<path>'
+        info, _, path = entry.partition("\t")
+        hashes[path] = info.split()[1]
+
+    modified = []
+    for path in _git_z(["git", "ls-files", "-m", "-z"]):
+        if os.path.isfile(path):
+            modified.append(path)
+        else:
+            hashes.pop(path, None)  # deleted
+
+    if modified:
+        result = subprocess.run(
+            ["git", "hash-object", "--stdin-paths"],
+            input="".join(f"{path}\n" for path in modified).encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        hashes.update(zip(modified, result.stdout.decode("utf-8").split()))
+
+    return hashes
+
+
+def environment_fingerprint(content_hashes):
+    """
+    Digest of what the tests ran with besides the repository's code:
+    the interpreter, the platform and the dependency (requirements, lock) files
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{PASS_RECORD_VERSION}\0{sys.implementation.name}\0{sys.version}\0".encode("utf-8"))
+    digest.update(f"{sys.platform}\0{platform.machine()}\0".encode("utf-8"))
+    for path in sorted(path for path in content_hashes if is_dependency_file(path)):
+        digest.update(f"{path}\0{content_hashes[path]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def normalize_context(context):
+    """
+    A context recorded by pytest-cov ('tests/test_x.py::TestX::test_a[1]|run') in
+    the format of coverage's dynamic_context = test_function ('tests.test_x.TestX.test_a'),
+    the other contexts are returned as they are
+    """
+    match = PYTEST_COV_CONTEXT_RE.match(context)
+    if match is None:
+        return context
+    return f"{match.group('module').replace('/', '.')}.{match.group('name').replace('::', '.')}"
+
+
+def read_contexts_by_name(coverage_db_path):
+    """
+    {test function name: {context id: context}} of the coverage DB
+    """
+    contexts_by_name = {}
+    cursor = get_connection(coverage_db_path).execute("SELECT id, context FROM context WHERE context != ''")
+    for context_id, context in cursor:
+        contexts_by_name.setdefault(get_test_func_name(context), {})[context_id] = context
+    return contexts_by_name
+
+
+def read_covered_paths(coverage_db_path, context_ids):
+    """
+    {context id: {covered path as recorded}} from one query per chunk of contexts
+    """
+    db = get_connection(coverage_db_path)
+    tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    covered = " UNION ".join(
+        f"SELECT context_id, file_id FROM {table}" for table in COVERED_TABLES if table in tables
+    )
+
+    paths = {}
+    context_ids = sorted(context_ids)
+    for start in range(0, len(context_ids), MAX_SQL_VARIABLES):
+        chunk = context_ids[start:start + MAX_SQL_VARIABLES]
+        cursor = db.execute(
+            f"SELECT DISTINCT covered.context_id, file.path FROM ({covered}) AS covered "
+            "JOIN file ON file.id = covered.file_id "
+            f"WHERE covered.context_id IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        )
+        for context_id, path in cursor:
+            paths.setdefault(context_id, set()).add(path)
+    return paths
+
+
+class Footprints:
+    """
+    Footprint of the tests of a coverage build: for every context, the
+    content hashes of the files it covered and of the test files defining it,
+    plus the environment fingerprint, digested into one key
+    """
+
+    def __init__(self, coverage_db_path, test_index, content_hashes=None):
+        self.coverage_db_path = coverage_db_path
+        self.test_index = test_index
+        self.content_hashes = content_hashes if content_hashes is not None else git_content_hashes()
+        self.environment = environment_fingerprint(self.content_hashes)
+        self._repo_paths = {}
+        self._contexts_by_name = None
+
+    def repo_path(self, db_path):
+        """
+        Path of a covered file relative to the repository: the longest suffix of
+        the recorded (often absolute, CI workspace) path that is a tracked file.
+        None for files outside the repository (e.g. site-packages)
+        """
+        if db_path not in self._repo_paths:
+            parts = db_path.replace("\\", "/").split("/")
+            self._repo_paths[db_path] = next(
+                (
+                    "/".join(parts[start:])
+                    for start in range(len(parts))
+                    if "/".join(parts[start:]) in self.content_hashes
+                ),
+                None,
+            )
+        return self._repo_paths[db_path]
+
+    def contexts_by_name(self):
+        if self._contexts_by_name is None:
+            self._contexts_by_name = read_contexts_by_name(self.coverage_db_path)
+        return self._contexts_by_name
+
+    def covered_paths(self, context_ids):
+        return read_covered_paths(self.coverage_db_path, context_ids)
+
+    def covered_files(self, covered_paths, test_files):
+        """
+        {repo path: content hash} of the covered files and of the test files
+        """
+        paths = {self.repo_path(path) for path in covered_paths} - {None}
+        paths.update(test_files)
+        return {path: self.content_hashes.get(path, MISSING_FILE) for path in paths}
+
+    def contexts(self):
+        """
+        {context: {context ids}} of the coverage DB, the contexts of pytest-cov
+        (one per phase and parameter of a test) normalized (see normalize_context())
+        """
+        contexts = {}
+        for name_contexts in self.contexts_by_name().values():
+            for context_id, context in name_contexts.items():
+                contexts.setdefault(normalize_context(context), set()).add(context_id)
+        return contexts
+
+    def digest(self, context, covered_paths, test_files):
+        digest = hashlib.sha256(f"{self.environment}\0{context}\n".encode("utf-8"))
+        for path, content_hash in sorted(self.covered_files(covered_paths, test_files).items()):
+            digest.update(f"{path}\0{content_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def digests(self, test_files):
+        """
+        {test file: {context: digest}} of the tests defined in test_files.
+        A test file maps to None when one of its tests is not in the coverage data
+        (e.g. a new test): it cannot be skipped
+        """
+        test_files = set(test_files)
+        names_by_file = {}
+        for name, files in self.test_index.definitions.items():
+            if not name.startswith("test"):
+                continue  # helpers and Test* classes, their methods are indexed too
+            for test_file in files & test_files:
+                names_by_file.setdefault(test_file, set()).add(name)
+
+        contexts_by_name = self.contexts_by_name()
+        context_ids = {
+            context_id
+            for names in names_by_file.values()
+            for name in names
+            for context_id in contexts_by_name.get(name, ())
+        }
+        covered_paths = self.covered_paths(context_ids)
+
+        digests = {}
+        for test_file in test_files:
+            names = names_by_file.get(test_file)
+            if not names or any(name not in contexts_by_name for name in names):
+                digests[test_file] = None
+                continue
+            digests[test_file] = {
+                context: self.digest(
+                    context, covered_paths.get(context_id, ()), self.test_index.definitions[name]
+                )
+                for name in names
+                for context_id, context in contexts_by_name[name].items()
+            }
+        return digests
+
+
+class TestResultCache(ResultCache):
+    """
+    Pass records of tests (coverage contexts), one small JSON file per
+    footprint digest (see Footprints) holding the content hashes of the files
+    the test covered in the run that passed. A test whose digest has a record
+    whose files are all unchanged already passed with the same code and
+    environment and does not need to run.
+    """
+
+    __test__ = False  # not a pytest test class
+
+    def has_pass(self, digest, content_hashes):
+        path = self._path(digest)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if any(content_hashes.get(file, MISSING_FILE) != sha for file, sha in entry.get("files", {}).items()):
+            return False
+
+        os.utime(path, None)  # mark it as recently used
+        return True
+
+    def record_pass(self, digest, context, files):
+        self._write(digest, {"context": context, "files": files})
+
+
+def drop_cached_passes(test_files, footprints, test_result_cache):
+    """
+    Test files whose tests did not all pass already with the same footprint
+    """
+    to_run = set()
+    for test_file, digests in footprints.digests(test_files).items():
+        if digests is None or not all(
+            test_result_cache.has_pass(digest, footprints.content_hashes) for digest in digests.values()
+        ):
+            to_run.add(test_file)
+        else:
+            logging.info(f"Partial Testing: every test of {test_file} already passed, skipping it")
+    return to_run
+
+
+def record_passes(results, footprints, test_result_cache, run_footprints):
+    """
+    Record a pass for the contexts whose tests all passed in the JUnit results
+    (parametrized tests included), in every test file defining them.
+    footprints is the coverage build the selection was made with (the digests),
+    run_footprints the coverage of the run that produced the results: the files
+    recorded with a pass are the ones the test covered in that run, including
+    the files the change made it import. Contexts missing from the run's
+    coverage are not recorded. Returns the number of contexts recorded
+    """
+    passed = {}
+    for result in results:
+        key = (result.test_file, result.name.partition("[")[0])
+        passed[key] = passed.get(key, True) and not result.failed
+
+    run_contexts = run_footprints.contexts()
+    to_record = []
+    test_files = {test_file for test_file, _ in passed}
+    for test_file, digests in footprints.digests(test_files).items():
+        for context, digest in (digests or {}).items():
+            name = get_test_func_name(context)
+            defining_files = footprints.test_index.definitions.get(name, ())
+            if context not in run_contexts:
+                logging.debug(f"Partial Testing: {context} is not in the coverage of the run, not recording it")
+            elif defining_files and all(passed.get((path, name)) for path in defining_files):
+                to_record.append((digest, context, defining_files))
+
+    run_covered_paths = run_footprints.covered_paths(
+        set().union(*(run_contexts[context] for _, context, _ in to_record))
+    )
+    for digest, context, defining_files in to_record:
+        covered_paths = set().union(*(run_covered_paths.get(context_id, ()) for context_id in run_contexts[context]))
+        files = run_footprints.covered_files(covered_paths, defining_files)
+        test_result_cache.record_pass(digest, context, files)
+
+    test_result_cache.evict()
+    return len(to_record)
+
+
+@click.command()
+@click.option(
+    "--coverage-file",
+    required=True,
+    help="Coverage data the selection was made with (<coverage_dir>/<project>/<build>/.coverage)",
+)
+@click.option(
+    "--run-coverage-file",
+    required=True,
+    help="Coverage data of the run that produced the JUnit results, with test contexts "
+    "(pytest --cov-context=test)",
+)
+@click.option(
+    "--junit-file",
+    required=True,
+    multiple=True,
+    help="JUnit results of the run (pytest --junitxml), can be given several times",
+)
+@click.option(
+    "--test-result-cache-dir",
+    required=True,
+    help="Where the pass records are stored, the same as partialtesting --test-result-cache-dir",
+)
+@click.option(
+    "--test-result-cache-max-size",
+    default=DEFAULT_MAX_SIZE_MB,
+    help=f"Maximum size (MB) of the pass records, least recently used records "
+    f"are evicted first. Default: {DEFAULT_MAX_SIZE_MB}",
+)
+@click.option(
+    "--log-level",
+    default="INFO",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+    help="Logging level. Default: INFO",
+)
+def main(coverage_file, run_coverage_file, junit_file, test_result_cache_dir, test_result_cache_max_size, log_level):
+    """
+    Record the tests that passed in a run, keyed by the content of every file
+    they covered and by the environment, so that partialtesting
+    --test-result-cache-dir skips them until one of those files changes.
+    Run it from the repository root once the selected tests ran
+    """
+    logging.basicConfig(level=getattr(logging, log_level))
+
+    results = []
+    for path in junit_file:
+        results.extend(read_junit_results(path))
+
+    test_index = TestDefinitionIndex.load(load_rules([], []).test_dirs())
+    content_hashes = git_content_hashes()
+    try:
+        recorded = record_passes(
+            results,
+            Footprints(coverage_file, test_index, content_hashes),
+            TestResultCache(test_result_cache_dir, test_result_cache_max_size),
+            Footprints(run_coverage_file, test_index, content_hashes),
+        )
+    finally:
+        close_connections()
+    logging.info(f"Partial Testing: recorded the pass of {recorded} tests in {test_result_cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
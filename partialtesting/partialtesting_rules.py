@@ -0,0 +1,240 @@
+import configparser
+import fnmatch
+import glob
+import logging
+import os
+import re
+from enum import Enum
+
+try:
+    import tomllib  # python >= 3.11
+except ImportError:  # pragma: no cover
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# project-level rules files, looked up in the root of the git repository
+RULES_FILE = ".partialtesting"
+PYPROJECT_FILE = "pyproject.toml"
+RULES_SECTION = "rules"
+
+DEFAULT_CODE_PATTERNS = ["*.py"]
+DEFAULT_NO_TESTS_PATTERNS = ["*.md", "*.rst", "*.tex", "*.txt"]
+DEFAULT_TEST_ROOT_PATTERNS = ["tests/*"]
+# conftest.py (pytest) looks like a code file but affects how every test runs
+DEFAULT_SPECIAL_PATTERNS = ["*conftest.py"]
+
+
+class FileClass(Enum):
+    SPECIAL = 1  # changes require a full test
+    CODE = 2  # changes require a coverage lookup
+    NO_TESTS = 3  # changes do not require any tests
+    UNKNOWN = 4  # not matched by any rule, requires a full test
+
+
+def _compile(patterns_by_class):
+    """
+    Compile fnmatch-style patterns (where '*' also matches '/') into a single
+    regex. Each pattern becomes a named alternative, the first one that
+    matches wins, so classes listed first take precedence
+    """
+    alternatives = []
+    group_classes = {}
+    for file_class, patterns in patterns_by_class:
+        for pattern in patterns:
+            group = f"g{len(alternatives)}"
+            group_classes[group] = file_class
+            alternatives.append(f"(?P<{group}>{fnmatch.translate(pattern)})")
+
+    if not alternatives:
+        return None, group_classes
+    return re.compile("|".join(alternatives)), group_classes
+
+
+def _static_prefix(pattern):
+    """
+    Directory part of a pattern before its first wildcard: 'tests/unit/*' -> 'tests/unit'
+    """
+    prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+    return prefix.rpartition("/")[0] or "."
+
+
+class Rules:
+    """
+    Classification rules for the changed files, as glob patterns:
+    - special: files that require a full test when changed
+    - code: files whose tests are found through the coverage data
+    - no_tests: files that do not require any tests (e.g. docs)
+    - test_roots: files that belong to the test suite
+    - project_special: the special patterns set in the project-level rules file,
+    which are always honored (e.g. over the dependency-only changes of a lock file)
+    - dependency_files: dependency files besides the ones of the project root
+    (see partialtesting_deps.is_dependency_file), e.g. 'projects/*/setup.py'
+    Patterns are compiled once, so that each file is classified in one match.
+    """
+
+    def __init__(
+        self,
+        special=DEFAULT_SPECIAL_PATTERNS,
+        code=DEFAULT_CODE_PATTERNS,
+        no_tests=DEFAULT_NO_TESTS_PATTERNS,
+        test_roots=DEFAULT_TEST_ROOT_PATTERNS,
+        project_special=(),
+        dependency_files=(),
+    ):
+        self.special = list(special)
+        self.code = list(code)
+        self.no_tests = list(no_tests)
+        self.test_roots = list(test_roots)
+        self.project_special = list(project_special)
+        self.dependency_files = list(dependency_files)
+
+        self._matcher, self._group_classes = _compile(
+            [
+                (FileClass.SPECIAL, self.special),
+                (FileClass.CODE, self.code),
+                (FileClass.NO_TESTS, self.no_tests),
+            ]
+        )
+        self._test_roots_matcher, _ = _compile([(True, self.test_roots)])
+        self._project_special_matcher, _ = _compile([(True, self.project_special)])
+        self._dependency_files_matcher, _ = _compile([(True, self.dependency_files)])
+
+    @classmethod
+    def from_defaults(cls, special_files, special_extensions, **overrides):
+        """
+        Rules equivalent to the --special-files/--special-extensions options:
+        special files match their exact path, extensions match any file ending with them
+        """
+        special = (
+            list(special_files)
+            + [f"*{extension}" for extension in special_extensions]
+            + overrides.pop("special", DEFAULT_SPECIAL_PATTERNS)
+        )
+        return cls(special=special, **overrides)
+
+    def classify(self, path):
+        match = self._matcher.match(path) if self._matcher else None
+        if match is None:
+            return FileClass.UNKNOWN
+        return self._group_classes[match.lastgroup]
+
+    def is_test_file(self, path):
+        return bool(self._test_roots_matcher and self._test_roots_matcher.match(path))
+
+    def is_project_special(self, path):
+        return bool(self._project_special_matcher and self._project_special_matcher.match(path))
+
+    def is_dependency_file(self, path):
+        return bool(self._dependency_files_matcher and self._dependency_files_matcher.match(path))
+
+    def test_dirs(self):
+        """
+        Directories containing the test suite, where test definitions are looked up
+        """
+        return sorted({_static_prefix(pattern) for pattern in self.test_roots})
+
+    def with_code_paths(self, paths):
+        """
+        Copy of the rules where the given files (exact paths) are also code files
+        """
+        return Rules(
+            special=self.special,
+            code=self.code + [glob.escape(path) for path in paths],
+            no_tests=self.no_tests,
+            test_roots=self.test_roots,
+            project_special=self.project_special,
+            dependency_files=self.dependency_files,
+        )
+
+    def to_dict(self):
+        return {
+            "special": self.special,
+            "code": self.code,
+            "no_tests": self.no_tests,
+            "test_roots": self.test_roots,
+            "dependency_files": self.dependency_files,
+        }
+
+
+def _split_patterns(value):
+    # INI values: comma and/or newline separated
+    return [pattern.strip() for pattern in re.split(r"[,\n]", value) if pattern.strip()]
+
+
+def read_config_section(section, repo_dir="."):
+    """
+    Read a [<section>] of <repo_dir>/.partialtesting, or else the
+    [tool.partialtesting.<section>] table of <repo_dir>/pyproject.toml.
+    Returns a dict of lists, empty if the section is not set
+    """
+    config = {}
+
+    rules_file = os.path.join(repo_dir, RULES_FILE)
+    pyproject_file = os.path.join(repo_dir, PYPROJECT_FILE)
+
+    if os.path.isfile(rules_file):
+        parser = configparser.ConfigParser()
+        # keys can be project or resource names, keep their case
+        parser.optionxform = str
+        parser.read(rules_file)
+        if parser.has_section(section):
+            config = {key: _split_patterns(value) for key, value in parser[section].items()}
+    elif os.path.isfile(pyproject_file):
+        if tomllib is None:
+            logging.warning(
+                f"Partial Testing: install 'tomli' to read the [{section}] in {pyproject_file}"
+            )
+        else:
+            with open(pyproject_file, "rb") as f:
+                pyproject = tomllib.load(f)
+            config = pyproject.get("tool", {}).get("partialtesting", {}).get(section, {})
+            config = {
+                key: [value] if isinstance(value, str) else list(value) for key, value in config.items()
+            }
+
+    return config
+
+
+def read_rules_config(repo_dir="."):
+    """
+    Read the project-level rules from <repo_dir>/.partialtesting:
+        [rules]
+        special = docker/*, *.lock
+        code = *.py, *.pyx
+        no_tests = docs/*, *.md
+        test_roots = tests/*, src/*/tests/*
+        dependency_files = projects/*/setup.py, projects/*/requirements.txt
+    or from <repo_dir>/pyproject.toml:
+        [tool.partialtesting.rules]
+        special = ["docker/*", "*.lock"]
+    Returns a dict with the keys that were set
+    """
+    config = read_config_section(RULES_SECTION, repo_dir)
+
+    unknown_keys = set(config) - {"special", "code", "no_tests", "test_roots", "dependency_files"}
+    if unknown_keys:
+        raise ValueError(f"Unknown partialtesting rules: {sorted(unknown_keys)}")
+
+    return config
+
+
+def load_rules(special_files, special_extensions, repo_dir="."):
+    """
+    Rules for a project: the special files/extensions (command line options)
+    plus the project-level rules file, if any. Its 'special' patterns are added
+    to the special files, the other classes replace the defaults
+    """
+    config = read_rules_config(repo_dir)
+    if config:
+        logging.info(f"Partial Testing: using project rules {config}")
+
+    project_special = config.pop("special", [])
+    return Rules.from_defaults(
+        special_files,
+        special_extensions,
+        special=DEFAULT_SPECIAL_PATTERNS + project_special,
+        project_special=project_special,
+        **config,
+    )
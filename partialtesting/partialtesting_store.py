@@ -0,0 +1,279 @@
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_cache import coverage_build_id
+from partialtesting.partialtesting_index import update_reverse_index
+
+# content-addressed area shared by every project: <coverage_dir>/.objects/<sha[:2]>/<sha>
+# (hidden, so that it is never taken for a project or a build)
+OBJECTS_DIR = ".objects"
+HASH_CHUNK_SIZE = 1024 * 1024
+# objects younger than this are never collected, they might be being published
+DEFAULT_GC_GRACE_SECONDS = 3600
+# <object><suffix>: its modification time is the last time the object was stored again.
+# The object itself is never touched, its inode (and so its mtime) is shared by every build linking it
+USED_MARKER_SUFFIX = ".used"
+
+
+def objects_dir(coverage_dir):
+    return os.path.join(coverage_dir, OBJECTS_DIR)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def object_path(coverage_dir, digest):
+    return os.path.join(objects_dir(coverage_dir), digest[:2], digest)
+
+
+def used_marker_path(stored_path):
+    return f"{stored_path}{USED_MARKER_SUFFIX}"
+
+
+def mark_used(stored_path):
+    """
+    Record that the object is in use again, see collect_garbage().
+    The marker is replaced rather than touched: that only needs write access
+    to the object's directory, whoever created the marker
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".pt_used", dir=os.path.dirname(stored_path))
+    os.close(fd)
+    try:
+        os.replace(tmp_path, used_marker_path(stored_path))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def last_used(stored_path, stat):
+    """
+    Modification time of the object or of its marker (see mark_used()), whichever is newer
+    """
+    try:
+        return max(stat.st_mtime, os.stat(used_marker_path(stored_path)).st_mtime)
+    except FileNotFoundError:
+        return stat.st_mtime
+
+
+def store_object(path, coverage_dir):
+    """
+    Store the file at path in the object area unless an identical one is
+    already there. Returns the path of the object
+    """
+    stored_path = object_path(coverage_dir, file_digest(path))
+    if os.path.isfile(stored_path):
+        mark_used(stored_path)
+        logging.info(f"Partial Testing: {path} is already stored as {stored_path}")
+        return stored_path
+
+    os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".pt_object", dir=os.path.dirname(stored_path))
+    os.close(fd)
+    try:
+        shutil.copyfile(path, tmp_path)
+        # objects are shared by builds, they must never be modified in place
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, stored_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logging.info(f"Partial Testing: stored {path} as {stored_path}")
+    return stored_path
+
+
+def link_object(stored_path, link_path):
+    """
+    Hardlink the object into a build directory, or symlink it when
+    the storage does not support hardlinks
+    """
+    try:
+        os.link(stored_path, link_path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise  # collected in the meantime
+        os.symlink(os.path.relpath(stored_path, os.path.dirname(link_path)), link_path)
+
+
+def publish_build(
+    db_path, coverage_dir, project_name, build_number, extra_files=(), update_index=False, commit=None
+):
+    """
+    Publish the coverage DB at db_path as a new build:
+    <coverage_dir>/<project_name>/<build_number>/.coverage
+    The DB is stored once in the object area (see store_object()) and linked
+    into the build directory, identical builds take no extra space.
+    extra_files (e.g. distributions.json) are copied next to it, and the commit
+    the coverage data was recorded at, if given (see partialtesting.find_build_for_merge_base).
+
+    The build is first written into a hidden directory (ignored by 'ls -t1')
+    and renamed into place, so readers never see a half-written build.
+    If update_index, the project's reverse index is patched with the changes
+    of the build (see partialtesting_index.update_reverse_index)
+    """
+    project_path = f"{coverage_dir}/{project_name}"
+    build_path = f"{project_path}/{build_number}"
+
+    if os.path.exists(build_path):
+        raise Exception(f"The build directory {build_path} already exists")
+
+    os.makedirs(project_path, exist_ok=True)
+    tmp_build_path = tempfile.mkdtemp(prefix=f".{build_number}.", dir=project_path)
+    try:
+        try:
+            link_object(store_object(db_path, coverage_dir), f"{tmp_build_path}/{pt.COVERAGE_FILE}")
+        except FileNotFoundError:
+            # the identical object was garbage collected before it could be linked
+            link_object(store_object(db_path, coverage_dir), f"{tmp_build_path}/{pt.COVERAGE_FILE}")
+        for extra_file in extra_files:
+            shutil.copyfile(extra_file, f"{tmp_build_path}/{os.path.basename(extra_file)}")
+        if commit:
+            with open(f"{tmp_build_path}/{pt.BUILD_COMMIT_FILE}", "w") as f:
+                f.write(f"{commit}\n")
+        os.rename(tmp_build_path, build_path)
+    except Exception:
+        shutil.rmtree(tmp_build_path, ignore_errors=True)
+        raise
+
+    logging.info(f"Partial Testing: published coverage build '{build_path}'")
+
+    if update_index:
+        db_path = f"{build_path}/{pt.COVERAGE_FILE}"
+        update_reverse_index(project_path, db_path, coverage_build_id(db_path))
+    return build_path
+
+
+def _symlinked_objects(coverage_dir):
+    objects_path = os.path.realpath(objects_dir(coverage_dir))
+    referenced = set()
+    for root, dirs, files in os.walk(coverage_dir):
+        dirs[:] = [name for name in dirs if name != OBJECTS_DIR]
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                target = os.path.realpath(path)
+                if target.startswith(objects_path + os.sep):
+                    referenced.add(target)
+    return referenced
+
+
+def _remove_marker(marker_path):
+    try:
+        os.remove(marker_path)
+    except FileNotFoundError:
+        pass
+
+
+def collect_garbage(coverage_dir, grace_seconds=DEFAULT_GC_GRACE_SECONDS):
+    """
+    Delete the objects no build refers to anymore: neither hardlinked
+    (a link count of 1, the object area's own) nor symlinked, and not
+    stored again (see mark_used()) for grace_seconds.
+    Returns (number of objects deleted, bytes freed)
+    """
+    objects_path = objects_dir(coverage_dir)
+    if not os.path.isdir(objects_path):
+        return 0, 0
+
+    referenced = _symlinked_objects(coverage_dir)
+    now = time.time()
+    deleted = freed = 0
+    for root, _, files in os.walk(objects_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(USED_MARKER_SUFFIX):
+                if not os.path.exists(path[: -len(USED_MARKER_SUFFIX)]):
+                    _remove_marker(path)  # the object was collected
+                continue
+            stat = os.lstat(path)
+            if stat.st_nlink > 1 or os.path.realpath(path) in referenced:
+                continue
+            if now - last_used(path, stat) < grace_seconds:
+                continue
+            logging.info(f"Partial Testing: deleting unreferenced object {path}")
+            os.remove(path)
+            _remove_marker(used_marker_path(path))
+            deleted += 1
+            freed += stat.st_size
+
+    return deleted, freed
+
+
+@click.command()
+@click.option(
+    "--coverage-dir",
+    help="Path to the saved coverage data.\n"
+    "Set a default path by setting the below in ~/.partialtesting:\n"
+    "[coverage]\ndir=<path>",
+)
+@click.option(
+    "--project-name",
+    required=True,
+    help="Project name (e.g. numpy). The coverage data is published under "
+    "<coverage_dir>/<project_name>/<build_number>/.coverage",
+)
+@click.option(
+    "--coverage-file",
+    default=pt.COVERAGE_FILE,
+    help=f"Coverage data of the master run. Default: {pt.COVERAGE_FILE}",
+)
+@click.option(
+    "--build-number",
+    required=True,
+    help="Name of the build directory to publish the coverage data to",
+)
+@click.option(
+    "--extra-file",
+    multiple=True,
+    help="File to publish next to the coverage data (e.g. distributions.json), can be given several times",
+)
+@click.option(
+    "--update-index",
+    is_flag=True,
+    help="Patch the project's reverse index (file -> tests) with the changes of the build, "
+    "partialtesting then looks the tests up there instead of in the .coverage file",
+)
+@click.option(
+    "--commit",
+    default=None,
+    help="Commit the coverage data was recorded at. Default: the commit checked out (HEAD)",
+)
+def main(coverage_dir, project_name, coverage_file, build_number, extra_file, update_index, commit):
+    """
+    Publish the coverage data of a master run as a new build. The .coverage
+    file is stored once by content hash under <coverage_dir>/.objects and
+    hardlinked (or symlinked) into the build directory
+    """
+    coverage_dir = pt.get_coverage_dir(coverage_dir)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    if commit is None:
+        try:
+            commit = pt.git_head_commit()
+        except Exception as e:
+            logging.warning(f"Partial Testing: the commit of the build will not be recorded. Reason: {e}")
+
+    publish_build(
+        coverage_file, coverage_dir, project_name, build_number, extra_file, update_index, commit
+    )
+
+
+if __name__ == "__main__":
+    main()
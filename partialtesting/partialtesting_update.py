@@ -0,0 +1,311 @@
+import hashlib
+import logging
+import shutil
+import sys
+import tempfile
+
+import click
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_index import TestDefinitionIndex, get_test_func_name
+from partialtesting.partialtesting_rules import load_rules
+from partialtesting.partialtesting_store import publish_build
+
+# columns holding the recorded coverage in each coverage table, besides file_id and context_id
+COVERAGE_TABLE_COLUMNS = {"arc": ["fromno", "tono"], "line_bits": ["numbits"]}
+
+
+def merge_partial_coverage(baseline_db_path, partial_db_path, line_coverage=False):
+    """
+    Replace the coverage rows of the tests that were run in a partial run.
+
+    Every (non-empty) context recorded in partial_db_path has its rows deleted
+    from baseline_db_path and replaced by the rows of the partial run.
+    Files and contexts that the baseline does not know about yet are added.
+    Returns the list of contexts (test names) that were refreshed.
+    """
+    cov_table = "arc" if not line_coverage else "line_bits"
+    cov_columns = ", ".join(COVERAGE_TABLE_COLUMNS[cov_table])
+    partial_cov_columns = ", ".join(
+        f"partial_cov.{column}" for column in COVERAGE_TABLE_COLUMNS[cov_table]
+    )
+
+    db, cursor = pt.connect_to_db(baseline_db_path)
+    try:
+        cursor.execute("ATTACH DATABASE ? AS partial", (partial_db_path,))
+
+        cursor.execute(
+            "select context from partial.context where context != '' order by context"
+        )
+        refreshed_contexts = [row[0] for row in cursor.fetchall()]
+
+        # forget what the baseline knew about the tests that were re-run
+        cursor.execute(
+            f"""\
+delete from {cov_table} where context_id in \
+(select context.id from context, partial.context as partial_context \
+where context.context = partial_context.context and partial_context.context != '') \
+"""
+        )
+
+        cursor.execute(
+            "insert or ignore into file(path) select path from partial.file"
+        )
+        cursor.execute(
+            "insert or ignore into context(context) select context from partial.context "
+            "where context != ''"
+        )
+
+        # copy the new rows, translating file and context ids into the baseline's ids
+        cursor.execute(
+            f"""\
+insert or ignore into {cov_table}(file_id, context_id, {cov_columns}) \
+select file.id, context.id, {partial_cov_columns} \
+from partial.{cov_table} as partial_cov, partial.file as partial_file, \
+partial.context as partial_context, file, context \
+where partial_cov.file_id = partial_file.id and partial_cov.context_id = partial_context.id and \
+file.path = partial_file.path and context.context = partial_context.context and \
+partial_context.context != '' \
+"""
+        )
+
+        db.commit()
+        cursor.execute("DETACH DATABASE partial")
+    finally:
+        db.close()
+
+    return refreshed_contexts
+
+
+def prune_deleted_tests(db_path, test_index, line_coverage=False):
+    """
+    Delete the coverage rows of the tests (contexts) that are not defined
+    anymore in the test suite (see partialtesting_index.TestDefinitionIndex).
+    Returns the list of contexts that were pruned
+    """
+    cov_table = "arc" if not line_coverage else "line_bits"
+
+    db, cursor = pt.connect_to_db(db_path)
+    try:
+        cursor.execute("select id, context from context where context != ''")
+        pruned = [
+            (context_id, context)
+            for context_id, context in cursor.fetchall()
+            if get_test_func_name(context) not in test_index.definitions
+        ]
+        pruned_ids = [(context_id,) for context_id, _ in pruned]
+        cursor.executemany(f"delete from {cov_table} where context_id = ?", pruned_ids)
+        cursor.executemany("delete from context where id = ?", pruned_ids)
+        db.commit()
+    finally:
+        db.close()
+
+    return [context for _, context in pruned]
+
+
+def slice_of(test_file, slices):
+    """
+    Slice (0 to slices - 1) of a test file, from a stable hash of its
+    path: the same on every build and machine
+    """
+    return int(hashlib.sha1(test_file.encode("utf-8")).hexdigest(), 16) % slices
+
+
+def slice_test_files(test_index, slices, index):
+    """
+    The test files of the index-th of slices (about 1/slices of the test suite)
+    """
+    test_files = {test_file for files in test_index.definitions.values() for test_file in files}
+    return sorted(test_file for test_file in test_files if slice_of(test_file, slices) == index)
+
+
+def update_baseline(
+    project_name,
+    coverage_dir,
+    partial_coverage_path,
+    build_number,
+    base_build_number="",
+    line_coverage=False,
+    update_index=False,
+    prune=False,
+    commit=None,
+):
+    """
+    Refresh the coverage baseline of a project using the coverage recorded
+    by a partial run (only the selected tests were run).
+
+    A copy of the latest build (or base_build_number) is updated with the
+    rows of the tests that were re-run and published as build_number.
+    The original build is never modified. Full master builds are still
+    needed from time to time to resync everything else (e.g. tests that
+    were deleted or not selected for a long time).
+
+    If prune, the tests not defined anymore in the test suite are removed
+    (see prune_deleted_tests()): with a rotating slice of the tests run on
+    every master build (see slice_test_files()), the published build is then
+    the freshest coverage of every test over the last builds
+
+    commit is the commit the partial run was recorded at (see publish_build)
+    """
+    project_data = pt.Project(
+        project_name,
+        coverage_dir,
+        build_number=base_build_number,
+        line_coverage=line_coverage,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="pt_update") as tmp_dir:
+        updated_db_path = f"{tmp_dir}/{pt.COVERAGE_FILE}"
+        shutil.copyfile(project_data.coverage_db_path, updated_db_path)
+
+        refreshed_contexts = merge_partial_coverage(
+            updated_db_path, partial_coverage_path, line_coverage
+        )
+        logging.info(
+            f"Partial Testing: refreshed coverage of {len(refreshed_contexts)} tests"
+        )
+        logging.debug(f"Partial Testing: refreshed tests {refreshed_contexts}")
+
+        if prune:
+            test_index = TestDefinitionIndex.load(load_rules([], []).test_dirs())
+            pruned_contexts = prune_deleted_tests(updated_db_path, test_index, line_coverage)
+            logging.info(f"Partial Testing: pruned coverage of {len(pruned_contexts)} deleted tests")
+            logging.debug(f"Partial Testing: pruned tests {pruned_contexts}")
+
+        return publish_build(
+            updated_db_path, coverage_dir, project_name, build_number, update_index=update_index, commit=commit
+        )
+
+
+@click.command()
+@click.option(
+    "--coverage-dir",
+    help="Path to the saved coverage data.\n"
+    "Set a default path by setting the below in ~/.partialtesting:\n"
+    "[coverage]\ndir=<path>",
+)
+@click.option(
+    "--project-name",
+    required=True,
+    help="Project name (e.g. numpy). The updated coverage data is published under "
+    "<coverage_dir>/<project_name>/<build_number>/.coverage",
+)
+@click.option(
+    "--partial-coverage",
+    default=pt.COVERAGE_FILE,
+    help=f"Path to the .coverage file produced by the partial run. Default: {pt.COVERAGE_FILE}",
+)
+@click.option(
+    "--build-number",
+    required=True,
+    help="Name of the build directory to publish the updated coverage data to",
+)
+@click.option(
+    "--base-build-number",
+    default="",
+    help="Build to update. Default: the latest build of the project",
+)
+@click.option(
+    "--line-coverage",
+    is_flag=True,
+    help="If recording line coverage instead of "
+    "branch coverage (coverage run --branch) ",
+)
+@click.option(
+    "--update-index",
+    is_flag=True,
+    help="Patch the project's reverse index (file -> tests) with the refreshed tests",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Remove the coverage of the tests not defined anymore in the test suite "
+    "(run it from the repository root), e.g. when refreshing from partialtesting-slice runs",
+)
+@click.option(
+    "--commit",
+    default=None,
+    help="Commit the partial run was recorded at. Default: the commit checked out (HEAD)",
+)
+def main(
+    coverage_dir,
+    project_name,
+    partial_coverage,
+    build_number,
+    base_build_number,
+    line_coverage,
+    update_index,
+    prune,
+    commit,
+):
+    """
+    Refresh the saved coverage data of a project with the coverage
+    recorded while running only the tests selected by partialtesting.
+    """
+    coverage_dir = pt.get_coverage_dir(coverage_dir)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    if commit is None:
+        try:
+            commit = pt.git_head_commit()
+        except Exception as e:
+            logging.warning(f"Partial Testing: the commit of the build will not be recorded. Reason: {e}")
+
+    update_baseline(
+        project_name,
+        coverage_dir,
+        partial_coverage,
+        build_number,
+        base_build_number,
+        line_coverage,
+        update_index,
+        prune,
+        commit,
+    )
+
+
+@click.command()
+@click.option(
+    "--slices",
+    required=True,
+    type=click.IntRange(min=1),
+    help="Number of slices the test suite is split into, "
+    "each test runs under coverage once every <slices> master builds",
+)
+@click.option(
+    "--slice",
+    "index",
+    required=True,
+    type=click.IntRange(min=0),
+    help="Slice to run, from 0 to <slices> - 1, e.g. $((BUILD_NUMBER % <slices>))",
+)
+@click.option(
+    "--output-file",
+    default=pt.TEST_FILES_TO_RUN_ALL_STAGES,
+    help=f"Where to write the test files of the slice. Default: {pt.TEST_FILES_TO_RUN_ALL_STAGES}",
+)
+def slice_main(slices, index, output_file):
+    """
+    Write the test files of a slice of the test suite (split by a stable hash
+    of their paths) for a master build to run under coverage, then refresh
+    the saved coverage data with partialtesting-update --prune.
+    A slice can be empty (more slices than test files): the output file is then
+    empty too, and the build must skip running the tests and the update.
+    Run it from the repository root
+    """
+    if index >= slices:
+        raise click.BadParameter(f"must be lower than --slices ({slices})", param_hint="--slice")
+
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+    test_index = TestDefinitionIndex.load(load_rules([], []).test_dirs())
+    test_files = slice_test_files(test_index, slices, index)
+    pt.write_file_of_test_files_to_run(test_files, output_file)
+    if not test_files:
+        # 'pytest $(cat <output_file>)' would run the whole test suite
+        logging.info(f"Partial Testing: slice {index} of {slices} is empty, there is nothing to run")
+
+
+if __name__ == "__main__":
+    main()
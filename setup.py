@@ -38,6 +38,14 @@ setup(
         "console_scripts": [
             "partialtesting = partialtesting.partialtesting:main",
             "partialtest = partialtesting.partialtesting:main",
+            "partialtesting-update = partialtesting.partialtesting_update:main",
+            "partialtesting-slice = partialtesting.partialtesting_update:slice_main",
+            "partialtesting-record-distributions = partialtesting.partialtesting_deps:main",
+            "partialtesting-range = partialtesting.partialtesting_range:main",
+            "partialtesting-replay = partialtesting.partialtesting_replay:main",
+            "partialtesting-train-history = partialtesting.partialtesting_replay:train_main",
+            "partialtesting-record-results = partialtesting.partialtesting_results:main",
+            "partialtesting-publish = partialtesting.partialtesting_store:main",
         ]
     },
 )
@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+
+def _create_coverage_db(db_path, arcs):
+    """
+    Minimal coveragepy DB where arcs is a list of (file_path, context)
+    or (file_path, context, fromno, tono) tuples. Returns db_path
+    """
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute(
+        "CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer, "
+        "unique(file_id, context_id, fromno, tono) )"
+    )
+    for file_path, context, *lines in arcs:
+        fromno, tono = lines or (1, 2)
+        db.execute("INSERT OR IGNORE INTO file(path) VALUES (?)", (file_path,))
+        db.execute("INSERT OR IGNORE INTO context(context) VALUES (?)", (context,))
+        db.execute(
+            "INSERT OR IGNORE INTO arc SELECT file.id, context.id, ?, ? FROM file, context "
+            "WHERE file.path = ? AND context.context = ?",
+            (fromno, tono, file_path, context),
+        )
+    db.commit()
+    db.close()
+    return db_path
+
+
+@pytest.fixture
+def create_coverage_db():
+    return _create_coverage_db
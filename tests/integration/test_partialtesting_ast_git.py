@@ -0,0 +1,81 @@
+import subprocess
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_ast import (
+    WORKING_TREE,
+    git_cat_file_batch,
+    semantically_unchanged_paths,
+)
+from partialtesting.partialtesting_metrics import Metrics
+from partialtesting.partialtesting_results import git_content_hashes
+
+
+def git(*args):
+    subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE)
+
+
+@pytest.fixture
+def git_repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+    git("config", "user.email", "pt@example.com")
+    git("config", "user.name", "pt")
+
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "docs_only.py").write_text("def f(x):\n    return x\n")
+    (tmp_path / "pkg" / "logic.py").write_text("def g(x):\n    return x\n")
+    git("add", ".")
+    git("commit", "-q", "-m", "base")
+    git("tag", "base")
+
+    (tmp_path / "pkg" / "docs_only.py").write_text(
+        'def f(x):\n    """Identity"""\n    return x  # as is\n'
+    )
+    (tmp_path / "pkg" / "logic.py").write_text("def g(x):\n    return x + 1\n")
+    return tmp_path
+
+
+def test_git_cat_file_batch(git_repo):
+    blobs = git_cat_file_batch(["base:pkg/logic.py", "base:pkg/missing.py", "base:pkg/docs_only.py"])
+
+    assert blobs == {
+        "base:pkg/logic.py": b"def g(x):\n    return x\n",
+        "base:pkg/docs_only.py": b"def f(x):\n    return x\n",
+    }
+
+
+def test_semantically_unchanged_paths(git_repo):
+    paths = ["pkg/docs_only.py", "pkg/logic.py"]
+
+    assert semantically_unchanged_paths(paths, "base", WORKING_TREE) == {"pkg/docs_only.py"}
+
+    git("commit", "-q", "-am", "change")
+    assert semantically_unchanged_paths(paths, "base", "HEAD") == {"pkg/docs_only.py"}
+
+
+def test_drop_non_semantic_changes(git_repo):
+    nontest_files = [pt.File("pkg/docs_only.py", "M"), pt.File("pkg/logic.py", "M")]
+    metrics = Metrics()
+
+    nontest_files, test_files = pt.drop_non_semantic_changes(
+        nontest_files, [], False, "base", metrics
+    )
+
+    assert [file.path for file in nontest_files] == ["pkg/logic.py"]
+    assert test_files == []
+    assert metrics.counts["non_semantic_changes"] == 1
+    assert "ast_comparison" in metrics.timings
+
+
+def test_git_content_hashes(git_repo):
+    (git_repo / "pkg" / "docs_only.py").unlink()
+    modified = subprocess.run(
+        ["git", "hash-object", "pkg/logic.py"], check=True, stdout=subprocess.PIPE
+    ).stdout.decode("utf-8").strip()
+
+    hashes = git_content_hashes()
+
+    # what is in the working tree, deleted files are left out
+    assert hashes == {"pkg/logic.py": modified}
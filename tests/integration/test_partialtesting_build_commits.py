@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import subprocess
+import time
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_store as pt_store
+
+FAKE_PROJECT = "fake_project"
+
+
+def git(*args):
+    result = subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE)
+    return result.stdout.decode("utf-8").strip()
+
+
+def commit_file(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    git("add", path)
+    git("commit", "-q", "-m", f"change {path}")
+    return git("rev-parse", "HEAD")
+
+
+@pytest.fixture
+def repo_with_builds(tmp_path, monkeypatch):
+    """
+    master: c1 (build 10) - c2 - c3 (build 11, the latest)
+    the branch forks off c2
+    """
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    monkeypatch.chdir(repo)
+    git("init", "-q", "-b", "master")
+    git("config", "user.email", "pt@example.com")
+    git("config", "user.name", "pt")
+
+    c1 = commit_file("b.py", "b = 1\n")
+    c2 = commit_file("b.py", "b = 2\n")
+    c3 = commit_file("c.py", "c = 1\n")
+    git("checkout", "-q", "-b", "branch", c2)
+    commit_file("README.md", "docs\n")
+
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = str(tmp_path / "build.coverage")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute("CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer )")
+    db.execute("INSERT INTO file VALUES (1, '/ci/repo/b.py')")
+    db.execute("INSERT INTO context VALUES (1, 'tests.test_b.test_b')")
+    db.execute("INSERT INTO arc VALUES (1, 1, 1, 2)")
+    db.commit()
+    db.close()
+    for build, commit in (("10", c1), ("11", c3)):
+        build_path = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, build, commit=commit)
+        build_time = time.time() - 100 + int(build)
+        os.utime(build_path, (build_time, build_time))
+
+    return coverage_dir, c1, c2, c3
+
+
+def test_find_build_for_merge_base(repo_with_builds):
+    coverage_dir, c1, c2, c3 = repo_with_builds
+
+    assert pt.read_build_commits(f"{coverage_dir}/{FAKE_PROJECT}") == {c1: "10", c3: "11"}
+    # the latest build (c3) is not an ancestor of the merge-base (c2)
+    assert pt.find_build_for_merge_base(FAKE_PROJECT, coverage_dir, "master") == ("10", c1)
+
+    # the changes of c2 are not in the coverage data of build 10: diffing against c1 finds them
+    changed_files = pt.detect_changed_files(True, c1)
+    assert sorted(file.path for file in changed_files) == ["README.md", "b.py"]
+
+
+def test_find_build_for_merge_base_without_recorded_ancestor(repo_with_builds):
+    coverage_dir, c1, c2, c3 = repo_with_builds
+    os.remove(f"{coverage_dir}/{FAKE_PROJECT}/10/{pt.BUILD_COMMIT_FILE}")
+
+    assert pt.find_build_for_merge_base(FAKE_PROJECT, coverage_dir, "master") == (None, None)
+    assert pt.nearest_commit_with_build({c1: "10"}, c3) == c1
+
+
+def test_detect_relevant_tests_build_from_merge_base(repo_with_builds):
+    coverage_dir, c1, c2, c3 = repo_with_builds
+    os.mkdir("tests")
+    with open("tests/test_b.py", "w") as f:
+        f.write("def test_b():\n    pass\n")
+
+    files_to_test = pt.detect_relevant_tests(
+        FAKE_PROJECT,
+        coverage_dir,
+        True,
+        special_files=[],
+        special_extensions=[],
+        output_file="test_files_to_run.txt",
+        compare_to_branch="master",
+        build_from_merge_base=True,
+    )
+
+    # b.py changed between build 10 and the merge-base
+    assert files_to_test == {"tests/test_b.py"}
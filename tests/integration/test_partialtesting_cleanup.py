@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import time
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_cleanup as pt_cleanup
+from partialtesting import partialtesting_store as pt_store
+
+PROJECT_DIR = "fake_project/master"
+
+
+def publish_builds(tmp_path, coverage_dir, count, create_coverage_db):
+    for build in range(1, count + 1):
+        db_path = str(tmp_path / f"{build}.coverage")
+        create_coverage_db(
+            db_path,
+            [("nontestfile1.py", "test_a", line, line + 1) for line in range(build * 2000)]
+            + [("nontestfile2.py", "test_b", 1, 2), ("nontestfile2.py", "test_a", 3, 4)],
+        )
+        build_path = pt_store.publish_build(db_path, coverage_dir, PROJECT_DIR, str(build))
+        build_time = time.time() - 100 + build
+        os.utime(build_path, (build_time, build_time))
+
+
+def test_compact_coverage_data(tmp_path, create_coverage_db):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    publish_builds(tmp_path, coverage_dir, 3, create_coverage_db)
+    full_sizes = {
+        build: os.path.getsize(f"{coverage_dir}/{PROJECT_DIR}/{build}/{pt.COVERAGE_FILE}")
+        for build in ("1", "2", "3")
+    }
+
+    pt_cleanup.compact_coverage_data(coverage_dir, "master", keep=1)
+
+    # the builds are all kept and still ordered the same way
+    assert sorted(os.listdir(f"{coverage_dir}/{PROJECT_DIR}")) == ["1", "2", "3"]
+    assert pt.get_last_build_directory(f"{coverage_dir}/{PROJECT_DIR}/") == "3"
+
+    for build in ("1", "2", "3"):
+        db_path = f"{coverage_dir}/{PROJECT_DIR}/{build}/{pt.COVERAGE_FILE}"
+        assert pt_cleanup.is_thin(db_path) == (build != "3")
+        assert pt.get_tests_that_use_file("nontestfile1.py", db_path) == ["test_a"]
+        assert sorted(pt.get_tests_that_use_file("nontestfile2.py", db_path)) == ["test_a", "test_b"]
+    pt.close_connections()
+
+    thin_db = sqlite3.connect(f"{coverage_dir}/{PROJECT_DIR}/2/{pt.COVERAGE_FILE}")
+    assert thin_db.execute("SELECT count(*) FROM arc").fetchone() == (3,)
+    thin_db.close()
+    assert os.path.getsize(f"{coverage_dir}/{PROJECT_DIR}/2/{pt.COVERAGE_FILE}") < full_sizes["2"]
+
+    # the full DBs of the compacted builds are not referenced anymore
+    assert pt_store.collect_garbage(coverage_dir, grace_seconds=0)[0] == 2
+
+    # compacting again leaves the thin builds as they are
+    thin_stat = os.stat(f"{coverage_dir}/{PROJECT_DIR}/1/{pt.COVERAGE_FILE}")
+    pt_cleanup.compact_coverage_data(coverage_dir, "master", keep=1)
+    assert os.stat(f"{coverage_dir}/{PROJECT_DIR}/1/{pt.COVERAGE_FILE}").st_ino == thin_stat.st_ino
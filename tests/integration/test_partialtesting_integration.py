@@ -1,6 +1,11 @@
+import io
+import json
 import logging
+import shutil
 import sqlite3
+import subprocess
 import sys
+import threading
 from collections import namedtuple
 from contextlib import contextmanager
 from glob import glob
@@ -9,6 +14,8 @@ from unittest.mock import patch
 import pytest
 
 from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_range as pt_range
+from partialtesting.partialtesting_index import TestDefinitionIndex
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -497,3 +504,331 @@ M tests/test_utility_file1.py
             )
 
             assert f"{GEN_TESTS_PATH}test_testfile1.py" in test_files
+
+
+def test_end_to_end_writes_metrics_file(generated_db, tmp_path):
+
+    git_diff = """\
+M nontestfile2.py
+"""
+    metrics_file = tmp_path / "metrics.json"
+
+    with patch("partialtesting.partialtesting.COVERAGE_FILE", generated_db.name):
+        with patch(
+            "partialtesting.partialtesting.git_diff_namestatus", return_value=git_diff
+        ):
+
+            test_files = pt.detect_relevant_tests(
+                project_name=FAKE_PROJECT,
+                coverage_dir=TESTFILESDIR,
+                git_diff_use_head=True,
+                metrics_file=str(metrics_file),
+            )
+
+    metrics = json.loads(metrics_file.read_text())
+    assert set(metrics["timings"]) == {
+        "build_resolution",
+        "git_diff",
+        "test_index",
+        "classification",
+        "db_lookup",
+        "test_file_resolution",
+        "output",
+    }
+    assert metrics["counts"]["changed_files"] == 1
+    assert metrics["counts"]["contexts_fetched"] == 3
+    assert metrics["counts"]["tests_selected"] == len(test_files)
+    assert (tmp_path / "metrics.prom").exists()
+
+
+def test_end_to_end_result_cache_hit_skips_lookups(generated_db, tmp_path):
+
+    git_diff = """\
+M nontestfile1.py
+"""
+    cache_dir = str(tmp_path / "cache")
+    output_file = str(tmp_path / "test_files_to_run.txt")
+
+    with patch("partialtesting.partialtesting.COVERAGE_FILE", generated_db.name), patch(
+        "partialtesting.partialtesting.git_diff_namestatus", return_value=git_diff
+    ), patch(
+        "partialtesting.partialtesting.git_merge_base", return_value="merge_base_sha"
+    ), patch(
+        "partialtesting.partialtesting.git_head_commit", return_value="head_sha"
+    ):
+
+        test_files = pt.detect_relevant_tests(
+            project_name=FAKE_PROJECT,
+            coverage_dir=TESTFILESDIR,
+            git_diff_use_head=True,
+            output_file=output_file,
+            result_cache_dir=cache_dir,
+            max_selected_percent=100,
+        )
+        assert f"{GEN_TESTS_PATH}test_testfile1.py" in test_files
+
+        # not even to warm it up or to count its tests for the context budget
+        with patch(
+            "partialtesting.partialtesting_db.open_readonly",
+            side_effect=AssertionError("the coverage DB should not be opened"),
+        ):
+            cached_test_files = pt.detect_relevant_tests(
+                project_name=FAKE_PROJECT,
+                coverage_dir=TESTFILESDIR,
+                git_diff_use_head=True,
+                output_file=output_file,
+                result_cache_dir=cache_dir,
+                max_selected_percent=100,
+            )
+
+    assert cached_test_files == test_files
+    with open(output_file) as f:
+        assert set(f.read().splitlines()) == test_files
+
+
+def test_end_to_end_multiple_projects(generated_db, tmp_path):
+    """
+    Both projects share the same coverage data, except for project_c which
+    has none (and requires a full test). git diff must only be run once
+    """
+    coverage_dir = tmp_path / "coverage"
+    for project_name in ["project_a", "project_b"]:
+        (coverage_dir / project_name / "1").mkdir(parents=True)
+        shutil.copyfile(
+            generated_db.path, coverage_dir / project_name / "1" / pt.COVERAGE_FILE
+        )
+    (coverage_dir / "project_c").mkdir()
+    output_file = tmp_path / "test_files_to_run.txt"
+
+    git_diff = """\
+M nontestfile1.py
+"""
+
+    with patch(
+        "partialtesting.partialtesting.git_diff_namestatus", return_value=git_diff
+    ) as mock_git_diff:
+        results = pt.detect_relevant_tests_for_projects(
+            pt.discover_projects(str(coverage_dir)),
+            coverage_dir=str(coverage_dir),
+            git_diff_use_head=True,
+            output_file=str(output_file),
+            manifest_file=str(tmp_path / "manifest.json"),
+        )
+
+    mock_git_diff.assert_called_once()
+    assert f"{GEN_TESTS_PATH}test_testfile1.py" in results["project_a"]
+    assert results["project_a"] == results["project_b"]
+    assert results["project_c"] is None
+
+    with open(tmp_path / "test_files_to_run_project_a.txt") as f:
+        assert set(f.read().splitlines()) == results["project_a"]
+    assert not (tmp_path / "test_files_to_run_project_c.txt").exists()
+
+    with open(tmp_path / "test_files_to_run_summary.json") as f:
+        summary = json.load(f)
+    assert summary["project_b"] == {
+        "full_test": False,
+        "test_files": sorted(results["project_b"]),
+    }
+    assert summary["project_c"] == {"full_test": True, "test_files": []}
+
+    with open(tmp_path / "manifest_project_c.json") as f:
+        assert json.load(f)["full_test"] is True
+    with open(tmp_path / "manifest_project_a.json") as f:
+        assert json.load(f)["full_test"] is False
+
+
+def test_end_to_end_multiple_projects_git_diff_fails(generated_db, tmp_path):
+    """
+    Every project gets a full test, and the summary is still written
+    """
+    output_file = tmp_path / "test_files_to_run.txt"
+
+    with patch(
+        "partialtesting.partialtesting.git_diff_namestatus",
+        side_effect=subprocess.CalledProcessError(128, "git diff"),
+    ):
+        results = pt.detect_relevant_tests_for_projects(
+            ["project_a", "project_b"],
+            coverage_dir=str(tmp_path / "coverage"),
+            git_diff_use_head=True,
+            output_file=str(output_file),
+        )
+
+    assert results == {"project_a": None, "project_b": None}
+    with open(tmp_path / "test_files_to_run_summary.json") as f:
+        summary = json.load(f)
+    assert summary["project_a"] == {"full_test": True, "test_files": []}
+
+
+@pytest.mark.parametrize(
+    "test_names",
+    [
+        ["test_fakename_2"],
+        ["test_fakename_9"],
+        ["tests.unit.fake_module.FakeClass.test_fakename_9"],
+        ["test_fakename_1", "test_fakename_7", "test_does_not_exist"],
+    ],
+)
+def test_test_definition_index_finds_same_files_as_grep(test_names):
+
+    test_index = TestDefinitionIndex.load(tests_dir=FAKE_TESTS_PATH)
+
+    assert test_index.test_files_for_test_names(test_names) == sorted(
+        pt.get_test_files_for_test_names(test_names, tests_dir=FAKE_TESTS_PATH)
+    )
+
+
+def test_test_definition_index_stops_loading():
+
+    stop_event = threading.Event()
+    stop_event.set()
+
+    test_index = TestDefinitionIndex.load(tests_dir=FAKE_TESTS_PATH, stop_event=stop_event)
+    assert test_index.definitions == {}
+
+
+@pytest.mark.parametrize(
+    "git_diff,expected",
+    [
+        ("M README.md\nA docs/usage.rst\n", set()),
+        ("M setup.py\nM nontestfile1.py\n", None),
+        ("A nontestfile1.py\n", None),
+    ],
+)
+def test_end_to_end_short_circuit_does_not_touch_coverage_data(git_diff, expected, tmp_path):
+
+    with patch(
+        "partialtesting.partialtesting.git_diff_namestatus", return_value=git_diff
+    ), patch(
+        "partialtesting.partialtesting.Project",
+        side_effect=AssertionError("the coverage data should not be accessed"),
+    ):
+        test_files = pt.detect_relevant_tests(
+            project_name="NONEXISTENT_PROJECT",
+            coverage_dir=TESTFILESDIR,
+            git_diff_use_head=True,
+            output_file=str(tmp_path / "test_files_to_run.txt"),
+        )
+
+    assert test_files == expected
+    assert (tmp_path / "test_files_to_run.txt").exists() is (expected is not None)
+
+
+def test_end_to_end_git_failure_triggers_fulltest(generated_db):
+
+    with patch("partialtesting.partialtesting.COVERAGE_FILE", generated_db.name), patch(
+        "partialtesting.partialtesting.git_diff_namestatus",
+        side_effect=IndexError("list index out of range"),
+    ):
+        test_files = pt.detect_relevant_tests(
+            project_name=FAKE_PROJECT, coverage_dir=TESTFILESDIR, git_diff_use_head=True
+        )
+
+    assert test_files is None
+
+
+@pytest.mark.parametrize(
+    "max_contexts,max_selected_percent,full_test",
+    [
+        (None, None, False),
+        (3, None, False),
+        (2, None, True),
+        (None, 75, False),  # 3 of the 4 known tests
+        (None, 50, True),
+    ],
+)
+def test_end_to_end_selection_cutoff(max_contexts, max_selected_percent, full_test):
+    """
+    nontestfile2.py triggers 3 tests out of the 4 known by the generated DB
+    """
+    with generated_db_ctx_mgr() as gen_db:
+        git_diff = """\
+M nontestfile2.py
+"""
+        with patch("partialtesting.partialtesting.COVERAGE_FILE", gen_db.name), patch(
+            "partialtesting.partialtesting.git_diff_namestatus", return_value=git_diff
+        ):
+            test_files = pt.detect_relevant_tests(
+                project_name=FAKE_PROJECT,
+                coverage_dir=TESTFILESDIR,
+                git_diff_use_head=True,
+                max_contexts=max_contexts,
+                max_selected_percent=max_selected_percent,
+            )
+
+    assert (test_files is None) is full_test
+
+
+SETUP_PY = 'from setuptools import setup\nsetup(name="pkg", install_requires=["numpy==1.0", "pandas"])\n'
+
+
+@pytest.mark.parametrize(
+    "new_setup_py,distributions_map,expected",
+    [
+        # only numpy was bumped: the tests that imported it
+        (
+            SETUP_PY.replace("numpy==1.0", "numpy==1.1"),
+            {"test_testfile1_test1": ["numpy"], "test_testfile2_test1": ["pandas"]},
+            {f"{GEN_TESTS_PATH}test_testfile1.py"},
+        ),
+        # a distribution no test imported directly, e.g. a transitive dependency or a pytest plugin
+        (SETUP_PY.replace('"pandas"', '"pandas", "six"'), {"test_testfile1_test1": ["numpy"]}, None),
+        # not only the dependencies changed
+        (SETUP_PY.replace('name="pkg"', 'name="pkg2"'), {"test_testfile1_test1": ["numpy"]}, None),
+        # no distributions map recorded with the coverage build: setup.py is a special file
+        (SETUP_PY.replace("numpy==1.0", "numpy==1.1"), None, None),
+    ],
+)
+def test_end_to_end_dependency_changes(new_setup_py, distributions_map, expected):
+    distributions_file = f"{FAKE_COV_PATH}distributions.json"
+
+    with generated_db_ctx_mgr() as gen_db:
+        if distributions_map is not None:
+            with open(distributions_file, "w") as f:
+                json.dump(distributions_map, f)
+        try:
+            with patch("partialtesting.partialtesting.COVERAGE_FILE", gen_db.name), patch(
+                "partialtesting.partialtesting.git_diff_namestatus", return_value="M setup.py\n"
+            ), patch("partialtesting.partialtesting.git_merge_base", return_value="merge_base"), patch(
+                "partialtesting.partialtesting.read_sources",
+                return_value={"setup.py": (SETUP_PY.encode(), new_setup_py.encode())},
+            ):
+                test_files = pt.detect_relevant_tests(
+                    project_name=FAKE_PROJECT, coverage_dir=TESTFILESDIR, git_diff_use_head=True
+                )
+        finally:
+            pt.run_sh_cmd(["rm", "-f", distributions_file])
+
+    assert test_files == expected
+
+
+def test_detect_relevant_tests_for_range(generated_db):
+    git_log = (
+        f"{pt_range.COMMIT_MARKER}commit1\0\nM\0nontestfile1.py\0"
+        f"{pt_range.COMMIT_MARKER}commit2\0\nM\0nontestfile2.py\0M\0README.md\0"
+        f"{pt_range.COMMIT_MARKER}commit3\0\nM\0setup.py\0"
+        f"{pt_range.COMMIT_MARKER}commit4\0\nM\0nontestfile1.py\0"
+    )
+    output = io.StringIO()
+
+    with patch("partialtesting.partialtesting.COVERAGE_FILE", generated_db.name), patch.object(
+        pt_range, "git_log_name_status", return_value=git_log
+    ), patch.object(pt, "get_tests_that_use_file", wraps=pt.get_tests_that_use_file) as lookups:
+        results = pt_range.detect_relevant_tests_for_range(
+            "commit0..commit4", FAKE_PROJECT, TESTFILESDIR, output
+        )
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [line["commit"] for line in lines] == ["commit1", "commit2", "commit3", "commit4"]
+    assert [line["full_test"] for line in lines] == [False, False, True, False]
+    assert f"{GEN_TESTS_PATH}test_testfile1.py" in lines[0]["test_files"]
+    assert f"{GEN_TESTS_PATH}test_testfile2.py" in lines[1]["test_files"]
+    assert results["commit3"] is None
+    assert results["commit1"] == results["commit4"]
+    # nontestfile1.py is only looked up once for the whole range
+    assert [call.args[0] for call in lookups.call_args_list] == [
+        "nontestfile1.py",
+        "nontestfile2.py",
+        "README.md",
+    ]
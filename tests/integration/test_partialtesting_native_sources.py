@@ -0,0 +1,100 @@
+import sqlite3
+import subprocess
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_db import close_connections
+from partialtesting.partialtesting_metrics import Metrics
+from partialtesting.partialtesting_native import python_importers
+from partialtesting.partialtesting_rules import FileClass, Rules
+
+
+def git(*args):
+    subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE)
+
+
+@pytest.fixture
+def extension_project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "setup.py").write_text(
+        "from setuptools import Extension, setup\n"
+        'setup(ext_modules=[Extension("pkg._fast", ["src/fast.c"]), Extension("pkg._lonely", ["src/lonely.cpp"])])\n'
+    )
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("")
+    (tmp_path / "pkg" / "fast.py").write_text("from . import _fast\n")
+    (tmp_path / "pkg" / "slow.py").write_text("# not using _fast\n")
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_fast.py").write_text("import pkg._fast\n")
+
+    git("init", "-q")
+    git("add", ".")
+    return tmp_path
+
+
+def test_python_importers(extension_project):
+    assert python_importers({"pkg._fast", "pkg._missing"}) == {
+        "pkg._fast": ["pkg/fast.py", "tests/test_fast.py"],
+        "pkg._missing": [],
+    }
+
+
+def test_native_sources_become_code_files(extension_project):
+    changed_files = [pt.File("src/fast.c", "M"), pt.File("src/unknown.c", "M")]
+    metrics = Metrics()
+
+    rules, native_importers = pt.resolve_native_sources(changed_files, Rules(), metrics)
+
+    assert native_importers == {"src/fast.c": ["pkg/fast.py", "tests/test_fast.py"]}
+    assert rules.classify("src/fast.c") == FileClass.CODE
+    # sources that are not compiled into a known extension module still require a full test
+    assert rules.classify("src/unknown.c") == FileClass.UNKNOWN
+    assert "native_sources" in metrics.timings
+
+    nontest_files, test_files = pt.expand_native_sources(changed_files[:1], [], native_importers, rules)
+    assert [file.path for file in nontest_files] == ["src/fast.c", "pkg/fast.py"]
+    # the test importing the extension module is run even if the coverage data did not record it
+    assert [file.path for file in test_files] == ["tests/test_fast.py"]
+
+
+def test_tests_importing_native_extensions_are_selected(extension_project):
+    changed_files = [pt.File("src/fast.c", "M")]
+    metrics = Metrics()
+    rules, native_importers = pt.resolve_native_sources(changed_files, Rules(), metrics)
+    nontest_files, test_files, full_test = pt.classify_changed_files(changed_files, [], [], metrics, rules)
+    assert not full_test
+
+    nontest_files, test_files = pt.expand_native_sources(nontest_files, test_files, native_importers, rules)
+
+    assert pt.identify_files_to_test_for_testfiles(test_files) == ["tests/test_fast.py"]
+    assert pt.coverage_lookup_required(nontest_files, test_files, rules)
+
+
+def test_no_native_sources_changed(extension_project):
+    rules = Rules()
+
+    assert pt.resolve_native_sources([pt.File("pkg/fast.py", "M")], rules, Metrics()) == (rules, {})
+
+
+def test_native_sources_without_importers(extension_project):
+    changed_files = [pt.File("src/lonely.cpp", "M")]
+
+    # nothing imports pkg._lonely: its tests are unknown, a full test is required
+    rules, native_importers = pt.resolve_native_sources(changed_files, Rules(), Metrics())
+    assert native_importers == {}
+    assert rules.classify("src/lonely.cpp") == FileClass.UNKNOWN
+
+    # unless the coverage data recorded the source itself
+    db_path = str(extension_project / ".coverage")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("INSERT INTO file VALUES (1, '/ci/workspace/repo/src/lonely.cpp')")
+    db.commit()
+    db.close()
+    try:
+        rules, native_importers = pt.resolve_native_sources(changed_files, Rules(), Metrics(), db_path)
+    finally:
+        close_connections()
+    assert native_importers == {"src/lonely.cpp": []}
+    assert rules.classify("src/lonely.cpp") == FileClass.CODE
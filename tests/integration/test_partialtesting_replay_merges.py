@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import sqlite3
+import subprocess
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_replay as pt_replay
+
+FAKE_PROJECT = "fake_project"
+
+
+def git(*args):
+    result = subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE)
+    return result.stdout.decode("utf-8").strip()
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def merge(branch_name, path, content):
+    """
+    Merge (--no-ff) a branch changing path into master, returns the merge commit
+    """
+    git("checkout", "-q", "-b", branch_name)
+    write_file(path, content)
+    git("commit", "-q", "-am", f"change {path}")
+    git("checkout", "-q", "master")
+    git("merge", "-q", "--no-ff", "-m", f"merge {branch_name}", branch_name)
+    return git("rev-parse", "HEAD")
+
+
+@pytest.fixture
+def repo_with_merges(tmp_path, monkeypatch):
+    """
+    master: initial - merge1 (pkg/a.py) - merge2 (pkg/b.py) - tests/test_b.py deleted.
+    The coverage build predates both merges: test_a covers pkg/a.py,
+    test_b covers pkg/a.py and pkg/b.py
+    """
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    monkeypatch.chdir(repo)
+    git("init", "-q", "-b", "master")
+    git("config", "user.email", "pt@example.com")
+    git("config", "user.name", "pt")
+
+    write_file("pkg/a.py", "a = 1\n")
+    write_file("pkg/b.py", "b = 1\n")
+    write_file("tests/test_a.py", "def test_a():\n    pass\n")
+    write_file("tests/test_b.py", "def test_b():\n    pass\n")
+    git("add", ".")
+    git("commit", "-q", "-m", "initial")
+
+    merge1 = merge("feature1", "pkg/a.py", "a = 2\n")
+    merge2 = merge("feature2", "pkg/b.py", "b = 2\n")
+    # the current checkout does not define test_b anymore, the merges did
+    git("rm", "-q", "tests/test_b.py")
+    git("commit", "-q", "-m", "drop test_b")
+
+    build_dir = tmp_path / "coverage" / FAKE_PROJECT / "1"
+    build_dir.mkdir(parents=True)
+    db = sqlite3.connect(str(build_dir / pt.COVERAGE_FILE))
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute("CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer )")
+    db.executemany("INSERT INTO file VALUES (?, ?)", [(1, "/ci/repo/pkg/a.py"), (2, "/ci/repo/pkg/b.py")])
+    db.executemany(
+        "INSERT INTO context VALUES (?, ?)", [(1, ""), (2, "tests.test_a.test_a"), (3, "tests.test_b.test_b")]
+    )
+    db.executemany("INSERT INTO arc VALUES (?, ?, 1, 2)", [(1, 2), (1, 3), (2, 3)])
+    db.commit()
+    db.close()
+    os.utime(str(build_dir), (0, 0))
+
+    junit_dir = tmp_path / "junit"
+    junit_dir.mkdir()
+    for commit in (merge1, merge2):
+        (junit_dir / f"{commit}.xml").write_text(
+            "<testsuite>"
+            '<testcase file="tests/test_a.py" name="test_a" time="60" />'
+            '<testcase file="tests/test_b.py" name="test_b" time="120"><failure /></testcase>'
+            "</testsuite>"
+        )
+
+    yield str(tmp_path / "coverage"), str(junit_dir), merge1, merge2
+    pt.close_connections()
+
+
+def test_replay_merge_commits(repo_with_merges):
+    coverage_dir, junit_dir, merge1, merge2 = repo_with_merges
+    output = io.StringIO()
+
+    summary = pt_replay.replay(FAKE_PROJECT, coverage_dir, junit_dir, output, branch="master")
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    # oldest first
+    assert [line.get("commit") for line in lines[:2]] == [merge1, merge2]
+    assert {line["build"] for line in lines[:2]} == {"1"}
+    # test_b is found in the tree of each merge, not in the current checkout
+    assert lines[0]["tests_selected"] == 2
+    assert lines[0]["missed_failures"] == []
+    # pkg/b.py is only covered by test_b
+    assert lines[1]["tests_skipped"] == 1
+    assert lines[2]["summary"] == summary
+    assert summary["cpu_minutes_saved"] == 1.0
+    assert summary["recall"] == 1.0
+    # the checkout and the worktrees are left as they were
+    assert not os.path.exists("tests/test_b.py")
+    assert len(git("worktree", "list").splitlines()) == 1
+
+
+def test_replay_with_selection_options(repo_with_merges):
+    coverage_dir, junit_dir, _, _ = repo_with_merges
+
+    summary = pt_replay.replay(
+        FAKE_PROJECT, coverage_dir, junit_dir, io.StringIO(), branch="master", max_contexts=1
+    )
+
+    # merge1 selects test_a and test_b, more than --max-contexts
+    assert summary["full_tests"] == 1
+    assert summary["tests_skipped"] == 1
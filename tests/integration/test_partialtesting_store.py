@@ -0,0 +1,223 @@
+import concurrent.futures
+import errno
+import os
+import time
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_cleanup as pt_cleanup
+from partialtesting import partialtesting_index as pt_index
+from partialtesting import partialtesting_store as pt_store
+from partialtesting.partialtesting_cache import coverage_build_id
+
+FAKE_PROJECT = "fake_project"
+
+
+def _coverage_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _objects(coverage_dir):
+    return sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(pt_store.objects_dir(coverage_dir))
+        for name in files
+        if not name.endswith(pt_store.USED_MARKER_SUFFIX)
+    )
+
+
+def test_publish_build_deduplicates(tmp_path):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = _coverage_file(tmp_path, "build.coverage", b"coverage data")
+
+    build_1 = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1")
+    build_2 = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "2")
+
+    objects = _objects(coverage_dir)
+    assert len(objects) == 1
+    assert os.path.samefile(f"{build_1}/{pt.COVERAGE_FILE}", objects[0])
+    assert os.path.samefile(f"{build_2}/{pt.COVERAGE_FILE}", objects[0])
+    assert pt.get_last_build_directory(f"{coverage_dir}/{FAKE_PROJECT}/") in ("1", "2")
+
+    other_db_path = _coverage_file(tmp_path, "other.coverage", b"other coverage data")
+    pt_store.publish_build(other_db_path, coverage_dir, FAKE_PROJECT, "3")
+    assert len(_objects(coverage_dir)) == 2
+
+
+def test_collect_garbage(tmp_path):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = _coverage_file(tmp_path, "build.coverage", b"coverage data")
+    build_path = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1")
+
+    assert pt_store.collect_garbage(coverage_dir, grace_seconds=0) == (0, 0)
+
+    os.remove(f"{build_path}/{pt.COVERAGE_FILE}")
+    # too recent, it might be being published
+    assert pt_store.collect_garbage(coverage_dir) == (0, 0)
+    assert pt_store.collect_garbage(coverage_dir, grace_seconds=0) == (1, len(b"coverage data"))
+    assert _objects(coverage_dir) == []
+
+
+def test_storing_an_object_again_leaves_it_untouched(tmp_path):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = _coverage_file(tmp_path, "build.coverage", b"coverage data")
+    build_path = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1")
+    stored_path = _objects(coverage_dir)[0]
+    old_time = time.time() - 2 * pt_store.DEFAULT_GC_GRACE_SECONDS
+    os.utime(stored_path, (old_time, old_time))
+    build_id = coverage_build_id(f"{build_path}/{pt.COVERAGE_FILE}")
+
+    assert pt_store.store_object(db_path, coverage_dir) == stored_path
+
+    # the inode shared with the build is not modified, the build keeps its id
+    assert os.stat(stored_path).st_mtime == old_time
+    assert coverage_build_id(f"{build_path}/{pt.COVERAGE_FILE}") == build_id
+    assert os.path.isfile(pt_store.used_marker_path(stored_path))
+    # but the object counts as recently used
+    os.remove(f"{build_path}/{pt.COVERAGE_FILE}")
+    assert pt_store.collect_garbage(coverage_dir) == (0, 0)
+    assert pt_store.collect_garbage(coverage_dir, grace_seconds=0) == (1, len(b"coverage data"))
+    assert os.listdir(os.path.dirname(stored_path)) == []
+
+
+def test_publish_build_without_hardlinks(tmp_path, monkeypatch):
+    def no_hardlinks(src, dst):
+        raise OSError(errno.EPERM, "hardlinks not supported")
+
+    monkeypatch.setattr(os, "link", no_hardlinks)
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = _coverage_file(tmp_path, "build.coverage", b"coverage data")
+
+    build_path = pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1")
+
+    assert os.path.islink(f"{build_path}/{pt.COVERAGE_FILE}")
+    with open(f"{build_path}/{pt.COVERAGE_FILE}", "rb") as f:
+        assert f.read() == b"coverage data"
+    # symlinked objects are referenced too
+    assert pt_store.collect_garbage(coverage_dir, grace_seconds=0) == (0, 0)
+
+
+def test_clean_coverage_data_keeps_the_objects_of_the_last_build(tmp_path):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    project_dir = f"{FAKE_PROJECT}/master"
+    old_db_path = _coverage_file(tmp_path, "old.coverage", b"old coverage data")
+    new_db_path = _coverage_file(tmp_path, "new.coverage", b"new coverage data")
+
+    pt_store.publish_build(old_db_path, coverage_dir, project_dir, "1")
+    old_time = time.time() - 60
+    os.utime(f"{coverage_dir}/{project_dir}/1", (old_time, old_time))
+    pt_store.publish_build(new_db_path, coverage_dir, project_dir, "2")
+
+    pt_cleanup.clean_coverage_data(coverage_dir, "master")
+    pt_store.collect_garbage(coverage_dir, grace_seconds=0)
+
+    assert os.listdir(f"{coverage_dir}/{project_dir}") == ["2"]
+    assert _objects(coverage_dir) == [
+        pt_store.object_path(coverage_dir, pt_store.file_digest(new_db_path))
+    ]
+
+
+def test_publish_build_updates_the_reverse_index(tmp_path, create_coverage_db):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    project_dir = f"{coverage_dir}/{FAKE_PROJECT}"
+
+    db_path = str(tmp_path / "1.coverage")
+    create_coverage_db(
+        db_path, [("/ci/pkg/a.py", "test_a"), ("/ci/pkg/b.py", "test_a"), ("/ci/pkg/b.py", "test_b")]
+    )
+    pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1", update_index=True)
+
+    db_path = str(tmp_path / "2.coverage")
+    create_coverage_db(
+        db_path, [("/ci/pkg/a.py", "test_a"), ("/ci/pkg/b.py", "test_b"), ("/ci/pkg/c.py", "test_c")]
+    )
+    os.utime(f"{project_dir}/1", (time.time() - 60, time.time() - 60))
+    pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "2", update_index=True)
+
+    current = pt_index.read_current_generation(project_dir)
+    assert current["generation"] == "gen-00000002.db"
+    assert current["build_id"] == coverage_build_id(f"{project_dir}/2/{pt.COVERAGE_FILE}")
+
+    # the lookups use the index of the latest build
+    project_data = pt.resolve_project(FAKE_PROJECT, coverage_dir)
+    assert project_data.reverse_index_path == f"{project_dir}/.reverse_index/gen-00000002.db"
+    assert pt.identify_tests_related_to_modified_files(
+        [pt.File("pkg/b.py", "M"), pt.File("pkg/c.py", "M")], project_data
+    ) == ["test_b", "test_c"]
+    pt.close_connections()
+
+    # the previous generation is kept for the readers still using it
+    assert pt_index.get_tests_that_use_file_from_index(
+        "pkg/b.py", f"{project_dir}/.reverse_index/gen-00000001.db"
+    ) == ["test_a", "test_b"]
+    pt.close_connections()
+
+
+def test_reverse_index_deleted_after_it_was_resolved(tmp_path, create_coverage_db):
+    coverage_dir = str(tmp_path / "saved_coverage")
+    db_path = create_coverage_db(str(tmp_path / "1.coverage"), [("/ci/pkg/a.py", "test_a")])
+    pt_store.publish_build(db_path, coverage_dir, FAKE_PROJECT, "1", update_index=True)
+    project_data = pt.resolve_project(FAKE_PROJECT, coverage_dir)
+
+    # e.g. two newer builds were indexed in the meantime
+    os.remove(project_data.reverse_index_path)
+
+    try:
+        assert pt.identify_tests_related_to_modified_files([pt.File("pkg/a.py", "M")], project_data) == [
+            "test_a"
+        ]
+    finally:
+        pt.close_connections()
+    assert project_data.reverse_index_path is None
+
+
+def test_concurrent_reverse_index_updates(tmp_path, create_coverage_db):
+    project_dir = str(tmp_path / FAKE_PROJECT)
+    db_path = str(tmp_path / "1.coverage")
+    create_coverage_db(db_path, [("pkg/a.py", "test_a")])
+
+    # e.g. several builds landing at once, each publishing from its own process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(pt_index.update_reverse_index, project_dir, db_path, f"build-{build}")
+            for build in range(8)
+        ]
+        generations = sorted(future.result()["generation"] for future in futures)
+
+    # no generation was published twice
+    assert generations == [f"gen-{number:08d}.db" for number in range(1, 9)]
+    assert pt_index.read_current_generation(project_dir)["number"] == 8
+
+
+def test_update_reverse_index_patches_the_delta(tmp_path, create_coverage_db):
+    project_dir = str(tmp_path / FAKE_PROJECT)
+    db_path = str(tmp_path / "1.coverage")
+    create_coverage_db(db_path, [("pkg/a.py", "test_a"), ("pkg/b.py", "test_b")])
+    stats = pt_index.update_reverse_index(project_dir, db_path, "build-1")
+    assert (stats["files_added"], stats["files_removed"], stats["files_changed"]) == (2, 0, 0)
+
+    db_path = str(tmp_path / "2.coverage")
+    create_coverage_db(
+        db_path, [("pkg/a.py", "test_a"), ("pkg/b.py", "test_a"), ("pkg/c.py", "test_c")]
+    )
+    stats = pt_index.update_reverse_index(project_dir, db_path, "build-2")
+    assert stats == {
+        "generation": "gen-00000002.db",
+        "files_added": 1,
+        "files_removed": 0,
+        "files_changed": 1,
+        "contexts_changed": 3,  # test_a and test_b for pkg/b.py, test_c
+    }
+
+    for build in range(3, 5):
+        pt_index.update_reverse_index(project_dir, db_path, f"build-{build}")
+    assert sorted(os.listdir(f"{project_dir}/.reverse_index")) == [
+        "CURRENT",
+        "LOCK",
+        "gen-00000003.db",
+        "gen-00000004.db",
+    ]
+    for name in ("CURRENT", "gen-00000004.db"):
+        assert os.stat(f"{project_dir}/.reverse_index/{name}").st_mode & 0o777 == 0o644
+    assert pt_index.find_reverse_index(project_dir, "build-3") is None
@@ -0,0 +1,130 @@
+import logging
+import os
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_update as pt_update
+from partialtesting.partialtesting_index import TestDefinitionIndex
+
+logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+
+FAKE_PROJECT = "fake_project"
+
+
+@pytest.fixture(scope="function")
+def coverage_dir(tmp_path, create_coverage_db):
+    build_path = tmp_path / FAKE_PROJECT / "100"
+    build_path.mkdir(parents=True)
+    create_coverage_db(
+        str(build_path / pt.COVERAGE_FILE),
+        [
+            ("nontestfile1.py", "test_a"),
+            ("nontestfile2.py", "test_a"),
+            ("nontestfile2.py", "test_b"),
+        ],
+    )
+    return str(tmp_path)
+
+
+def test_update_baseline_replaces_rows_of_rerun_tests(coverage_dir, tmp_path, create_coverage_db):
+
+    # test_a no longer uses nontestfile2.py but now uses the new nontestfile3.py
+    partial_db_path = str(tmp_path / "partial.coverage")
+    create_coverage_db(
+        partial_db_path,
+        [("nontestfile1.py", "test_a"), ("nontestfile3.py", "test_a")],
+    )
+
+    build_path = pt_update.update_baseline(
+        FAKE_PROJECT, coverage_dir, partial_db_path, build_number="101"
+    )
+
+    new_db_path = f"{build_path}/{pt.COVERAGE_FILE}"
+    assert pt.get_tests_that_use_file("nontestfile1.py", new_db_path) == ["test_a"]
+    assert pt.get_tests_that_use_file("nontestfile2.py", new_db_path) == ["test_b"]
+    assert pt.get_tests_that_use_file("nontestfile3.py", new_db_path) == ["test_a"]
+
+    # the previous build is left untouched
+    old_db_path = f"{coverage_dir}/{FAKE_PROJECT}/100/{pt.COVERAGE_FILE}"
+    assert sorted(pt.get_tests_that_use_file("nontestfile2.py", old_db_path)) == [
+        "test_a",
+        "test_b",
+    ]
+
+    # and the new build is the one partialtesting picks up
+    assert pt.Project(FAKE_PROJECT, coverage_dir).coverage_db_path == new_db_path
+
+
+def test_publish_build_refuses_to_overwrite(coverage_dir):
+
+    with pytest.raises(Exception):
+        pt_update.publish_build(
+            f"{coverage_dir}/{FAKE_PROJECT}/100/{pt.COVERAGE_FILE}",
+            coverage_dir,
+            FAKE_PROJECT,
+            "100",
+        )
+
+    # no temporary build directories are left behind
+    assert os.listdir(f"{coverage_dir}/{FAKE_PROJECT}") == ["100"]
+
+
+def test_slice_test_files():
+    definitions = {f"test_{index}": {f"tests/test_file_{index}.py"} for index in range(40)}
+    test_index = TestDefinitionIndex("tests", definitions)
+
+    slices = [pt_update.slice_test_files(test_index, 4, index) for index in range(4)]
+
+    # every test file is in exactly one slice, and always the same one
+    assert sorted(sum(slices, [])) == sorted(f"tests/test_file_{index}.py" for index in range(40))
+    assert all(slices)
+    assert pt_update.slice_test_files(test_index, 4, 2) == slices[2]
+    assert pt_update.slice_test_files(test_index, 1, 0) == sorted(sum(slices, []))
+
+
+def test_slice_cli(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_x.py").write_text("def test_x():\n    pass\n")
+    runner = CliRunner()
+
+    result = runner.invoke(pt_update.slice_main, ["--slices", "1", "--slice", "0", "--output-file", "slice.txt"])
+    assert result.exit_code == 0
+    assert (tmp_path / "slice.txt").read_text() == "tests/test_x.py\n"
+
+    result = runner.invoke(pt_update.slice_main, ["--slices", "2", "--slice", "2"])
+    assert result.exit_code != 0
+
+    # more slices than test files: some slices are empty
+    empty_slices = 0
+    for index in range(4):
+        result = runner.invoke(
+            pt_update.slice_main, ["--slices", "4", "--slice", str(index), "--output-file", "slice.txt"]
+        )
+        assert result.exit_code == 0
+        empty_slices += (tmp_path / "slice.txt").read_text() == ""
+    assert empty_slices == 3
+
+
+def test_update_baseline_prunes_deleted_tests(coverage_dir, tmp_path, monkeypatch, create_coverage_db):
+    # test_b was deleted from the test suite since build 100
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_a.py").write_text("def test_a():\n    pass\n")
+    partial_db_path = str(tmp_path / "partial.coverage")
+    create_coverage_db(partial_db_path, [("nontestfile1.py", "test_a")])
+
+    build_path = pt_update.update_baseline(
+        FAKE_PROJECT, coverage_dir, partial_db_path, build_number="101", prune=True, commit="abc123"
+    )
+
+    new_db_path = f"{build_path}/{pt.COVERAGE_FILE}"
+    assert pt.get_tests_that_use_file("nontestfile1.py", new_db_path) == ["test_a"]
+    assert pt.get_tests_that_use_file("nontestfile2.py", new_db_path) == []
+    assert pt.count_known_tests(new_db_path) == 1
+
+    # found by --build-from-merge-base
+    assert pt.read_build_commits(f"{coverage_dir}/{FAKE_PROJECT}") == {"abc123": "101"}
@@ -6,6 +6,7 @@ import pytest
 from click.testing import CliRunner
 
 from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_metrics as pt_metrics
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -485,6 +486,28 @@ def test_cli_args():
                 "--compare-to-branch",
                 "my_custom_branch",
                 "--line-coverage",
+                "--metrics-file",
+                "my_metrics.json",
+                "--result-cache-dir",
+                "my_cache_dir",
+                "--result-cache-max-size",
+                "10",
+                "--max-contexts",
+                "500",
+                "--max-selected-percent",
+                "80",
+                "--skip-non-semantic-changes",
+                "--test-result-cache-dir",
+                "my_passes_dir",
+                "--build-from-merge-base",
+                "--history-file",
+                "my_history.json",
+                "--history-defer-below",
+                "0.01",
+                "--group-workers",
+                "4",
+                "--manifest-file",
+                "my_manifest.json",
             ],
             catch_exceptions=False,
         )
@@ -501,6 +524,18 @@ def test_cli_args():
         "my_out_file",
         "my_custom_branch",
         True,
+        "my_metrics.json",
+        result_cache_dir="my_cache_dir",
+        result_cache_max_size_mb=10,
+        max_contexts=500,
+        max_selected_percent=80.0,
+        skip_non_semantic_changes=True,
+        test_result_cache_dir="my_passes_dir",
+        build_from_merge_base=True,
+        history_file="my_history.json",
+        history_defer_below=0.01,
+        group_workers=4,
+        manifest_file="my_manifest.json",
     )
 
 
@@ -523,5 +558,199 @@ def test_cli_args_git_diff_use_head_flag(flag_applied):
 
     # Assert
     mock_detect_relevant_tests.assert_called_once_with(
-        ANY, ANY, flag_applied, ANY, ANY, ANY, ANY, flag_applied
+        ANY,
+        ANY,
+        flag_applied,
+        ANY,
+        ANY,
+        ANY,
+        ANY,
+        flag_applied,
+        None,
+        result_cache_dir=None,
+        result_cache_max_size_mb=ANY,
+        max_contexts=None,
+        max_selected_percent=None,
+        skip_non_semantic_changes=False,
+        test_result_cache_dir=None,
+        build_from_merge_base=False,
+        history_file=None,
+        history_defer_below=None,
+        group_workers=None,
+        manifest_file=None,
     )
+
+
+def test_cli_args_multiple_projects():
+    # Setup
+    runner = CliRunner()
+
+    with patch.object(
+        pt, pt.detect_relevant_tests_for_projects.__name__, autospec=True
+    ) as mock_detect_for_projects:
+        # Execute
+        runner.invoke(
+            pt.main,
+            args=[
+                "--project-name",
+                "project_a",
+                "--project-name",
+                "project_b",
+                "--coverage-dir",
+                "/coverage_dir",
+                "--max-workers",
+                "3",
+            ],
+            catch_exceptions=False,
+        )
+
+    # Assert
+    mock_detect_for_projects.assert_called_once_with(
+        ("project_a", "project_b"),
+        "/coverage_dir",
+        False,
+        ANY,
+        ANY,
+        pt.TEST_FILES_TO_RUN_ALL_STAGES,
+        ANY,
+        False,
+        None,
+        3,
+        max_contexts=None,
+        max_selected_percent=None,
+        skip_non_semantic_changes=False,
+        manifest_file=None,
+    )
+
+
+@pytest.mark.parametrize(
+    "option", [["--result-cache-dir", "cache"], ["--build-from-merge-base"], ["--group-workers", "4"]]
+)
+def test_cli_single_project_options_with_multiple_projects(option):
+    # Setup
+    runner = CliRunner()
+
+    with patch.object(
+        pt, pt.detect_relevant_tests_for_projects.__name__, autospec=True
+    ) as mock_detect_for_projects:
+        # Execute
+        result = runner.invoke(
+            pt.main,
+            args=["--project-name", "project_a", "--project-name", "project_b", "--coverage-dir", "/coverage_dir"]
+            + option,
+        )
+
+    # Assert
+    assert result.exit_code == 2
+    assert f"{option[0]} cannot be used with several projects" in result.output
+    mock_detect_for_projects.assert_not_called()
+
+
+@pytest.mark.parametrize("workers", ["0", "-2"])
+def test_cli_group_workers_must_be_positive(workers):
+    runner = CliRunner()
+
+    with patch.object(pt, pt.detect_relevant_tests.__name__, autospec=True) as mock_detect:
+        result = runner.invoke(
+            pt.main, args=["--project-name", "project_a", "--coverage-dir", "/coverage_dir", "--group-workers", workers]
+        )
+
+    assert result.exit_code == 2
+    assert "--group-workers" in result.output
+    mock_detect.assert_not_called()
+
+
+def test_project_output_file():
+
+    assert (
+        pt.project_output_file("out/test_files_to_run.txt", "numpy")
+        == "out/test_files_to_run_numpy.txt"
+    )
+    assert pt.summary_output_file("out/test_files_to_run.txt") == "out/test_files_to_run_summary.json"
+
+
+def test_context_budget():
+
+    budget = pt.ContextBudget(2)
+    budget.add("test_a")
+    budget.add("test_a")  # only distinct contexts count
+    budget.add("test_b")
+    assert budget.exceeded is False
+
+    with pytest.raises(pt.SelectionTooLarge):
+        budget.add("test_c")
+    assert budget.exceeded is True
+
+    # once exceeded, concurrent lookups stop too
+    with pytest.raises(pt.SelectionTooLarge):
+        budget.add("test_a")
+
+
+def test_metrics_phases_counts_and_hooks():
+
+    events = []
+
+    def hook(event, payload):
+        events.append((event, payload.get("phase", payload.get("name"))))
+
+    pt_metrics.register_hook(hook)
+    try:
+        metrics = pt_metrics.Metrics(labels={"project": "helloworld"})
+        with metrics.phase("git_diff"):
+            pass
+        metrics.count("changed_files", 3)
+    finally:
+        pt_metrics.unregister_hook(hook)
+
+    assert events == [
+        (pt_metrics.PHASE_STARTED, "git_diff"),
+        (pt_metrics.PHASE_FINISHED, "git_diff"),
+        (pt_metrics.COUNT, "changed_files"),
+    ]
+    assert set(metrics.timings) == {"git_diff"}
+    assert metrics.counts == {"changed_files": 3}
+
+    prometheus = metrics.to_prometheus()
+    assert 'partialtesting_phase_seconds{phase="git_diff",project="helloworld"}' in prometheus
+    assert 'partialtesting_changed_files{project="helloworld"} 3' in prometheus
+
+
+def test_metrics_broken_hook_is_ignored():
+
+    def broken_hook(event, payload):
+        raise ValueError("broken")
+
+    pt_metrics.register_hook(broken_hook)
+    try:
+        metrics = pt_metrics.Metrics()
+        metrics.count("tests_selected", 1)
+    finally:
+        pt_metrics.unregister_hook(broken_hook)
+
+    assert metrics.counts == {"tests_selected": 1}
+
+
+def test_dependency_changes_of_project_special_files(tmp_path):
+    (tmp_path / ".partialtesting").write_text("[rules]\nspecial = *.lock\n")
+    rules = pt.load_rules(pt.SPECIAL_FILES_DEFAULT, pt.SPECIAL_EXTENSIONS_DEFAULT, str(tmp_path))
+    old_lock = '[[package]]\nname = "numpy"\nversion = "1.0"\n'
+    sources = {
+        "poetry.lock": (old_lock.encode(), old_lock.replace("1.0", "1.1").encode()),
+        "requirements.txt": (b"six==1.0\n", b"six==1.1\n"),
+    }
+    changed_files = [pt.File("poetry.lock", "M"), pt.File("requirements.txt", "M")]
+
+    def read_sources(paths, old_revision, new_revision):
+        return {path: sources[path] for path in paths}
+
+    with patch.object(pt, pt.read_sources.__name__, side_effect=read_sources) as mock_read_sources, patch.object(
+        pt, pt.diff_revisions.__name__, return_value=("merge_base", "HEAD")
+    ):
+        dependency_changes = pt.find_dependency_only_changes(
+            changed_files, True, "master", pt_metrics.Metrics(), rules
+        )
+
+    # poetry.lock is special for the project: a full test whatever changed in it
+    mock_read_sources.assert_called_once_with(["requirements.txt"], "merge_base", "HEAD")
+    assert set(dependency_changes) == {"requirements.txt"}
+    assert rules.classify("poetry.lock") == pt.FileClass.SPECIAL
@@ -0,0 +1,72 @@
+import textwrap
+
+import pytest
+
+from partialtesting.partialtesting_ast import semantically_equal
+
+BASE = textwrap.dedent(
+    '''
+    """Module docstring"""
+    import os
+    from functools import partial
+
+
+    @dataclass
+    class Point:
+        x: int = 0
+
+        def norm(self, scale: float = 1.0) -> float:
+            """Norm of the point"""
+            total: float = self.x * scale
+            return abs(total)
+    '''
+)
+
+
+@pytest.mark.parametrize(
+    "new_source",
+    [
+        # comments and formatting
+        BASE.replace("import os", "import os  # paths").replace("abs(total)", "abs( total )"),
+        # docstrings
+        BASE.replace('"""Norm of the point"""', '"""\n    Norm of the point, always >= 0\n    """'),
+        BASE.replace('"""Module docstring"""\n', ""),
+        # local variable annotations
+        BASE.replace("total: float =", "total ="),
+        # import order
+        BASE.replace("import os\nfrom functools import partial", "from functools import partial\nimport os"),
+    ],
+)
+def test_non_semantic_changes(new_source):
+    assert semantically_equal(BASE, new_source) is True
+
+
+@pytest.mark.parametrize(
+    "new_source",
+    [
+        BASE.replace("abs(total)", "total"),
+        BASE.replace("import os", "import sys"),
+        BASE.replace("scale: float = 1.0", "scale: float = 2.0"),
+        # function signature annotations are used at runtime (e.g. functools.singledispatch)
+        BASE.replace("scale: float = 1.0) -> float", "scale=1.0)"),
+        BASE.replace("-> float", "-> int"),
+        # class level annotations are used at runtime (e.g. dataclasses)
+        BASE.replace("x: int = 0", "x: float = 0"),
+        BASE.replace("def norm", "async def norm"),
+        # cannot be parsed: considered changed
+        BASE.replace("return abs(total)", "return abs(total"),
+    ],
+)
+def test_semantic_changes(new_source):
+    assert semantically_equal(BASE, new_source) is False
+
+
+def test_docstring_only_function_body():
+    assert semantically_equal('def f():\n    """doc"""\n', "def f():\n    pass\n") is True
+
+
+def test_imports_binding_the_same_name_keep_their_order():
+    assert semantically_equal("from a import x\nfrom b import x\n", "from b import x\nfrom a import x\n") is False
+    assert semantically_equal("import a\nimport b\n", "import b\nimport a\n") is True
+    # only consecutive imports are reordered
+    assert semantically_equal("import a\nx = 1\nimport b\n", "import b\nx = 1\nimport a\n") is False
@@ -0,0 +1,46 @@
+import os
+
+from partialtesting import partialtesting_cache as pt_cache
+
+
+def test_result_cache_miss_and_hit(tmp_path):
+
+    cache = pt_cache.ResultCache(str(tmp_path))
+
+    assert cache.get("key1") == (False, None)
+
+    cache.put("key1", {"tests/unit/test_a.py", "tests/unit/test_b.py"})
+    assert cache.get("key1") == (True, {"tests/unit/test_a.py", "tests/unit/test_b.py"})
+
+    # full tests (None) and no tests (empty set) are cached too
+    cache.put("key2", None)
+    assert cache.get("key2") == (True, None)
+    cache.put("key3", set())
+    assert cache.get("key3") == (True, set())
+    # the cache is shared by the CI jobs of other users
+    assert os.stat(cache._path("key1")).st_mode & 0o777 == pt_cache.SHARED_FILE_MODE
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+
+    cache = pt_cache.ResultCache(str(tmp_path))
+    cache.put("old", {"tests/unit/test_a.py"})
+    cache.put("new", {"tests/unit/test_b.py"})
+    os.utime(tmp_path / "old.json", (1, 1))
+
+    entry_size = os.path.getsize(tmp_path / "new.json")
+    cache.max_size_bytes = entry_size
+    cache.evict()
+
+    assert cache.get("old") == (False, None)
+    assert cache.get("new") == (True, {"tests/unit/test_b.py"})
+
+
+def test_selection_cache_key():
+
+    key = pt_cache.selection_cache_key("build1", "sha1", "sha2", {"special_files": ["setup.py"]})
+
+    assert key == pt_cache.selection_cache_key("build1", "sha1", "sha2", {"special_files": ["setup.py"]})
+    assert key != pt_cache.selection_cache_key("build2", "sha1", "sha2", {"special_files": ["setup.py"]})
+    assert key != pt_cache.selection_cache_key("build1", "sha1", "sha3", {"special_files": ["setup.py"]})
+    assert key != pt_cache.selection_cache_key("build1", "sha1", "sha2", {"special_files": []})
@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+
+import pytest
+
+from partialtesting import partialtesting_db as pt_db
+
+
+@pytest.fixture(scope="function")
+def db_path(tmp_path):
+    path = str(tmp_path / ".coverage")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) );")
+    db.execute("INSERT INTO file(path) VALUES ('file1.py')")
+    db.commit()
+    db.close()
+    return path
+
+
+def test_open_readonly(db_path):
+
+    db = pt_db.open_readonly(db_path)
+
+    assert db.execute("select path from file").fetchall() == [("file1.py",)]
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute("INSERT INTO file(path) VALUES ('file2.py')")
+
+
+def test_open_readonly_does_not_create_missing_db(tmp_path):
+
+    with pytest.raises(sqlite3.OperationalError):
+        pt_db.open_readonly(str(tmp_path / "missing.coverage"))
+
+    assert not (tmp_path / "missing.coverage").exists()
+
+
+def test_connection_pool_reuses_connections_per_thread(db_path):
+
+    pool = pt_db.ConnectionPool()
+    db = pool.get(db_path)
+    assert pool.get(db_path) is db
+
+    other_thread_dbs = []
+    thread = threading.Thread(target=lambda: other_thread_dbs.append(pool.get(db_path)))
+    thread.start()
+    thread.join()
+    assert other_thread_dbs[0] is not db
+
+    pool.close()
+    assert pool._connections == {}
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("select 1")
+
+
+def test_connection_pool_keeps_connections_of_running_threads(db_path):
+
+    pool = pt_db.ConnectionPool()
+    opened = threading.Event()
+    done = threading.Event()
+
+    def _use_db():
+        pool.get(db_path)
+        opened.set()
+        done.wait()
+
+    thread = threading.Thread(target=_use_db)
+    thread.start()
+    opened.wait()
+
+    pool.close(db_path)
+    assert len(pool._connections) == 1
+
+    done.set()
+    thread.join()
+    pool.close(db_path)
+    assert pool._connections == {}
@@ -0,0 +1,141 @@
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from partialtesting import partialtesting_deps as pt_deps
+from partialtesting.partialtesting_deps import (
+    changed_distributions,
+    is_dependency_file,
+    parse_requirements,
+    record_distributions,
+    tomllib,
+)
+from partialtesting.partialtesting_rules import Rules
+
+SETUP_PY = """\
+from setuptools import setup
+
+setup(
+    name="pkg",
+    version="1.0",
+    install_requires=["numpy>=1.20", "pandas"],
+    extras_require={"tests": ["pytest"]},
+)
+"""
+
+SETUP_CFG = """\
+[metadata]
+name = pkg
+
+[options]
+install_requires =
+    numpy>=1.20
+    pandas
+"""
+
+
+def test_is_dependency_file():
+    assert is_dependency_file("setup.py") is True
+    assert is_dependency_file("requirements-dev.txt") is True
+    assert is_dependency_file("poetry.lock") is True
+    assert is_dependency_file("docs/index.txt") is False
+    assert is_dependency_file("pkg/setup_utils.py") is False
+    # only the ones of the project root...
+    assert is_dependency_file("docs/requirements.txt") is False
+    assert is_dependency_file("tests/fixtures/setup.cfg") is False
+    # ...unless the rules say otherwise
+    rules = Rules(dependency_files=["projects/*/setup.cfg"])
+    assert is_dependency_file("projects/x/setup.cfg", rules) is True
+    assert is_dependency_file("tests/fixtures/setup.cfg", rules) is False
+
+
+def test_parse_requirements():
+    assert parse_requirements(
+        [
+            "# pinned",
+            "-r base.txt",
+            "NumPy == 1.21  # security fix",
+            "scikit_learn[alldeps]>=1.0; python_version >= '3.8'",
+            "",
+        ]
+    ) == {
+        "numpy": "NumPy==1.21",
+        "scikit-learn": "scikit_learn[alldeps]>=1.0;python_version>='3.8'",
+    }
+
+
+@pytest.mark.parametrize(
+    "path,old_content,new_content,expected",
+    [
+        # bumped, added and removed dependencies
+        ("setup.py", SETUP_PY, SETUP_PY.replace("numpy>=1.20", "numpy>=1.22"), {"numpy"}),
+        ("setup.py", SETUP_PY, SETUP_PY.replace('"pandas"', '"pandas", "scipy"'), {"scipy"}),
+        ("setup.py", SETUP_PY, SETUP_PY.replace('["pytest"]', "[]"), {"pytest"}),
+        ("setup.cfg", SETUP_CFG, SETUP_CFG.replace("    pandas\n", ""), {"pandas"}),
+        ("requirements.txt", "numpy==1.0\n", "numpy==1.1\npandas==2.0\n", {"numpy", "pandas"}),
+        ("requirements.txt", None, "numpy==1.0\n", {"numpy"}),
+        # only formatting
+        ("setup.py", SETUP_PY, SETUP_PY.replace('"pandas"', "'pandas'"), set()),
+        # other changes than the dependencies
+        ("setup.py", SETUP_PY, SETUP_PY.replace('version="1.0"', 'version="1.1"'), None),
+        ("setup.cfg", SETUP_CFG, SETUP_CFG.replace("name = pkg", "name = pkg2"), None),
+        ("setup.py", SETUP_PY, SETUP_PY.replace('["numpy>=1.20", "pandas"]', "read_requirements()"), None),
+        ("setup.py", None, SETUP_PY, None),
+    ],
+)
+def test_changed_distributions(path, old_content, new_content, expected):
+    assert changed_distributions(path, old_content, new_content) == expected
+
+
+@pytest.mark.skipif(tomllib is None, reason="tomllib/tomli is not available")
+def test_changed_distributions_lock_file():
+    old_lock = '[[package]]\nname = "numpy"\nversion = "1.0"\n\n[[package]]\nname = "six"\nversion = "1.16"\n'
+    new_lock = old_lock.replace('"1.0"', '"1.1"')
+
+    assert changed_distributions("poetry.lock", old_lock, new_lock) == {"numpy"}
+
+
+def test_tests_using_distributions():
+    distributions_map = {"test_a": ["numpy"], "test_b": ["numpy", "pandas"], "test_c": []}
+
+    assert pt_deps.tests_using_distributions(distributions_map, {"pandas"}) == {"test_b"}
+    assert pt_deps.tests_using_distributions(distributions_map, {"numpy", "six"}) == {"test_a", "test_b"}
+
+
+@pytest.mark.skipif(
+    pt_deps.packages_distributions is None, reason="importlib.metadata.packages_distributions is not available"
+)
+def test_record_distributions(tmp_path):
+    uses_click = tmp_path / "uses_click.py"
+    uses_click.write_text("import click\nfrom os import path\n")
+    plain = tmp_path / "plain.py"
+    plain.write_text("import os\n")
+
+    db_path = str(tmp_path / ".coverage")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute("CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer )")
+    db.execute(f"INSERT INTO file VALUES (1, '{uses_click}'), (2, '{plain}')")
+    db.execute("INSERT INTO context VALUES (1, 'test_cli'), (2, 'test_plain'), (3, '')")
+    db.execute("INSERT INTO arc VALUES (1, 1, 1, 2), (2, 1, 1, 2), (2, 2, 1, 2), (1, 3, 1, 2)")
+    db.commit()
+    db.close()
+
+    distributions_map = record_distributions(db_path)
+
+    assert distributions_map == {"test_cli": ["click"], "test_plain": []}
+
+
+def test_record_distributions_without_packages_distributions(tmp_path, monkeypatch):
+    monkeypatch.setattr(pt_deps, "packages_distributions", None)
+    output_file = tmp_path / "distributions.json"
+
+    result = CliRunner().invoke(
+        pt_deps.main, ["--coverage-file", str(tmp_path / ".coverage"), "--output-file", str(output_file)]
+    )
+
+    assert result.exit_code == 1
+    assert "requires Python >= 3.10" in result.output
+    assert not output_file.exists()
@@ -0,0 +1,121 @@
+import json
+import sqlite3
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_db import close_connections
+from partialtesting.partialtesting_groups import covered_files_by_test_file, group_names, group_test_files
+from partialtesting.partialtesting_index import TestDefinitionIndex
+from partialtesting.partialtesting_metrics import Metrics
+
+DEFINITIONS = {
+    "test_db_1": {"tests/test_db_1.py"},
+    "test_db_2": {"tests/test_db_2.py"},
+    "test_db_3": {"tests/test_db_2.py"},
+    "test_cli": {"tests/test_cli.py"},
+    "test_new": {"tests/test_new.py"},
+}
+
+
+@pytest.fixture
+def coverage_db(tmp_path):
+    db_path = str(tmp_path / ".coverage")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute("CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer )")
+    db.executemany(
+        "INSERT INTO file VALUES (?, ?)",
+        [(1, "/repo/pkg/db.py"), (2, "/repo/pkg/models.py"), (3, "/repo/pkg/cli.py")],
+    )
+    db.executemany(
+        "INSERT INTO context VALUES (?, ?)",
+        [
+            (1, ""),
+            (2, "tests.test_db_1.test_db_1"),
+            (3, "tests.test_db_2.test_db_2"),
+            (4, "tests.test_db_2.test_db_3"),
+            (5, "tests.test_cli.test_cli"),
+        ],
+    )
+    db.executemany(
+        "INSERT INTO arc VALUES (?, ?, 1, 2)",
+        [(1, 1), (1, 2), (2, 2), (1, 3), (2, 4), (3, 5)],
+    )
+    db.commit()
+    db.close()
+    yield db_path
+    close_connections()
+
+
+def test_covered_files_by_test_file(coverage_db):
+    covered = covered_files_by_test_file(
+        coverage_db,
+        {"tests/test_db_1.py", "tests/test_db_2.py", "tests/test_new.py"},
+        TestDefinitionIndex("tests", DEFINITIONS),
+    )
+
+    assert covered == {
+        "tests/test_db_1.py": ({"/repo/pkg/db.py", "/repo/pkg/models.py"}, 1),
+        "tests/test_db_2.py": ({"/repo/pkg/db.py", "/repo/pkg/models.py"}, 2),
+        "tests/test_new.py": (set(), 0),
+    }
+
+
+def test_group_test_files_by_overlap():
+    covered = {
+        "tests/test_db_1.py": ({"db.py", "models.py"}, 2),
+        "tests/test_db_2.py": ({"db.py", "models.py", "orm.py"}, 2),
+        "tests/test_cli_1.py": ({"cli.py"}, 2),
+        "tests/test_cli_2.py": ({"cli.py", "args.py"}, 2),
+    }
+
+    assert group_test_files(covered, 2) == [
+        ["tests/test_cli_1.py", "tests/test_cli_2.py"],
+        ["tests/test_db_1.py", "tests/test_db_2.py"],
+    ]
+    # one group per test file at most
+    assert len(group_test_files(covered, 8)) == 4
+    assert group_test_files({}, 2) == []
+
+
+def test_group_test_files_balances_the_groups():
+    # everything covers the same files, only the sizes tell the groups apart
+    covered = {f"tests/test_{index}.py": ({"core.py"}, 10) for index in range(6)}
+
+    groups = group_test_files(covered, 3)
+
+    assert sorted(len(group) for group in groups) == [2, 2, 2]
+
+
+def test_group_names():
+    assert group_names([["a.py", "b.py"], ["c.py"]]) == {
+        "a.py": "partialtesting_0",
+        "b.py": "partialtesting_0",
+        "c.py": "partialtesting_1",
+    }
+
+
+def test_write_test_groups(coverage_db, tmp_path):
+    project_data = pt.Project("project", str(tmp_path), "1")
+    project_data.coverage_db_path = coverage_db
+    output_file = str(tmp_path / "test_files_to_run.txt")
+    metrics = Metrics()
+
+    groups = pt.write_test_groups(
+        {"tests/test_db_1.py", "tests/test_db_2.py", "tests/test_cli.py"},
+        project_data,
+        TestDefinitionIndex("tests", DEFINITIONS),
+        3,
+        output_file,
+        metrics,
+    )
+
+    # test_db_1.py would fit with test_db_2.py only by overfilling its group
+    assert groups == [["tests/test_db_2.py"], ["tests/test_cli.py"], ["tests/test_db_1.py"]]
+    with open(pt.groups_output_file(output_file)) as f:
+        assert json.load(f) == group_names(groups)
+    with open(pt.worker_output_file(output_file, 1)) as f:
+        assert f.read().splitlines() == ["tests/test_cli.py"]
+    assert metrics.counts["test_groups"] == 3
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_history as pt_history
+from partialtesting.partialtesting_history import CoFailureModel
+from partialtesting.partialtesting_metrics import Metrics
+from partialtesting.partialtesting_results import TestResult
+
+
+def _results(failing=(), passing=("tests/test_a.py", "tests/test_b.py", "tests/test_config.py")):
+    return [TestResult(test_file, "test_x", 1.0, test_file in failing) for test_file in set(passing) | set(failing)]
+
+
+@pytest.fixture
+def model():
+    model = CoFailureModel()
+    # test_config.py reads settings.yaml, which the coverage data cannot know
+    for _ in range(3):
+        model.add_run(["pkg/settings.yaml"], _results(failing=["tests/test_config.py"]))
+    model.add_run(["pkg/settings.yaml"], _results())
+    # a single failure of test_b.py with pkg/core.py
+    model.add_run(["pkg/core.py"], _results(failing=["tests/test_b.py"]))
+    for _ in range(5):
+        model.add_run(["pkg/core.py"], _results())
+    return model
+
+
+def test_add_run(model):
+    assert model.runs == {"pkg/settings.yaml": 4, "pkg/core.py": 6}
+    assert model.cofailures == {
+        "pkg/settings.yaml": {"tests/test_config.py": 3},
+        "pkg/core.py": {"tests/test_b.py": 1},
+    }
+    assert model.test_runs["tests/test_a.py"] == 10
+    assert model.test_failures == {"tests/test_a.py": 0, "tests/test_b.py": 1, "tests/test_config.py": 3}
+
+
+def test_cofailing_tests(model):
+    assert model.cofailing_tests(["pkg/settings.yaml"]) == {"tests/test_config.py"}
+    # not enough co-failures
+    assert model.cofailing_tests(["pkg/core.py"]) == set()
+    assert model.cofailing_tests(["pkg/core.py"], min_rate=0.0) == set()
+    assert model.cofailing_tests(["pkg/unknown.py"]) == set()
+
+
+def test_risk(model):
+    assert model.risk("tests/test_a.py", ["pkg/core.py"]) == 0
+    assert model.risk("tests/test_b.py", ["pkg/core.py"]) == pytest.approx(1 / 6)
+    assert model.risk("tests/test_config.py", ["pkg/settings.yaml"]) == 0.75
+    # no history
+    assert model.risk("tests/test_new.py", ["pkg/core.py"]) == 1.0
+
+
+def test_save_and_load(model, tmp_path):
+    path = str(tmp_path / "history.json")
+    model.save(path)
+
+    loaded = CoFailureModel.load(path)
+
+    assert loaded.to_dict() == model.to_dict()
+    assert loaded.fingerprint() == model.fingerprint()
+    assert os.listdir(tmp_path) == ["history.json"]
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+
+def test_load_other_version(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text(f'{{"version": {pt_history.HISTORY_VERSION + 1}}}')
+
+    with pytest.raises(ValueError):
+        CoFailureModel.load(str(path))
+
+
+def test_apply_history(model, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tests").mkdir()
+    for name in ["test_a.py", "test_b.py", "test_config.py"]:
+        (tmp_path / "tests" / name).write_text("")
+    output_file = str(tmp_path / "test_files_to_run.txt")
+    metrics = Metrics()
+
+    files_to_test = pt.apply_history(
+        {"tests/test_a.py", "tests/test_b.py", "tests/test_new.py"},
+        [pt.File("pkg/core.py", "M"), pt.File("pkg/settings.yaml", "M")],
+        [pt.File("tests/test_a.py", "M")],
+        model,
+        0.05,
+        output_file,
+        metrics,
+    )
+
+    # test_a.py changed, test_new.py has no history, test_config.py is added
+    assert files_to_test == {"tests/test_a.py", "tests/test_b.py", "tests/test_new.py", "tests/test_config.py"}
+    assert metrics.counts["history_added"] == 1
+
+    files_to_test = pt.apply_history(
+        {"tests/test_a.py", "tests/test_b.py"}, [pt.File("pkg/core.py", "M")], [], model, 0.5, output_file, metrics
+    )
+
+    assert files_to_test == set()
+    with open(pt.deferred_output_file(output_file)) as f:
+        assert set(f.read().splitlines()) == {"tests/test_a.py", "tests/test_b.py"}
+    assert metrics.counts["history_deferred"] == 2
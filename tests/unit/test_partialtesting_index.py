@@ -0,0 +1,21 @@
+from partialtesting.partialtesting_index import postings_delta
+
+
+def test_postings_delta():
+    old_postings = {
+        "pkg/unchanged.py": {"test_a"},
+        "pkg/changed.py": {"test_a", "test_b"},
+        "pkg/removed.py": {"test_c"},
+    }
+    new_postings = {
+        "pkg/unchanged.py": {"test_a"},
+        "pkg/changed.py": {"test_b", "test_d"},
+        "pkg/added.py": {"test_d"},
+    }
+
+    assert postings_delta(old_postings, new_postings) == {
+        "pkg/changed.py": {"test_b", "test_d"},
+        "pkg/added.py": {"test_d"},
+        "pkg/removed.py": None,
+    }
+    assert postings_delta(new_postings, new_postings) == {}
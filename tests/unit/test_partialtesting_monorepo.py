@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_db import close_connections
+from partialtesting.partialtesting_monorepo import ProjectGraph, installed_top_level
+
+SOURCE_ROOTS = {"core": ["core/src"], "plugins": ["core/src/core_plugins/", "plugins"]}
+
+
+@pytest.fixture
+def downstream_db(tmp_path):
+    """
+    Coverage of a project with core installed in a virtualenv
+    """
+    db_path = str(tmp_path / ".coverage")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE file ( id integer primary key, path text, unique(path) )")
+    db.execute("CREATE TABLE context ( id integer primary key, context text, unique(context) )")
+    db.execute("CREATE TABLE arc ( file_id integer, context_id integer, fromno integer, tono integer )")
+    db.executemany(
+        "INSERT INTO file VALUES (?, ?)",
+        [
+            (1, "/ci/workspace/repo/app/src/app/main.py"),
+            (2, "/ci/venv/lib/python3.9/site-packages/core/utils.py"),
+        ],
+    )
+    db.executemany("INSERT INTO context VALUES (?, ?)", [(1, ""), (2, "tests.test_main.test_main")])
+    db.executemany("INSERT INTO arc VALUES (?, ?, 1, 2)", [(1, 2), (2, 2)])
+    db.commit()
+    db.close()
+    yield db_path
+    close_connections()
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        ("core/src/core/utils.py", ("core", "core/utils.py")),
+        ("core/src/core_plugins/csv.py", ("plugins", "csv.py")),
+        ("plugins/xml.py", ("plugins", "xml.py")),
+        ("core/setup.py", (None, None)),
+        ("app/src/app/main.py", (None, None)),
+    ],
+)
+def test_installed_path(path, expected):
+    assert ProjectGraph(SOURCE_ROOTS).installed_path(path) == expected
+
+
+def test_installed_top_level():
+    assert installed_top_level("core/sub/utils.py") == "core/"
+    assert installed_top_level("six.py") == "six.py"
+
+
+def test_upstream_changes():
+    graph = ProjectGraph(SOURCE_ROOTS)
+    changes = graph.upstream_changes(
+        [
+            pt.File("core/src/core/utils.py", "M"),
+            pt.File("core/src/core/old.py", "R100", "core/src/core/new.py"),
+            pt.File("app/src/app/main.py", "M"),
+        ]
+    )
+
+    assert set(changes) == {"core"}
+    assert [file.path for file in changes["core"]] == ["core/utils.py", "core/old.py"]
+    assert changes["core"][1].new_path == "core/new.py"
+    assert changes["core"][1].status == pt.FileStatus.RENAMED
+
+
+def test_upstream_projects_derived_from_coverage(downstream_db):
+    graph = ProjectGraph(SOURCE_ROOTS)
+    changes = graph.upstream_changes(
+        [pt.File("core/src/core/other.py", "M"), pt.File("plugins/xml.py", "M")]
+    )
+
+    # app's coverage recorded files of the installed core package, not of the plugins
+    assert graph.upstream_projects("app", downstream_db, changes) == {"core"}
+    # the project's own changes are looked up as usual
+    assert graph.upstream_projects("core", downstream_db, changes) == set()
+
+
+def test_upstream_projects_declared(downstream_db):
+    graph = ProjectGraph(SOURCE_ROOTS, {"app": ["plugins"]})
+    changes = graph.upstream_changes(
+        [pt.File("core/src/core/utils.py", "M"), pt.File("plugins/xml.py", "M")]
+    )
+
+    assert graph.upstream_projects("app", downstream_db, changes) == {"plugins"}
+
+
+def test_upstream_projects_declared_transitively(downstream_db):
+    graph = ProjectGraph(
+        dict(SOURCE_ROOTS, lib=["lib/src"]), {"app": ["lib"], "lib": ["core"], "core": ["app"]}
+    )
+    changes = graph.upstream_changes([pt.File("core/src/core/utils.py", "M")])
+
+    assert graph.declared_dependencies("app") == {"lib", "core"}
+    # app -> lib -> core: a change to core is looked up in app's coverage too
+    assert graph.upstream_projects("app", downstream_db, changes) == {"core"}
+
+
+def test_upstream_files_are_found_in_downstream_coverage(downstream_db):
+    graph = ProjectGraph(SOURCE_ROOTS)
+    changes = graph.upstream_changes([pt.File("core/src/core/utils.py", "M")])
+
+    files = graph.files_to_look_up("app", downstream_db, changes)
+
+    assert [file.path for file in files] == ["site-packages/core/utils.py", "dist-packages/core/utils.py"]
+    assert pt.get_tests_that_use_file(files[0].path, downstream_db) == ["tests.test_main.test_main"]
+    # the repository path alone misses it
+    assert pt.get_tests_that_use_file("core/src/core/utils.py", downstream_db) == []
+
+
+def test_load(tmp_path):
+    (tmp_path / ".partialtesting").write_text(
+        "[projects]\nCore = core/src\n\n[project_dependencies]\nMyApp = Core, plugins\n"
+    )
+
+    graph = ProjectGraph.load(str(tmp_path))
+
+    # project names keep their case
+    assert graph.source_roots == {"Core": ["core/src"]}
+    assert graph.dependencies == {"MyApp": {"Core", "plugins"}}
+    assert ProjectGraph.load(str(tmp_path / "missing")).source_roots == {}
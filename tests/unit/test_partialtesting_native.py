@@ -0,0 +1,92 @@
+import json
+import textwrap
+
+from partialtesting.partialtesting_native import (
+    imported_modules,
+    is_native_source,
+    load_native_manifest,
+    native_source_map,
+    native_sources_from_setup_py,
+)
+
+SETUP_PY = textwrap.dedent(
+    """
+    from setuptools import Extension, setup
+    from Cython.Build import cythonize
+
+    setup(
+        name="pkg",
+        ext_modules=[
+            Extension(
+                "pkg._fast",
+                ["src/fast.cpp", "src/fast_utils.cpp"],
+                depends=["src/fast.h"],
+            ),
+            Extension(name="pkg._computed", sources=get_sources()),
+        ]
+        + cythonize("pkg/*.pyx"),
+    )
+    """
+)
+
+
+def test_is_native_source():
+    assert is_native_source("src/fast.cpp") is True
+    assert is_native_source("pkg/_speedups.pyx") is True
+    assert is_native_source("pkg/fast.py") is False
+
+
+def test_native_sources_from_setup_py(tmp_path):
+    (tmp_path / "setup.py").write_text(SETUP_PY)
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "_speedups.pyx").write_text("")
+
+    assert native_sources_from_setup_py(str(tmp_path / "setup.py")) == {
+        f"{tmp_path}/src/fast.cpp": {"pkg._fast"},
+        f"{tmp_path}/src/fast_utils.cpp": {"pkg._fast"},
+        f"{tmp_path}/src/fast.h": {"pkg._fast"},
+        f"{tmp_path}/pkg/_speedups.pyx": {"pkg._speedups"},
+    }
+
+
+def test_native_source_map_merges_setup_py_and_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "setup.py").write_text(SETUP_PY)
+    (tmp_path / "manifest.json").write_text(
+        json.dumps({"src/fast.h": ["pkg._other"], "./src/gen.c": ["pkg._gen"]})
+    )
+
+    assert load_native_manifest("manifest.json") == {
+        "src/fast.h": {"pkg._other"},
+        "src/gen.c": {"pkg._gen"},
+    }
+    assert native_source_map("setup.py", "manifest.json") == {
+        "src/fast.cpp": {"pkg._fast"},
+        "src/fast_utils.cpp": {"pkg._fast"},
+        "src/fast.h": {"pkg._fast", "pkg._other"},
+        "src/gen.c": {"pkg._gen"},
+    }
+    assert native_source_map("missing_setup.py", "missing.json") == {}
+
+
+def test_imported_modules():
+    source = textwrap.dedent(
+        """
+        import numpy as np
+        import pkg._fast
+        from pkg import _speedups
+        from . import _gen
+        from ..core import helpers
+        """
+    )
+
+    assert imported_modules(source, "pkg/sub/module.py") == {
+        "numpy",
+        "pkg._fast",
+        "pkg",
+        "pkg._speedups",
+        "pkg.sub",
+        "pkg.sub._gen",
+        "pkg.core",
+        "pkg.core.helpers",
+    }
@@ -0,0 +1,30 @@
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_range import COMMIT_MARKER, parse_git_log_name_status
+
+
+def test_parse_git_log_name_status():
+    git_output = (
+        f"{COMMIT_MARKER}aaa\0\nM\0dir1/file1.py\0A\0tests/test_new.py\0"
+        f"{COMMIT_MARKER}bbb\0"  # no changes (e.g. an empty commit)
+        f"{COMMIT_MARKER}ccc\0\nR084\0tests/test_old.py\0tests/test_renamed.py\0D\0file with spaces.md\0"
+    )
+
+    commits = parse_git_log_name_status(git_output)
+
+    assert [commit for commit, _ in commits] == ["aaa", "bbb", "ccc"]
+    assert [(file.path, file.status) for file in commits[0][1]] == [
+        ("dir1/file1.py", pt.FileStatus.MODIFIED),
+        ("tests/test_new.py", pt.FileStatus.ADDED),
+    ]
+    assert commits[1][1] == []
+    renamed, deleted = commits[2][1]
+    assert (renamed.path, renamed.new_path, renamed.status) == (
+        "tests/test_old.py",
+        "tests/test_renamed.py",
+        pt.FileStatus.RENAMED,
+    )
+    assert deleted.path == "file with spaces.md"
+
+
+def test_parse_git_log_name_status_empty_range():
+    assert parse_git_log_name_status("") == []
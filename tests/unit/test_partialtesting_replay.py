@@ -0,0 +1,110 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting import partialtesting_replay as pt_replay
+from partialtesting.partialtesting_replay import build_at, evaluate_selection, read_junit_results, summarize
+from partialtesting.partialtesting_results import TestResult
+
+JUNIT_XML = """\
+<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="pytest" tests="3">
+    <testcase classname="tests.unit.test_partial_testing" name="test_a" time="1.5" />
+    <testcase classname="tests.unit.test_partial_testing" name="test_b" time="0.5">
+      <failure message="assert False" />
+    </testcase>
+    <testcase classname="tests.unit.test_other.TestClass" name="test_c" time="2" file="tests/unit/test_other.py">
+      <error message="fixture failed" />
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+RESULTS = [
+    TestResult("tests/unit/test_a.py", "test_a1", 30.0, False),
+    TestResult("tests/unit/test_a.py", "test_a2", 30.0, True),
+    TestResult("tests/unit/test_b.py", "test_b1", 60.0, True),
+]
+
+
+def test_read_junit_results(tmp_path):
+    junit_file = tmp_path / "junit.xml"
+    junit_file.write_text(JUNIT_XML)
+
+    assert read_junit_results(str(junit_file)) == [
+        # found on disk from the classname
+        TestResult("tests/unit/test_partial_testing.py", "test_a", 1.5, False),
+        TestResult("tests/unit/test_partial_testing.py", "test_b", 0.5, True),
+        TestResult("tests/unit/test_other.py", "test_c", 2.0, True),
+    ]
+
+
+def test_evaluate_selection():
+    evaluation = evaluate_selection({"tests/unit/test_a.py"}, RESULTS)
+
+    assert evaluation == {
+        "full_test": False,
+        "tests": 3,
+        "tests_selected": 2,
+        "tests_skipped": 1,
+        "cpu_minutes_saved": 1.0,
+        "failing_tests": 2,
+        "failing_tests_selected": 1,
+        "missed_failures": ["tests/unit/test_b.py::test_b1"],
+    }
+
+    full_test = evaluate_selection(None, RESULTS)
+    assert (full_test["tests_selected"], full_test["cpu_minutes_saved"]) == (3, 0)
+
+
+def test_summarize():
+    replays = [
+        dict(evaluate_selection({"tests/unit/test_a.py"}, RESULTS), selector_seconds=0.2),
+        dict(evaluate_selection(None, RESULTS), selector_seconds=0.1),
+        {"commit": "no_junit_results", "build": None},
+    ]
+
+    summary = summarize(replays)
+
+    assert summary["merges"] == 3
+    assert summary["merges_evaluated"] == 2
+    assert summary["full_tests"] == 1
+    assert summary["tests_skipped"] == 1
+    assert summary["cpu_minutes_saved"] == 1.0
+    assert summary["recall"] == 3 / 4
+    assert summary["selector_seconds_mean"] == pytest.approx(0.15)
+
+
+def test_build_at(tmp_path):
+    for build, mtime in (("1", 100), ("2", 200), ("3", 300)):
+        os.makedirs(tmp_path / build)
+        (tmp_path / build / ".coverage").write_text("")
+        os.utime(tmp_path / build, (mtime, mtime))
+    os.makedirs(tmp_path / "no_coverage")
+
+    assert build_at(str(tmp_path), 250) == "2"
+    assert build_at(str(tmp_path), 300) == "3"
+    assert build_at(str(tmp_path), 50) is None
+
+
+def test_train_cofailure_model(tmp_path):
+    (tmp_path / "sha1.xml").write_text(JUNIT_XML)
+    (tmp_path / "sha3.xml").write_text(JUNIT_XML)
+    changes = {
+        "sha1": [pt.File("settings.yaml", "M")],
+        "sha3": [pt.File("old.py", "R100", "new.py")],
+    }
+
+    with patch.object(
+        pt_replay, "git_merge_commits", return_value=[("sha3", 300), ("sha2", 200), ("sha1", 100)]
+    ), patch.object(pt_replay, "git_merged_changes", side_effect=changes.get) as mock_changes:
+        model = pt_replay.train_cofailure_model(str(tmp_path))
+
+    # sha2 has no JUnit results
+    assert [call[0][0] for call in mock_changes.call_args_list] == ["sha1", "sha3"]
+    assert model.runs == {"settings.yaml": 1, "old.py": 1, "new.py": 1}
+    assert model.cofailures["new.py"] == {"tests/unit/test_partial_testing.py": 1, "tests/unit/test_other.py": 1}
+    assert model.test_runs["tests/unit/test_partial_testing.py"] == 2
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_resources import ResourceRules, file_markers
+
+TEST_FILES = {
+    "tests/unit/test_core.py": "def test_core():\n    pass\n",
+    "tests/integration/test_api.py": (
+        "import pytest\n\n\n@pytest.mark.redis\n@pytest.mark.parametrize('x', [1])\ndef test_api(x):\n    pass\n"
+    ),
+    "tests/integration_db/test_models.py": "from pytest import mark\n\npytestmark = [mark.slow]\n",
+}
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for path, content in TEST_FILES.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(content)
+    (tmp_path / ".partialtesting").write_text(
+        "[resources]\npostgres = tests/integration_db/*\n\n[resource_markers]\nredis = redis, cache\n"
+    )
+    return tmp_path
+
+
+def test_file_markers(repo):
+    assert file_markers("tests/integration/test_api.py") == {"redis", "parametrize"}
+    assert file_markers("tests/integration_db/test_models.py") == {"slow"}
+    assert file_markers("tests/unit/test_deleted.py") == set()
+
+
+def test_load(repo):
+    resource_rules = ResourceRules.load(pt.TEST_STAGES)
+
+    assert resource_rules.resources() == ["postgres", "redis"]
+    assert resource_rules.stage_of("tests/integration_db/test_models.py") == "integration_db"
+    assert resource_rules.stage_of("tests/test_other.py") is None
+    assert resource_rules.resources_of("tests/integration_db/test_models.py") == {"postgres"}
+    assert resource_rules.resources_of("tests/integration/test_api.py") == {"redis"}
+    assert resource_rules.resources_of("tests/unit/test_core.py") == set()
+
+
+def test_manifest(repo):
+    manifest = ResourceRules.load(pt.TEST_STAGES).manifest(
+        {"tests/unit/test_core.py", "tests/integration/test_api.py"}
+    )
+
+    assert manifest == {
+        "full_test": False,
+        "stages": {
+            "unit": {"needed": True, "test_files": ["tests/unit/test_core.py"]},
+            "integration": {"needed": True, "test_files": ["tests/integration/test_api.py"]},
+            "integration_db": {"needed": False, "test_files": []},
+        },
+        "resources": {
+            "postgres": {"needed": False, "test_files": []},
+            "redis": {"needed": True, "test_files": ["tests/integration/test_api.py"]},
+        },
+    }
+
+
+def test_manifest_of_tests_without_a_stage(repo):
+    manifest = ResourceRules.load(pt.TEST_STAGES).manifest({"tests/test_other.py"})
+
+    # whichever stage runs it, it must not be skipped
+    assert manifest["stages"] == {
+        stage: {"needed": True, "test_files": ["tests/test_other.py"]} for stage in pt.TEST_STAGES
+    }
+
+
+@pytest.mark.parametrize("files_to_test,needed", [(None, True), (set(), False)])
+def test_write_manifest(repo, files_to_test, needed):
+    pt.write_manifest(files_to_test, "manifest.json")
+
+    with open("manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["full_test"] is (files_to_test is None)
+    assert {stage["needed"] for stage in manifest["stages"].values()} == {needed}
+    assert {resource["needed"] for resource in manifest["resources"].values()} == {needed}
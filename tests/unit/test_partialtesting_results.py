@@ -0,0 +1,180 @@
+import pytest
+
+from partialtesting import partialtesting_results as pt_results
+from partialtesting.partialtesting_db import close_connections
+from partialtesting.partialtesting_index import TestDefinitionIndex
+from partialtesting.partialtesting_results import Footprints, TestResult, TestResultCache
+
+CONTENT_HASHES = {
+    "pkg/core.py": "sha-core",
+    "pkg/utils.py": "sha-utils",
+    "tests/test_core.py": "sha-test-core",
+    "tests/test_utils.py": "sha-test-utils",
+    "requirements.txt": "sha-requirements",
+}
+
+DEFINITIONS = {
+    "test_core": {"tests/test_core.py"},
+    "test_utils": {"tests/test_utils.py"},
+    "helper": {"tests/test_utils.py"},
+}
+
+
+CORE = "/ci/workspace/repo/pkg/core.py"
+UTILS = "/ci/workspace/repo/pkg/utils.py"
+SIX = "/usr/lib/python3/site-packages/six.py"
+NEW = "/home/dev/repo/pkg/new.py"
+TEST_CORE = "tests.test_core.test_core"
+TEST_UTILS = "tests.test_utils.test_utils"
+
+
+@pytest.fixture
+def coverage_db(tmp_path, create_coverage_db):
+    yield create_coverage_db(
+        str(tmp_path / ".coverage"),
+        [(CORE, TEST_CORE), (UTILS, TEST_CORE), (SIX, TEST_CORE), (UTILS, TEST_UTILS)],
+    )
+    close_connections()
+
+
+def _footprints(coverage_db, changed_hashes=None):
+    content_hashes = dict(CONTENT_HASHES, **(changed_hashes or {}))
+    return Footprints(coverage_db, TestDefinitionIndex("tests", DEFINITIONS), content_hashes)
+
+
+def test_repo_path(coverage_db):
+    footprints = _footprints(coverage_db)
+
+    assert footprints.repo_path("/ci/workspace/repo/pkg/core.py") == "pkg/core.py"
+    assert footprints.repo_path("pkg/utils.py") == "pkg/utils.py"
+    assert footprints.repo_path("/usr/lib/python3/site-packages/six.py") is None
+
+
+def test_digests_depend_on_covered_files_only(coverage_db):
+    digests = _footprints(coverage_db).digests({"tests/test_core.py", "tests/test_utils.py"})
+
+    assert set(digests["tests/test_core.py"]) == {"tests.test_core.test_core"}
+    assert set(digests["tests/test_utils.py"]) == {"tests.test_utils.test_utils"}
+
+    # test_utils does not cover pkg/core.py
+    changed = _footprints(coverage_db, {"pkg/core.py": "sha-core-2"}).digests(
+        {"tests/test_core.py", "tests/test_utils.py"}
+    )
+    assert changed["tests/test_core.py"] != digests["tests/test_core.py"]
+    assert changed["tests/test_utils.py"] == digests["tests/test_utils.py"]
+
+    # the test file itself and the environment are part of every footprint
+    changed = _footprints(coverage_db, {"tests/test_utils.py": "sha-2"}).digests({"tests/test_utils.py"})
+    assert changed["tests/test_utils.py"] != digests["tests/test_utils.py"]
+
+    content_hashes = dict(CONTENT_HASHES, **{"requirements.txt": "sha-requirements-2"})
+    assert pt_results.environment_fingerprint(content_hashes) != pt_results.environment_fingerprint(
+        CONTENT_HASHES
+    )
+
+
+def test_digests_of_tests_not_in_coverage(coverage_db):
+    definitions = dict(DEFINITIONS, test_new={"tests/test_core.py"})
+    footprints = Footprints(
+        coverage_db, TestDefinitionIndex("tests", definitions), dict(CONTENT_HASHES)
+    )
+
+    # test_new has no coverage yet, test_core.py has to run
+    assert footprints.digests({"tests/test_core.py"}) == {"tests/test_core.py": None}
+
+
+def test_record_and_drop_cached_passes(coverage_db, tmp_path):
+    footprints = _footprints(coverage_db)
+    cache = TestResultCache(str(tmp_path / "passes"))
+    results = [
+        TestResult("tests/test_core.py", "test_core[1]", 1.0, False),
+        TestResult("tests/test_core.py", "test_core[2]", 1.0, True),
+        TestResult("tests/test_utils.py", "test_utils", 1.0, False),
+    ]
+
+    assert pt_results.record_passes(results, footprints, cache, footprints) == 1
+    assert pt_results.drop_cached_passes(
+        {"tests/test_core.py", "tests/test_utils.py"}, footprints, cache
+    ) == {"tests/test_core.py"}
+
+    # pkg/utils.py changed since the pass was recorded
+    changed = _footprints(coverage_db, {"pkg/utils.py": "sha-utils-2"})
+    assert pt_results.drop_cached_passes(
+        {"tests/test_core.py", "tests/test_utils.py"}, changed, cache
+    ) == {"tests/test_core.py", "tests/test_utils.py"}
+
+
+def test_record_passes_with_the_files_covered_by_the_run(coverage_db, tmp_path, create_coverage_db):
+    """
+    The change made pkg/core.py import pkg/new.py: the coverage build the selection
+    is made with does not know about it, the coverage of the run that passed does
+    """
+    run_coverage_db = create_coverage_db(str(tmp_path / "run.coverage"), [(CORE, TEST_CORE), (NEW, TEST_CORE)])
+    content_hashes = dict(CONTENT_HASHES, **{"pkg/new.py": "sha-new"})
+    test_index = TestDefinitionIndex("tests", DEFINITIONS)
+    cache = TestResultCache(str(tmp_path / "passes"))
+    results = [TestResult("tests/test_core.py", "test_core", 1.0, False)]
+
+    recorded = pt_results.record_passes(
+        results,
+        Footprints(coverage_db, test_index, content_hashes),
+        cache,
+        Footprints(run_coverage_db, test_index, content_hashes),
+    )
+
+    assert recorded == 1
+    footprints = Footprints(coverage_db, test_index, content_hashes)
+    assert pt_results.drop_cached_passes({"tests/test_core.py"}, footprints, cache) == set()
+
+    # a later commit only changes pkg/new.py, the digest is the same but the pass no longer holds
+    footprints = Footprints(coverage_db, test_index, dict(content_hashes, **{"pkg/new.py": "sha-new-2"}))
+    assert pt_results.drop_cached_passes({"tests/test_core.py"}, footprints, cache) == {"tests/test_core.py"}
+
+
+def test_record_passes_not_in_the_run_coverage(coverage_db, tmp_path, create_coverage_db):
+    run_coverage_db = create_coverage_db(str(tmp_path / "run.coverage"), [(CORE, "")])
+    cache = TestResultCache(str(tmp_path / "passes"))
+    results = [TestResult("tests/test_core.py", "test_core", 1.0, False)]
+
+    # the run was not recorded with test contexts: what test_core covered is unknown
+    assert pt_results.record_passes(results, _footprints(coverage_db), cache, _footprints(run_coverage_db)) == 0
+
+
+@pytest.mark.parametrize(
+    "context,expected",
+    [
+        ("tests/test_core.py::test_core|run", "tests.test_core.test_core"),
+        ("tests/test_core.py::TestCore::test_core[a|b-1]|setup", "tests.test_core.TestCore.test_core"),
+        ("tests.test_core.test_core", "tests.test_core.test_core"),
+    ],
+)
+def test_normalize_context(context, expected):
+    assert pt_results.normalize_context(context) == expected
+
+
+def test_record_passes_of_a_pytest_cov_run(coverage_db, tmp_path, create_coverage_db):
+    """
+    pytest --cov-context=test records one context per phase of each test
+    """
+    run_coverage_db = create_coverage_db(
+        str(tmp_path / "run.coverage"),
+        [(CORE, "tests/test_core.py::test_core|run"), (NEW, "tests/test_core.py::test_core|setup")],
+    )
+    content_hashes = dict(CONTENT_HASHES, **{"pkg/new.py": "sha-new"})
+    test_index = TestDefinitionIndex("tests", DEFINITIONS)
+    cache = TestResultCache(str(tmp_path / "passes"))
+    results = [TestResult("tests/test_core.py", "test_core", 1.0, False)]
+
+    recorded = pt_results.record_passes(
+        results,
+        Footprints(coverage_db, test_index, content_hashes),
+        cache,
+        Footprints(run_coverage_db, test_index, content_hashes),
+    )
+
+    assert recorded == 1
+    footprints = Footprints(coverage_db, test_index, content_hashes)
+    assert pt_results.drop_cached_passes({"tests/test_core.py"}, footprints, cache) == set()
+    # the file covered in the setup phase is part of the record
+    footprints = Footprints(coverage_db, test_index, dict(content_hashes, **{"pkg/new.py": "sha-new-2"}))
+    assert pt_results.drop_cached_passes({"tests/test_core.py"}, footprints, cache) == {"tests/test_core.py"}
@@ -0,0 +1,136 @@
+import pytest
+
+from partialtesting import partialtesting as pt
+from partialtesting.partialtesting_rules import (
+    FileClass,
+    Rules,
+    load_rules,
+    read_rules_config,
+    tomllib,
+)
+
+
+@pytest.fixture
+def default_rules():
+    return Rules.from_defaults(pt.SPECIAL_FILES_DEFAULT, pt.SPECIAL_EXTENSIONS_DEFAULT)
+
+
+@pytest.mark.parametrize(
+    "path,file_class",
+    [
+        ("dir1/dir2/nontestfile1.py", FileClass.CODE),
+        ("tests/unit/test_unit1.py", FileClass.CODE),
+        ("setup.py", FileClass.SPECIAL),
+        ("setup_ts2.py", FileClass.SPECIAL),
+        # special files match their exact path only
+        ("dir1/setup.py", FileClass.CODE),
+        ("tests/conftest.py", FileClass.SPECIAL),
+        ("dir2/pickles/fake_pickle.pkl", FileClass.SPECIAL),
+        ("README.md", FileClass.NO_TESTS),
+        ("docs/index.rst", FileClass.NO_TESTS),
+        ("security_master/equity_asia1.out.gz.enc.20180827", FileClass.UNKNOWN),
+        ("Makefile", FileClass.UNKNOWN),
+    ],
+)
+def test_default_rules_match_the_special_files_and_extensions(default_rules, path, file_class):
+    assert default_rules.classify(path) == file_class
+
+
+def test_default_test_roots(default_rules):
+    assert default_rules.is_test_file("tests/unit/test_unit1.py") is True
+    assert default_rules.is_test_file("dir1/tests/test_unit1.py") is False
+    assert default_rules.is_test_file("tests_data.py") is False
+    assert default_rules.test_dirs() == ["tests"]
+
+
+def test_special_patterns_take_precedence():
+    rules = Rules(special=["docs/conf.py"], code=["*.py"], no_tests=["docs/*"])
+
+    assert rules.classify("docs/conf.py") == FileClass.SPECIAL
+    assert rules.classify("docs/api.py") == FileClass.CODE
+    assert rules.classify("docs/api.md") == FileClass.NO_TESTS
+
+
+def test_test_roots_and_test_dirs():
+    rules = Rules(test_roots=["tests/*", "src/*/tests/*"])
+
+    assert rules.is_test_file("src/pkg/tests/test_a.py") is True
+    assert rules.is_test_file("src/pkg/a.py") is False
+    assert rules.test_dirs() == ["src", "tests"]
+
+
+def test_read_rules_config_from_rules_file(tmp_path):
+    (tmp_path / ".partialtesting").write_text(
+        "[rules]\n"
+        "special = docker/*, *.lock\n"
+        "no_tests =\n"
+        "    docs/*\n"
+        "    *.md\n"
+        "dependency_files = projects/*/setup.py\n"
+    )
+
+    assert read_rules_config(str(tmp_path)) == {
+        "special": ["docker/*", "*.lock"],
+        "no_tests": ["docs/*", "*.md"],
+        "dependency_files": ["projects/*/setup.py"],
+    }
+
+
+def test_read_rules_config_unknown_rule(tmp_path):
+    (tmp_path / ".partialtesting").write_text("[rules]\nspecial_files = setup.py\n")
+
+    with pytest.raises(ValueError):
+        read_rules_config(str(tmp_path))
+
+
+def test_read_rules_config_without_rules(tmp_path):
+    assert read_rules_config(str(tmp_path)) == {}
+
+    (tmp_path / "pyproject.toml").write_text("[tool.black]\nline-length = 100\n")
+    assert read_rules_config(str(tmp_path)) == {}
+
+
+@pytest.mark.skipif(tomllib is None, reason="tomllib/tomli is not available")
+def test_load_rules_from_pyproject(tmp_path):
+    (tmp_path / "pyproject.toml").write_text(
+        "[tool.partialtesting.rules]\n"
+        'special = ["docker/*"]\n'
+        'code = ["*.py", "*.pyx"]\n'
+        'test_roots = ["src/*/tests/*"]\n'
+    )
+
+    rules = load_rules(pt.SPECIAL_FILES_DEFAULT, pt.SPECIAL_EXTENSIONS_DEFAULT, str(tmp_path))
+
+    # the project's special patterns are added to the special files/extensions
+    assert rules.classify("docker/Dockerfile") == FileClass.SPECIAL
+    assert rules.classify("setup.py") == FileClass.SPECIAL
+    assert rules.classify("tests/conftest.py") == FileClass.SPECIAL
+    assert rules.classify("pkg/fast.pyx") == FileClass.CODE
+    # the other classes replace the defaults
+    assert rules.is_test_file("src/pkg/tests/test_a.py") is True
+    assert rules.is_test_file("tests/test_a.py") is False
+
+
+def test_full_test_required_with_rules():
+    rules = Rules.from_defaults(
+        pt.SPECIAL_FILES_DEFAULT,
+        pt.SPECIAL_EXTENSIONS_DEFAULT,
+        code=["*.py", "*.pyx"],
+        no_tests=["*.md", "docs/*"],
+    )
+
+    def full_test_required(nontest_files, test_files=()):
+        return pt.full_test_required(
+            nontest_files,
+            list(test_files),
+            pt.SPECIAL_FILES_DEFAULT,
+            pt.SPECIAL_EXTENSIONS_DEFAULT,
+            rules,
+        )
+
+    assert full_test_required([pt.File("pkg/fast.pyx", "M")]) is False
+    assert full_test_required([pt.File("pkg/fast.pyx", "A")]) is True
+    assert full_test_required([pt.File("docs/diagram.svg", "A")]) is False
+    assert full_test_required([pt.File("Makefile", "M")]) is True
+    assert full_test_required([], [pt.File("tests/test_new.py", "A")]) is False
+    assert full_test_required([], [pt.File("tests/conftest.py", "M")]) is True